@@ -0,0 +1,287 @@
+"""
+Adaptive coarse-to-fine resonance search, as a cheaper alternative to the
+full (amplitude x frequency) Larmor sweep.
+
+    1. coarse   one amplitude (search_amp), frequencies every coarse_step
+                over the span; candidates are points that stand out from a
+                running-median baseline by more than z_min robust sigmas
+    2. refine   dense points around each candidate, then a Lorentzian on a
+                linear baseline is fitted; the most significant one wins
+    3. converge new points where the line is most sensitive to f0
+                (f0 +- fwhm / (2 sqrt 3)) until the fitted sigma(f0) is below
+                f0_tol or the shot budget is spent
+    4. profile  every amp_levels amplitude at a few frequencies around f0
+                and across the span
+
+The result saves in the sweep layout (energy_map, freq_axis, amp_axis) on
+the irregular set of measured frequencies. Cells that were not measured
+are interpolated along frequency within their amplitude row; `measured`
+marks the real ones, and the fitted line is stored with them.
+
+    search = AdaptiveSearch(SimInstrument(), f_center=2.5e6, f_span=4e6,
+                            amp_levels=np.linspace(0.1, 2.0, 20))
+    result = search.run()
+    result.save("data/h2_tube_4_adaptive.npz")
+"""
+
+import time
+
+import numpy as np
+from scipy.ndimage import median_filter
+from scipy.optimize import curve_fit
+
+from nmrkit.instrument import lorentzian
+from nmrkit.sweep import SweepStats, rx_energy, save_npz
+
+
+def line_model(f, f0, fwhm, depth, b0, b1):
+    """Linear baseline plus a Lorentzian of signed height `depth` (negative = dip)."""
+    return b0 + b1 * (f - f0) + depth * lorentzian(f, f0, fwhm)
+
+
+def fit_line(freqs, energies, f0, fwhm, window=6.0):
+    """
+    Fit line_model to the points within window*fwhm of f0. Returns
+    (params, sigmas) with sigmas from the covariance scaled by the residual
+    variance, or None if the fit fails.
+    """
+    freqs = np.asarray(freqs, float)
+    energies = np.asarray(energies, float)
+    sel = np.abs(freqs - f0) <= window * fwhm
+    if sel.sum() < 8:
+        return None
+    f, e = freqs[sel], energies[sel]
+    base = np.median(e)
+    depth = e[np.argmin(np.abs(f - f0))] - base
+    p0 = (f0, fwhm, depth, base, 0.0)
+    lo = (f0 - window * fwhm, fwhm / 20, -np.inf, -np.inf, -np.inf)
+    hi = (f0 + window * fwhm, fwhm * 20, np.inf, np.inf, np.inf)
+    try:
+        p, cov = curve_fit(line_model, f, e, p0=p0, bounds=(lo, hi), maxfev=5000)
+    except (RuntimeError, ValueError):
+        return None
+    sig = np.sqrt(np.clip(np.diag(cov), 0, None))
+    if not np.all(np.isfinite(sig)):
+        return None
+    return p, sig
+
+
+class SearchResult:
+    """Measured points plus the fitted line; see to_grid() / save()."""
+
+    def __init__(self, freqs, amps, energies, fit, stats, history):
+        self.freqs = np.asarray(freqs)
+        self.amps = np.asarray(amps)
+        self.energies = np.asarray(energies)
+        self.fit = fit  # {"f0", "fwhm", "depth", "f0_sigma", ...} or None
+        self.stats = stats
+        self.history = history  # (shots, f0, f0_sigma) per convergence step
+
+    @property
+    def f0(self):
+        return None if self.fit is None else self.fit["f0"]
+
+    def to_grid(self):
+        """
+        (energy_map, freq_axis, amp_axis, measured) on the measured
+        frequencies x amplitudes; gaps are interpolated along frequency
+        within each amplitude row (repeated points are averaged).
+        """
+        freq_axis = np.unique(self.freqs)
+        amp_axis = np.unique(self.amps)
+        fi = np.searchsorted(freq_axis, self.freqs)
+        ai = np.searchsorted(amp_axis, self.amps)
+        total = np.zeros((len(amp_axis), len(freq_axis)))
+        count = np.zeros_like(total)
+        np.add.at(total, (ai, fi), self.energies)
+        np.add.at(count, (ai, fi), 1)
+        measured = count > 0
+        energy_map = np.divide(total, count, out=np.zeros_like(total), where=measured)
+        for row in range(len(amp_axis)):
+            m = measured[row]
+            if m.any() and not m.all():
+                energy_map[row, ~m] = np.interp(
+                    freq_axis[~m], freq_axis[m], energy_map[row, m]
+                )
+        return energy_map, freq_axis, amp_axis, measured
+
+    def save(self, path):
+        energy_map, freq_axis, amp_axis, measured = self.to_grid()
+        fit = self.fit or {}
+        save_npz(
+            path,
+            energy_map=energy_map,
+            freq_axis=freq_axis,
+            amp_axis=amp_axis,
+            measured=measured,
+            points_freq=self.freqs,
+            points_amp=self.amps,
+            points_energy=self.energies,
+            **{"fit_" + k: v for k, v in fit.items()},
+        )
+
+
+class AdaptiveSearch:
+    """
+    instrument: see nmrkit.instrument. min_fwhm is the narrowest line the
+    coarse grid must not step over (coarse_step defaults to it).
+    """
+
+    def __init__(self, instrument, f_center, f_span, amp_levels, search_amp=None,
+                 fs=10e6, record_s=500e-6, settle_s=0.001, min_fwhm=4e3,
+                 coarse_step=None, z_min=5.0, n_candidates=3, f0_tol=50.0,
+                 batch=6, max_shots=5000, profile_freqs=9, analyse=rx_energy):
+        self.instrument = instrument
+        self.f_center = f_center
+        self.f_span = f_span
+        self.amp_levels = np.asarray(amp_levels, float)
+        self.search_amp = float(self.amp_levels.max() if search_amp is None else search_amp)
+        self.fs = fs
+        self.record_s = record_s
+        self.settle_s = settle_s
+        self.min_fwhm = min_fwhm
+        self.coarse_step = coarse_step or min_fwhm
+        self.z_min = z_min
+        self.n_candidates = n_candidates
+        self.f0_tol = f0_tol
+        self.batch = batch
+        self.max_shots = max_shots
+        self.profile_freqs = profile_freqs
+        self.analyse = analyse
+
+        self.stats = SweepStats()
+        self._f, self._a, self._e = [], [], []
+
+    # ------------------------------------------------------------------
+    # acquisition
+    # ------------------------------------------------------------------
+
+    def measure(self, freqs, amp):
+        """Shoot each frequency at one amplitude; returns the energies."""
+        inst = self.instrument
+        sec = self.stats.seconds
+        out = np.empty(len(freqs))
+        for k, f in enumerate(freqs):
+            t0 = time.perf_counter()
+            inst.tune(f, amp)
+            t1 = time.perf_counter()
+            if self.settle_s:
+                time.sleep(self.settle_s)
+            t2 = time.perf_counter()
+            data = inst.record()
+            t3 = time.perf_counter()
+            out[k] = self.analyse(data)
+            sec["tune"] += t1 - t0
+            sec["settle"] += t2 - t1
+            sec["record"] += t3 - t2
+            sec["analysis"] += time.perf_counter() - t3
+        self._f.extend(freqs)
+        self._a.extend([amp] * len(freqs))
+        self._e.extend(out)
+        self.stats.shots += len(freqs)
+        return out
+
+    def _search_points(self):
+        f = np.asarray(self._f)
+        sel = np.asarray(self._a) == self.search_amp
+        return f[sel], np.asarray(self._e)[sel]
+
+    def _budget(self):
+        return self.max_shots - self.stats.shots
+
+    # ------------------------------------------------------------------
+    # stages
+    # ------------------------------------------------------------------
+
+    def coarse(self):
+        """Coarse grid; returns candidate frequencies, strongest first."""
+        lo = self.f_center - self.f_span / 2
+        n = int(round(self.f_span / self.coarse_step)) + 1
+        freqs = np.linspace(lo, lo + self.f_span, n)
+        e = self.measure(freqs, self.search_amp)
+
+        base = median_filter(e, size=15, mode="nearest")
+        resid = e - base
+        mad = np.median(np.abs(resid - np.median(resid))) * 1.4826
+        z = np.abs(resid) / (mad if mad > 0 else 1.0)
+        order = np.argsort(z)[::-1]
+        candidates = []
+        for i in order:
+            if z[i] < self.z_min or len(candidates) == self.n_candidates:
+                break
+            if all(abs(freqs[i] - c) > 4 * self.coarse_step for c in candidates):
+                candidates.append(freqs[i])
+        return candidates
+
+    def refine(self, candidates):
+        """Dense points around each candidate; returns the best fit (params, sigmas) or None."""
+        best = None
+        for c in candidates:
+            half = 4 * self.coarse_step
+            n = min(self._budget(), 33)
+            if n <= 0:
+                break
+            self.measure(np.linspace(c - half, c + half, n), self.search_amp)
+            f, e = self._search_points()
+            res = fit_line(f, e, c, max(self.min_fwhm, self.coarse_step))
+            if res is None:
+                continue
+            p, sig = res
+            significance = abs(p[2]) / sig[2] if sig[2] > 0 else 0.0
+            if best is None or significance > best[2]:
+                best = (p, sig, significance)
+        return None if best is None else best[:2]
+
+    def converge(self, p, sig, history):
+        """Shoot where the line is most sensitive to f0 until sigma(f0) < f0_tol."""
+        while sig[0] > self.f0_tol and self._budget() > 0:
+            f0, fwhm = p[0], p[1]
+            d = fwhm / (2 * np.sqrt(3))
+            offsets = np.array([-d, d, -fwhm, fwhm, -3 * fwhm, 3 * fwhm])
+            freqs = f0 + np.resize(offsets, min(self.batch, self._budget()))
+            self.measure(freqs, self.search_amp)
+            f, e = self._search_points()
+            res = fit_line(f, e, f0, fwhm)
+            if res is None:
+                break
+            p, sig = res
+            history.append((self.stats.shots, p[0], sig[0]))
+        return p, sig
+
+    def profile(self, f0, fwhm):
+        """All amplitude levels at frequencies around f0 and across the span."""
+        lo = self.f_center - self.f_span / 2
+        freqs = np.linspace(lo, lo + self.f_span, self.profile_freqs)
+        if f0 is not None:
+            near = f0 + fwhm * np.array([-10.0, -3.0, -1.0, -0.5, 0.0, 0.5, 1.0, 3.0, 10.0])
+            freqs = np.concatenate((freqs, near))
+        for amp in self.amp_levels:
+            if self._budget() < len(freqs):
+                break
+            self.measure(freqs, amp)
+
+    # ------------------------------------------------------------------
+    # run
+    # ------------------------------------------------------------------
+
+    def run(self):
+        self.instrument.configure(self.fs, self.record_s, float(self.amp_levels.max()))
+        self.stats.started = time.perf_counter()
+        history = []
+        fit = None
+        candidates = self.coarse()
+        res = self.refine(candidates) if candidates else None
+        if res is not None:
+            p, sig = res
+            history.append((self.stats.shots, p[0], sig[0]))
+            p, sig = self.converge(p, sig, history)
+            fit = {
+                "f0": p[0], "fwhm": p[1], "depth": p[2],
+                "f0_sigma": sig[0], "fwhm_sigma": sig[1], "depth_sigma": sig[2],
+                "converged": sig[0] <= self.f0_tol,
+            }
+            self.profile(p[0], p[1])
+        else:
+            self.profile(None, None)
+        self.stats.elapsed = time.perf_counter() - self.stats.started
+        return SearchResult(self._f, self._a, self._e, fit, self.stats, history)
@@ -0,0 +1,273 @@
+"""
+Single-record frequency sweeps: one acquisition per amplitude instead of
+one per (frequency, amplitude) shot.
+
+    chirp      the wavegen sweeps f_start -> f_stop linearly every chirp_s
+               (FM ramp); one period is recorded, aligned to the sweep
+               start by a circular matched filter, dechirped and averaged
+               over n_bins segments: bin k holds the energy of the
+               component that follows the sweep through bin k's band.
+    multitone  a custom buffer holding every tone k * buffer_hz in the
+               band (Schroeder phases, low crest factor) is replayed; a
+               record of whole buffer periods gives each tone's energy
+               straight from its FFT bin.
+
+Energies are mean squares (V^2) of the drive-following component, scaled
+to a single tone at the full amplitude, so maps compare with the stepped
+sweep (whose energies also hold the noise power). A chirp only reproduces
+a line of width fwhm if it sweeps slower than about fwhm**2 Hz/s; see
+min_chirp_s(). Multitone has no such limit; its resolution is buffer_hz.
+
+    python -m nmrkit.chirp run data/h2_tube_4_chirp.npz --mode multitone
+    python -m nmrkit.chirp compare data/h2_tube_3.npz data/h2_tube_4_chirp.npz
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from nmrkit.sweep import SweepStats, save_npz
+
+
+def min_chirp_s(f_span, fwhm, factor=4.0):
+    """Shortest sweep period that still resolves a line of width fwhm."""
+    return factor * f_span / fwhm**2
+
+
+def chirp_phase(n, fs, f_start, f_stop):
+    """Phase (rad) of a linear sweep over n samples, starting at t = 0."""
+    t = np.arange(n) / fs
+    rate = (f_stop - f_start) * fs / n
+    return 2 * np.pi * (f_start * t + 0.5 * rate * t * t)
+
+
+def align_chirp(x, ref):
+    """
+    Sample offset of the sweep start in a record of exactly one period
+    (circular cross-correlation with the complex reference, by FFT).
+    """
+    c = np.fft.ifft(np.fft.fft(x) * np.conj(np.fft.fft(ref)))
+    return int(np.argmax(np.abs(c)))
+
+
+def chirp_energy(x, fs, f_start, f_stop, n_bins):
+    """
+    (bin_freqs, energies) from one sweep period x. The record is rolled to
+    start at the sweep start, multiplied by the conjugate sweep and the
+    result averaged per segment: 2 |mean|^2 is the mean square of the
+    component following the sweep.
+    """
+    n = len(x) - len(x) % n_bins
+    x = np.asarray(x[:n], dtype=np.float32)
+    ref = np.exp(1j * chirp_phase(n, fs, f_start, f_stop)).astype(np.complex64)
+    lag = align_chirp(x, ref)
+    z = np.roll(x, -lag) * np.conj(ref)
+    m = z.reshape(n_bins, -1).mean(axis=1)
+    edges = np.linspace(f_start, f_stop, n_bins + 1)
+    return (edges[:-1] + edges[1:]) / 2, 2.0 * np.abs(m) ** 2
+
+
+def multitone_buffer(f_start, f_stop, n_samples=4096, awg_rate=10e6):
+    """
+    One period of a comb of tones k * buffer_hz within [f_start, f_stop],
+    buffer_hz = awg_rate / n_samples, normalised to +-1. Returns
+    (samples, buffer_hz, tone_freqs, tone_amp) with tone_amp the amplitude
+    of each tone relative to the buffer peak.
+    """
+    buffer_hz = awg_rate / n_samples
+    k = np.arange(int(np.ceil(f_start / buffer_hz)), int(f_stop // buffer_hz) + 1)
+    if len(k) == 0 or k[-1] >= n_samples // 2:
+        raise ValueError("band is empty or above the AWG Nyquist rate")
+    spec = np.zeros(n_samples // 2 + 1, dtype=complex)
+    idx = np.arange(len(k))
+    spec[k] = np.exp(-1j * np.pi * idx * idx / len(k))  # Schroeder phases
+    samples = np.fft.irfft(spec, n_samples)
+    tone_amp = 2.0 / n_samples  # |spec[k]| = 1 -> cosine amplitude 2/n
+    peak = np.abs(samples).max()
+    return samples / peak, buffer_hz, k * buffer_hz, tone_amp / peak
+
+
+def multitone_energy(x, fs, tone_freqs):
+    """Mean square of each tone from a record of whole buffer periods."""
+    n = len(x)
+    spec = np.fft.rfft(np.asarray(x, dtype=np.float32))
+    bins = np.rint(np.asarray(tone_freqs) * n / fs).astype(int)
+    return 2.0 * np.abs(spec[bins]) ** 2 / n**2
+
+
+class ChirpSweep:
+    """
+    Energy map over amp_axis x frequency with one record per amplitude.
+    instrument needs play_chirp / play_buffer (see nmrkit.instrument).
+    chirp_s defaults to min_chirp_s() for the span and fwhm, the narrowest
+    line to resolve.
+    """
+
+    def __init__(self, instrument, f_start, f_stop, amp_axis, mode="chirp", fs=10e6,
+                 chirp_s=None, fwhm=5e3, n_bins=500, periods=4, n_samples=4096,
+                 settle_s=0.01):
+        if mode not in ("chirp", "multitone"):
+            raise ValueError("mode is 'chirp' or 'multitone'")
+        self.instrument = instrument
+        self.f_start = f_start
+        self.f_stop = f_stop
+        self.amp_axis = np.asarray(amp_axis, dtype=float)
+        self.mode = mode
+        self.fs = fs
+        self.chirp_s = min_chirp_s(abs(f_stop - f_start), fwhm) if chirp_s is None else chirp_s
+        self.n_bins = n_bins
+        self.periods = periods  # multitone: buffer periods per record
+        self.n_samples = n_samples
+        self.settle_s = settle_s
+        self.stats = SweepStats()
+
+    def run(self):
+        """Returns (energy_map, freq_axis, amp_axis)."""
+        inst = self.instrument
+        sec = self.stats.seconds
+        if self.mode == "chirp":
+            record_s = self.chirp_s
+        else:
+            buf, buffer_hz, tones, tone_amp = multitone_buffer(
+                self.f_start, self.f_stop, self.n_samples, awg_rate=self.fs
+            )
+            record_s = self.periods / buffer_hz
+        inst.configure(self.fs, record_s, float(self.amp_axis.max()))
+
+        rows = []
+        self.stats.started = time.perf_counter()
+        for amp in self.amp_axis:
+            t0 = time.perf_counter()
+            if self.mode == "chirp":
+                inst.play_chirp(self.f_start, self.f_stop, self.chirp_s, amp)
+            else:
+                inst.play_buffer(buf, buffer_hz, amp)
+            t1 = time.perf_counter()
+            time.sleep(self.settle_s)
+            t2 = time.perf_counter()
+            x = inst.record()
+            t3 = time.perf_counter()
+            if self.mode == "chirp":
+                freq_axis, e = chirp_energy(x, self.fs, self.f_start, self.f_stop, self.n_bins)
+            else:
+                freq_axis, e = tones, multitone_energy(x, self.fs, tones) / tone_amp**2
+            rows.append(e)
+            sec["tune"] += t1 - t0
+            sec["settle"] += t2 - t1
+            sec["record"] += t3 - t2
+            sec["analysis"] += time.perf_counter() - t3
+            self.stats.shots += 1
+        self.stats.elapsed = time.perf_counter() - self.stats.started
+        return np.array(rows), np.asarray(freq_axis), self.amp_axis
+
+
+# ====================================
+# COMPARISON WITH STEPPED SWEEPS
+# ====================================
+
+
+def _profile_f0(energy_map, freq_axis, smooth=15):
+    """Frequency of the strongest dip below a running-median baseline."""
+    from scipy.ndimage import median_filter
+
+    p = energy_map.mean(axis=0)
+    resid = p - median_filter(p, size=min(smooth, len(p)), mode="nearest")
+    return float(freq_axis[np.argmin(resid)])
+
+
+def compare_maps(ref, test):
+    """
+    Compare two sweep npz files (or dicts) on their common frequency range:
+    test is interpolated onto ref's frequencies at ref's amplitudes, each
+    amplitude row is scaled to unit mean (drive levels differ between
+    modes), and the rows are compared.
+    """
+    f_r, a_r, e_r = ref["freq_axis"], ref["amp_axis"], ref["energy_map"]
+    f_t, a_t, e_t = test["freq_axis"], test["amp_axis"], test["energy_map"]
+    sel = (f_r >= f_t.min()) & (f_r <= f_t.max())
+    amps = a_r[(a_r >= a_t.min()) & (a_r <= a_t.max())]
+    if not sel.any() or not len(amps):
+        raise ValueError("maps do not overlap")
+    f = f_r[sel]
+
+    # bilinear: along frequency per test row, then along amplitude
+    rows = np.array([np.interp(f, f_t, row) for row in e_t])
+    test_on_ref = np.array([
+        [np.interp(a, a_t, rows[:, j]) for j in range(len(f))] for a in amps
+    ])
+    ref_on_ref = e_r[np.isin(a_r, amps)][:, sel]
+
+    def norm(m):
+        return m / m.mean(axis=1, keepdims=True)
+
+    r, t = norm(ref_on_ref), norm(test_on_ref)
+    corr = np.array([np.corrcoef(r[i], t[i])[0, 1] for i in range(len(amps))])
+    return {
+        "n_freq": int(sel.sum()),
+        "n_amp": len(amps),
+        "row_corr_median": float(np.median(corr)),
+        "row_corr_min": float(corr.min()),
+        "nrmse": float(np.sqrt(np.mean((r - t) ** 2))),
+        "f0_ref": _profile_f0(ref_on_ref, f),
+        "f0_test": _profile_f0(test_on_ref, f),
+    }
+
+
+def main():
+    from nmrkit.instrument import DwfInstrument, SimInstrument
+
+    ap = argparse.ArgumentParser(description="Chirp / multitone single-record sweeps")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("run", help="acquire a map")
+    p.add_argument("out")
+    p.add_argument("--mode", choices=("chirp", "multitone"), default="chirp")
+    p.add_argument("--sim", action="store_true")
+    p.add_argument("--f0", type=float, default=2.5e6)
+    p.add_argument("--span", type=float, default=4e6)
+    p.add_argument("--amp", type=float, nargs=2, default=(0.1, 2.0), metavar=("MIN", "MAX"))
+    p.add_argument("--n-amp", type=int, default=100)
+    p.add_argument("--n-bins", type=int, default=500)
+    p.add_argument("--fwhm", type=float, default=5e3, help="narrowest line to resolve, Hz")
+    p.add_argument("--chirp-s", type=float, default=None,
+                   help="sweep period (default: min_chirp_s(span, fwhm))")
+    p.add_argument("--fs", type=float, default=10e6)
+
+    p = sub.add_parser("compare", help="compare a map against a stepped sweep")
+    p.add_argument("ref", help="stepped sweep npz (e.g. data/h2_tube_3.npz)")
+    p.add_argument("test", nargs="+")
+    args = ap.parse_args()
+
+    if args.cmd == "compare":
+        with np.load(args.ref) as ref:
+            ref = dict(ref)
+        for path in args.test:
+            with np.load(path) as test:
+                res = compare_maps(ref, dict(test))
+            print(f"{path} vs {args.ref}:")
+            for k, v in res.items():
+                print(f"  {k:<16} {v:.6g}" if isinstance(v, float) else f"  {k:<16} {v}")
+        return
+
+    shortest = min_chirp_s(args.span, args.fwhm)
+    if args.mode == "chirp" and args.chirp_s is not None and args.chirp_s < shortest:
+        print(f"warning: --chirp-s {args.chirp_s:g} s is shorter than {shortest:.3g} s; "
+              f"lines narrower than {np.sqrt(4 * args.span / args.chirp_s):.3g} Hz will be smeared",
+              file=sys.stderr)
+    inst = SimInstrument(f0=args.f0, fwhm=args.fwhm) if args.sim else DwfInstrument()
+    sweep = ChirpSweep(inst, args.f0 - args.span / 2, args.f0 + args.span / 2,
+                       np.linspace(args.amp[0], args.amp[1], args.n_amp), mode=args.mode,
+                       fs=args.fs, chirp_s=args.chirp_s, fwhm=args.fwhm, n_bins=args.n_bins)
+    try:
+        energy_map, freq_axis, amp_axis = sweep.run()
+    finally:
+        inst.close()
+    save_npz(args.out, energy_map=energy_map, freq_axis=freq_axis, amp_axis=amp_axis,
+             mode=args.mode)
+    print(sweep.stats.report())
+
+
+if __name__ == "__main__":
+    main()
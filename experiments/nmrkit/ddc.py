@@ -0,0 +1,214 @@
+"""
+Digital downconversion of passband RX records to complex baseband.
+
+    x (fs) --NCO--> x * exp(-j 2 pi f0 t) --CIC, / cic_decimation--> --FIR, / fir_decimation--> z
+
+  NCO  float32 mix with a local oscillator table for one block; later
+       blocks reuse it rotated by the phase the NCO has reached, so the LO
+       is continuous across blocks without recomputing it.
+  CIC  order cic_order, in its non-recursive polyphase form: the boxcar**n
+       impulse response applied to frames of cic_decimation samples as n
+       small matrix products, so no integrator grows without bound and it
+       all stays in float32.
+  FIR  firwin2 design that flattens the CIC droop over the passband and
+       rejects everything that would alias into it, applied polyphase at
+       the output rate.
+
+z is scaled so |z| is the envelope of the passband signal (a tone of
+amplitude A at f0 + df gives A exp(j 2 pi df t)). Processing runs in blocks
+of up to `block` samples into buffers allocated once, so records of any
+length and successive shots stream through without temporary arrays of
+the full-rate size:
+
+    ddc = DDC(f0=F0_HZ, fs=FS, decimation=80)
+    z = ddc(ch1)                        # one record, filter state reset
+    t = ddc.time_axis(len(z))           # delay-corrected, s
+
+    ddc.reset()
+    for chunk in chunks:                # streaming
+        parts.append(ddc.process(chunk))
+"""
+
+import numpy as np
+
+
+def cic_response(f, fs, decimation, order):
+    """Magnitude response of a unit-gain CIC at f (Hz, input rate fs)."""
+    x = np.asarray(f, dtype=float) / fs
+    num = np.sin(np.pi * decimation * x)
+    den = decimation * np.sin(np.pi * x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        h = np.where(np.abs(den) < 1e-12, 1.0, num / den)
+    return np.abs(h) ** order
+
+
+def design_fir(rate, decimation, passband, cic, numtaps=127, n_grid=1025):
+    """
+    Lowpass for `rate` (Hz) ahead of decimation: flat to passband after
+    dividing by the CIC droop (cic = (fs, cic_decimation, order)), zero from
+    rate / decimation - passband (the first frequency that aliases into the
+    passband) on.
+    """
+    from scipy.signal import firwin2
+
+    out_rate = rate / decimation
+    stop = out_rate - passband
+    if stop <= passband:
+        raise ValueError("passband must be below half the output rate, "
+                         f"got {passband:g} Hz at {out_rate:g} Hz out")
+    nyq = rate / 2
+    f = np.linspace(0.0, nyq, n_grid)
+    gain = np.zeros_like(f)
+    pas = f <= passband
+    gain[pas] = 1.0 / cic_response(f[pas], *cic)
+    # linear ramp across the transition band
+    tr = (f > passband) & (f < stop)
+    gain[tr] = gain[pas][-1] * (stop - f[tr]) / (stop - passband)
+    return firwin2(numtaps, f, gain, fs=rate).astype(np.float32)
+
+
+class DDC:
+    """
+    f0, fs: NCO frequency and input sample rate (Hz). decimation =
+    cic_decimation * fir_decimation; out_rate = fs / decimation. passband
+    (Hz either side of f0) defaults to 0.4 * out_rate.
+    """
+
+    def __init__(self, f0, fs, decimation=80, fir_decimation=4, cic_order=4, passband=None,
+                 numtaps=127, block=1 << 16):
+        if decimation % fir_decimation:
+            raise ValueError("decimation must be a multiple of fir_decimation")
+        self.f0 = float(f0)
+        self.fs = float(fs)
+        self.decimation = int(decimation)
+        self.fir_decimation = int(fir_decimation)
+        self.cic_decimation = self.decimation // self.fir_decimation
+        self.cic_order = int(cic_order)
+        self.out_rate = self.fs / self.decimation
+        self.passband = 0.4 * self.out_rate if passband is None else float(passband)
+        self.block = int(block)
+
+        r, n = self.cic_decimation, self.cic_order
+        # unit-gain boxcar**n, padded to n frames and split per frame: output m
+        # is sum_j frame[m - j] @ _cic_taps[j] (the taps reversed within a frame)
+        h = np.ones(1)
+        for _ in range(n):
+            h = np.convolve(h, np.ones(r))
+        h = np.append(h / h.sum(), np.zeros(n * r - len(h)))
+        self._cic_taps = h.reshape(n, r)[:, ::-1].astype(np.complex64)
+
+        cic_rate = self.fs / r
+        self.taps = design_fir(cic_rate, self.fir_decimation, self.passband,
+                               (self.fs, r, n), numtaps)
+        self._taps_rev = self.taps[::-1].astype(np.complex64)
+
+        # group delay in input samples: CIC n (r - 1) / 2, FIR (L - 1) / 2 at fs / r
+        self.delay_s = (n * (r - 1) / 2 + (len(self.taps) - 1) / 2 * r) / self.fs
+
+        # NCO table for one block; fixed buffers for one block at each rate
+        b = self.block
+        k = np.arange(b)
+        self._lo = np.exp(-2j * np.pi * (self.f0 / self.fs) * k).astype(np.complex64)
+        self._lo_block_cycles = (self.f0 / self.fs * b) % 1.0
+        self._mix = np.empty(b, dtype=np.complex64)
+        self._frames = np.empty((n + 1 + b // r) * r, dtype=np.complex64)
+        n_mid = b // r + 1
+        self._mid = np.empty(len(self.taps) - 1 + n_mid, dtype=np.complex64)
+        self._out = np.empty(n_mid // self.fir_decimation + 1, dtype=np.complex64)
+        self.reset()
+
+    def reset(self):
+        """Zero the NCO phase and filter state (start of a new record)."""
+        self._cycles = 0.0
+        # CIC history: the last cic_order - 1 frames plus a partial frame
+        self._held = (self.cic_order - 1) * self.cic_decimation
+        self._frames[: self._held] = 0
+        self._hist = len(self.taps) - 1  # FIR history held at the front of _mid
+        self._mid[: self._hist] = 0
+        self._fir_phase = 0  # CIC outputs since the last FIR output
+
+    # ------------------------------------------------------------------
+    # stages
+    # ------------------------------------------------------------------
+
+    def _nco(self, x):
+        n = len(x)
+        rot = np.complex64(np.exp(-2j * np.pi * self._cycles))
+        np.multiply(self._lo[:n], rot, out=self._mix[:n])
+        self._mix[:n] *= x
+        if n == self.block:
+            self._cycles = (self._cycles + self._lo_block_cycles) % 1.0
+        else:
+            self._cycles = (self._cycles + self.f0 / self.fs * n) % 1.0
+        return self._mix[:n]
+
+    def _cic(self, mix):
+        """CIC decimation on whole frames; a partial frame waits for the next block."""
+        r, n = self.cic_decimation, self.cic_order
+        held = self._held
+        total = held + len(mix)
+        buf = self._frames[:total]
+        buf[held:] = mix
+        n_frames = total // r
+        n_out = n_frames - (n - 1)
+        frames = buf[: n_frames * r].reshape(n_frames, r)
+        z = frames[n - 1 :] @ self._cic_taps[0]
+        for j in range(1, n):
+            z += frames[n - 1 - j : n_frames - j] @ self._cic_taps[j]
+        keep = total - n_out * r
+        self._frames[:keep] = buf[n_out * r :]
+        self._held = keep
+        return z
+
+    def _fir(self, z):
+        """Polyphase FIR decimation; the last len(taps) - 1 inputs carry over."""
+        h = self._hist
+        m = len(z)
+        if m == 0:
+            return self._out[:0]
+        buf = self._mid[: h + m]
+        buf[h:] = z
+        dec = self.fir_decimation
+        first = (dec - 1 - self._fir_phase) % dec
+        self._fir_phase = (self._fir_phase + m) % dec
+        windows = np.lib.stride_tricks.sliding_window_view(buf, h + 1)[first::dec]
+        n_out = len(windows)
+        out = self._out[:n_out]
+        np.matmul(windows, self._taps_rev, out=out)
+        self._mid[:h] = buf[m:]
+        return out
+
+    # ------------------------------------------------------------------
+    # public
+    # ------------------------------------------------------------------
+
+    def process(self, x):
+        """Downconvert the next samples of a stream; returns a new complex64 array."""
+        x = np.asarray(x)
+        parts = []
+        for i in range(0, len(x), self.block):
+            mix = self._nco(x[i : i + self.block])
+            out = self._fir(self._cic(mix))
+            parts.append(out * np.float32(2.0))  # |z| = passband amplitude
+        if not parts:
+            return np.empty(0, dtype=np.complex64)
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def __call__(self, x):
+        """Downconvert one whole record (state reset first)."""
+        self.reset()
+        return self.process(x)
+
+    def time_axis(self, n):
+        """Time (s) of n output samples relative to the first input sample."""
+        return np.arange(n) / self.out_rate - self.delay_s + (self.decimation - 1) / self.fs
+
+    def spectrum(self, z):
+        """
+        (offset_hz, magnitude) of baseband samples with a Hanning window;
+        magnitude is the tone amplitude, as rfft_db() in fid.ipynb gives it.
+        """
+        win = np.hanning(len(z)).astype(np.float32)
+        spec = np.fft.fftshift(np.fft.fft(z * win))
+        freqs = np.fft.fftshift(np.fft.fftfreq(len(z), d=1 / self.out_rate))
+        return freqs, np.abs(spec) / win.sum()
@@ -0,0 +1,319 @@
+"""
+Batched fits of baseband FIDs to a damped complex exponential,
+
+    z(t) = amp * exp(i phase) * exp((-r2 + i 2 pi freq) t)
+
+(amp and phase at t = 0, freq the offset from the downconversion
+frequency, r2 = 1 / T2*). In frequency this is a Lorentzian line of FWHM
+r2 / pi centred on freq.
+
+Every row of a (shots x samples) array is fitted at once. The model is a
+single complex exponential, so all Jacobian columns are the model times 1,
+i, t or i t: the Levenberg-Marquardt normal equations reduce to two 2 x 2
+blocks built from sums of |m|^2 t^k, and each iteration costs a few
+passes over the data. Starting points come from the previous fit's r2
+and freq (warm start, for consecutive shots) or from a zero-padded FFT
+peak plus an order-1 linear prediction of the demodulated signal,
+whichever leaves the smaller residual after solving for amp and phase.
+
+    fitter = FidFitter(t)              # t: sample times (s) of each FID
+    fit = fitter.fit(z)                # z: (n_samples,) or (n_shots, n_samples)
+    print(fit.freq, fit.t2, fit.freq_sigma)
+
+matrix_pencil() estimates several lines per FID (batched SVD), e.g. to
+look for a second component or as a start for a multi-line model.
+"""
+
+import numpy as np
+
+
+class FidFit:
+    """Per-shot parameter arrays (length n_shots) and their 1-sigma errors."""
+
+    FIELDS = ("amp", "phase", "r2", "freq")
+
+    def __init__(self, amp, phase, r2, freq, sigmas, rss, n_samples, iterations):
+        self.amp = amp
+        self.phase = phase
+        self.r2 = r2
+        self.freq = freq
+        self.amp_sigma, self.phase_sigma, self.r2_sigma, self.freq_sigma = sigmas
+        self.rss = rss  # residual sum of squares |z - model|^2
+        self.n_samples = n_samples
+        self.iterations = iterations
+
+    def __len__(self):
+        return len(self.amp)
+
+    @property
+    def t2(self):
+        """T2* (s)."""
+        with np.errstate(divide="ignore"):
+            return 1.0 / self.r2
+
+    @property
+    def fwhm(self):
+        """Linewidth (Hz) of the equivalent Lorentzian."""
+        return self.r2 / np.pi
+
+    @property
+    def noise(self):
+        """RMS of the complex residual per sample."""
+        return np.sqrt(self.rss / self.n_samples)
+
+    def as_dict(self):
+        out = {k: getattr(self, k) for k in self.FIELDS}
+        out.update({k + "_sigma": getattr(self, k + "_sigma") for k in self.FIELDS})
+        out.update(t2=self.t2, rss=self.rss)
+        return out
+
+
+def fft_start(z, dt, pad=2, blocks=8):
+    """
+    (freq, r2, amp, phase) starting points for rows of z at t = 0, 1, ... * dt:
+    frequency from the peak of a zero-padded FFT (parabolic interpolation),
+    then the demodulated FID is averaged over its first two of `blocks`
+    blocks; their ratio gives r2 and their phase difference the remaining
+    frequency error, with the noise averaged down. FIDs that are gone by
+    the second block use blocks 8 times shorter.
+    """
+    b, n = z.shape
+    nfft = 1 << int(np.ceil(np.log2(pad * n)))
+    mag = np.abs(np.fft.fft(z, nfft, axis=1))
+    k = np.argmax(mag, axis=1)
+    rows = np.arange(b)
+    y0, y1, y2 = mag[rows, k - 1], mag[rows, k], mag[rows, (k + 1) % nfft]
+    den = y0 - 2 * y1 + y2
+    delta = np.where(den != 0, 0.5 * (y0 - y2) / np.where(den != 0, den, 1), 0.0)
+    freq = np.fft.fftfreq(nfft, dt)[k] + delta / (nfft * dt)
+
+    m = max(n // blocks, 1)
+    y = z[:, : 2 * m] * _exp_grid(-2j * np.pi * freq * dt, 2 * m)
+    r2, df = _block_decay(y, m, dt)
+    ms = max(m // 8, 1)
+    r2_short, df_short = _block_decay(y, ms, dt)
+    short = r2_short * m * dt > 3.0
+    r2 = np.where(short, r2_short, r2)
+    freq = freq + np.where(short, df_short, df)
+    amp, phase = _linear_amplitude(z, dt, r2, freq)
+    return freq, r2, amp, phase
+
+
+def _block_decay(y, m, dt):
+    """r2 and frequency error from the sums of two consecutive blocks of m samples."""
+    c1, c2 = y[:, :m].sum(axis=1), y[:, m : 2 * m].sum(axis=1)
+    ratio = c2 / np.where(c1 != 0, c1, 1)
+    span = m * dt
+    r2 = np.clip(-np.log(np.maximum(np.abs(ratio), 1e-6)) / span, 0.0, None)
+    return r2, np.angle(ratio) / (2 * np.pi * span)
+
+
+def _exp_grid(step, n):
+    """
+    exp(step * k) for k = 0 .. n-1 and each complex step (rows), as products
+    of two power tables of about sqrt(n) entries: much cheaper than exp().
+    """
+    step = np.asarray(step, dtype=np.complex128)
+    k = int(np.sqrt(n)) + 1
+    fine = np.exp(np.outer(step, np.arange(k)))
+    coarse = np.exp(np.outer(step * k, np.arange((n + k - 1) // k)))
+    return (coarse[:, :, None] * fine[:, None, :]).reshape(len(step), -1)[:, :n]
+
+
+def _linear_amplitude(z, dt, r2, freq):
+    """Least-squares complex amplitude for fixed r2 and freq."""
+    amp, phase, _ = _linear_fit(z, dt, r2, freq)
+    return amp, phase
+
+
+def _linear_fit(z, dt, r2, freq):
+    """(amp, phase, rss) of the least-squares amplitude for fixed r2 and freq."""
+    e = _exp_grid((-r2 + 2j * np.pi * freq) * dt, z.shape[1])
+    norm = np.maximum(np.sum(e.real**2 + e.imag**2, axis=1), np.finfo(float).tiny)
+    c = np.sum(z * np.conj(e), axis=1) / norm
+    rss = np.sum(z.real**2 + z.imag**2, axis=1) - (c.real**2 + c.imag**2) * norm
+    return np.abs(c), np.angle(c), np.maximum(rss, 0.0)
+
+
+def _model(params, n, dt):
+    amp, phase, r2, freq = params
+    return (amp * np.exp(1j * phase))[:, None] * _exp_grid((-r2 + 2j * np.pi * freq) * dt, n)
+
+
+def _normal_blocks(m, t, amp):
+    """Gauss-Newton normal equations: (amp, r2) and (phase, freq) decouple."""
+    w = m.real**2 + m.imag**2
+    s0, s1, s2 = w.sum(axis=1), w @ t, w @ (t * t)
+    a = np.maximum(np.abs(amp), np.finfo(float).tiny)
+    two_pi = 2 * np.pi
+    return (s0 / a**2, -s1 / a, s2), (s0, two_pi * s1, two_pi**2 * s2)
+
+
+def levenberg_marquardt(z, t, amp, phase, r2, freq, max_iter=30, tol=1e-6, lam=1e-3):
+    """
+    Refine (amp, phase, r2, freq) for every row of z, sampled at the
+    uniform times t from 0, at once; rows drop out as they converge
+    (predicted decrease below tol * cost). Returns the
+    parameters, the normal-equation blocks at the solution (for errors),
+    the residual sum of squares and the iteration count.
+    """
+    n, dt = len(t), t[1] - t[0]
+    params = np.array([amp, phase, r2, freq], dtype=float)
+    lam = np.full(len(z), lam)
+    m = _model(params, n, dt)
+    res = z - m
+    cost = np.sum(res.real**2 + res.imag**2, axis=1)
+    active = np.arange(len(z))
+    it = 0
+    while len(active) and it < max_iter:
+        it += 1
+        p, la = params[:, active], lam[active]
+        ma, ra = m[active], res[active]
+        (h_aa, h_ar, h_rr), (h_pp, h_pf, h_ff) = _normal_blocks(ma, t, p[0])
+        cr = np.conj(ma) * ra
+        q0, q1 = cr.sum(axis=1), cr @ t
+        g_a = q0.real / np.maximum(np.abs(p[0]), np.finfo(float).tiny)
+        g_p, g_r, g_f = q0.imag, -q1.real, 2 * np.pi * q1.imag
+        d_a, d_r = _solve2(h_aa * (1 + la), h_ar, h_rr * (1 + la), g_a, g_r)
+        d_p, d_f = _solve2(h_pp * (1 + la), h_pf, h_ff * (1 + la), g_p, g_f)
+        predicted = d_a * g_a + d_p * g_p + d_r * g_r + d_f * g_f
+
+        new = p + np.array([d_a, d_p, d_r, d_f])
+        with np.errstate(over="ignore", invalid="ignore"):  # wild steps just get rejected
+            m_new = _model(new, n, dt)
+            res_new = z[active] - m_new
+            cost_new = np.sum(res_new.real**2 + res_new.imag**2, axis=1)
+        better = cost_new < cost[active]
+        lam[active] = np.where(better, la / 3, la * 4)
+        upd = active[better]
+        params[:, upd] = new[:, better]
+        m[upd], res[upd], cost[upd] = m_new[better], res_new[better], cost_new[better]
+        active = active[np.abs(predicted) > tol * cost[active]]
+
+    # a negative amplitude is a phase flip
+    flip = params[0] < 0
+    params[0] = np.abs(params[0])
+    params[1] = np.angle(np.exp(1j * (params[1] + np.pi * flip)))
+    return tuple(params), _normal_blocks(m, t, params[0]), cost, it
+
+
+def _solve2(h11, h12, h22, g1, g2):
+    """Closed-form solve of a batch of symmetric 2 x 2 systems."""
+    det = h11 * h22 - h12 * h12
+    det = np.where(np.abs(det) > 0, det, np.inf)
+    return (h22 * g1 - h12 * g2) / det, (h11 * g2 - h12 * g1) / det
+
+
+def _inv2(h11, h12, h22):
+    """(c11, c12, c22) of the inverses of a batch of symmetric 2 x 2 matrices."""
+    det = h11 * h22 - h12 * h12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return h22 / det, -h12 / det, h11 / det
+
+
+class FidFitter:
+    """
+    t: sample times (s) shared by all FIDs, uniformly spaced. With
+    warm_start, each fit() starts from the previous r2 and freq (row by
+    row for a batch of the same size, otherwise their median) with amp and
+    phase re-solved on the new data, so phase jumps between shots cost
+    nothing. Rows whose warm start leaves a larger residual than the FFT
+    start use the FFT start instead; rows that still end up with negative
+    r2 or non-finite parameters are refitted from it.
+    """
+
+    def __init__(self, t, max_iter=30, tol=1e-6, warm_start=True):
+        self.t = np.asarray(t, dtype=float)
+        self.t0 = self.t[0]
+        self.dt = float(np.mean(np.diff(self.t)))
+        self._tt = self.t - self.t0  # fit on t from 0, referred back to t = 0 after
+        self.max_iter = max_iter
+        self.tol = tol
+        self.warm_start = warm_start
+        self.last = None
+
+    def _start(self, z):
+        b = len(z)
+        last = self.last
+        freq, r2, amp, phase = fft_start(z, self.dt)
+        if self.warm_start and last is not None:
+            w_r2, w_freq = last.r2, last.freq
+            if len(last) != b:
+                w_r2, w_freq = (np.full(b, np.median(p)) for p in (w_r2, w_freq))
+            ok = np.isfinite(w_r2) & np.isfinite(w_freq) & (w_r2 >= 0)
+            w_r2, w_freq = np.where(ok, w_r2, r2), np.where(ok, w_freq, freq)
+            w_amp, w_phase, w_rss = _linear_fit(z, self.dt, w_r2, w_freq)
+            _, _, rss = _linear_fit(z, self.dt, r2, freq)
+            warm = w_rss <= rss
+            amp, phase = np.where(warm, w_amp, amp), np.where(warm, w_phase, phase)
+            r2, freq = np.where(warm, w_r2, r2), np.where(warm, w_freq, freq)
+        return amp, phase, r2, freq
+
+    def fit(self, z):
+        """Fit each row of z (complex baseband on t); returns a FidFit."""
+        z = np.atleast_2d(np.asarray(z, dtype=np.complex128))
+        if z.shape[1] != len(self.t):
+            raise ValueError(f"FIDs have {z.shape[1]} samples, expected {len(self.t)}")
+        tt = self._tt
+        amp, phase, r2, freq = self._start(z)
+        (amp, phase, r2, freq), blocks, rss, it = levenberg_marquardt(
+            z, tt, amp, phase, r2, freq, self.max_iter, self.tol
+        )
+        bad = ~(np.isfinite(amp) & np.isfinite(r2) & np.isfinite(freq)) | (r2 < 0)
+        if bad.any() and self.warm_start and self.last is not None:
+            f0, r0, a0, p0 = fft_start(z[bad], self.dt)
+            (a, p, r, f), blk, c, it2 = levenberg_marquardt(
+                z[bad], tt, a0, p0, r0, f0, self.max_iter, self.tol
+            )
+            amp[bad], phase[bad], r2[bad], freq[bad], rss[bad] = a, p, r, f, c
+            for block, sub in zip(blocks, blk):
+                for arr, s in zip(block, sub):
+                    arr[bad] = s
+            it = max(it, it2)
+
+        # covariances from the inverse normal equations and the residual
+        # variance per real component, then amp and phase referred to t = 0
+        var = rss / max(2 * z.shape[1] - 4, 1)
+        c_aa, c_ar, c_rr = (c * var for c in _inv2(*blocks[0]))
+        c_pp, c_pf, c_ff = (c * var for c in _inv2(*blocks[1]))
+        with np.errstate(over="ignore"):  # a noise-only row may decay "instantly"
+            grow = np.exp(r2 * self.t0)
+        w = 2 * np.pi * self.t0
+        var_amp = grow**2 * (c_aa + 2 * amp * self.t0 * c_ar + (amp * self.t0) ** 2 * c_rr)
+        var_phase = c_pp - 2 * w * c_pf + w**2 * c_ff
+        sigmas = tuple(np.sqrt(np.abs(v)) for v in (var_amp, var_phase, c_rr, c_ff))
+        amp = amp * grow
+        phase = np.angle(np.exp(1j * (phase - w * freq)))
+        fit = FidFit(amp, phase, r2, freq, sigmas, rss, z.shape[1], it)
+        self.last = fit
+        return fit
+
+
+def matrix_pencil(z, dt, order=1, pencil=None):
+    """
+    Matrix-pencil estimate of `order` damped exponentials in each row of z
+    (samples at 0, dt, 2 dt, ...). Returns (freq, r2, amp, phase), each
+    (n_shots, order), lines sorted by amplitude. Cost grows with
+    samples**3: give it a few hundred samples (decimate first if needed).
+    """
+    z = np.atleast_2d(np.asarray(z, dtype=np.complex128))
+    b, n = z.shape
+    pencil = n // 3 if pencil is None else pencil
+    rows = n - pencil
+    idx = np.arange(rows)[:, None] + np.arange(pencil + 1)
+    y = z[:, idx]  # (b, rows, pencil + 1) Hankel matrices
+    _, _, vh = np.linalg.svd(y, full_matrices=False)
+    v = vh[:, :order, :].transpose(0, 2, 1)  # signal subspace of the rows
+    v1, v2 = v[:, :-1, :], v[:, 1:, :]
+    poles = np.linalg.eigvals(np.linalg.pinv(v1) @ v2)
+
+    k = np.arange(n)
+    vander = poles[:, None, :] ** k[None, :, None]  # (b, n, order)
+    vh_ = np.conj(vander).transpose(0, 2, 1)
+    c = np.linalg.solve(vh_ @ vander, (vh_ @ z[:, :, None]))[..., 0]
+
+    order_idx = np.argsort(-np.abs(c), axis=1)
+    poles = np.take_along_axis(poles, order_idx, axis=1)
+    c = np.take_along_axis(c, order_idx, axis=1)
+    s = np.log(poles) / dt
+    return s.imag / (2 * np.pi), -s.real, np.abs(c), np.angle(c)
@@ -0,0 +1,214 @@
+"""
+Instruments for tone-response sweeps: drive a sine on W1, record the RX
+channel. The sweep engine only uses
+
+    configure(sample_rate, record_s, rx_range)   once per sweep
+    tune(freq, amp)                              per shot
+    record()  -> float32 RX samples              per shot (raises if any were lost)
+    close()
+
+and the single-record modes (nmrkit.chirp) also
+
+    play_chirp(f_start, f_stop, period_s, amp)   repeating linear sweep
+    play_buffer(samples, buffer_hz, amp)         repeating custom waveform
+
+DwfInstrument talks to an Analog Discovery through dwfpy; SimInstrument
+synthesises records from a resonance model, for testing and benchmarks
+without hardware. nmrkit.simdwf simulates one level lower, standing in for
+dwfpy itself, so DwfInstrument and the notebooks run unchanged.
+"""
+
+import ctypes
+import time
+
+import numpy as np
+
+
+def upload_custom(device, channel, samples):
+    """
+    Load a custom carrier buffer (normalised to +-1) into a wavegen channel.
+    dwfpy's setup() has no data argument, so this goes through the binding.
+    """
+    import dwfpy.bindings as dwfb
+
+    buf = np.ascontiguousarray(samples, dtype=np.float64)
+    ptr = buf.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+    dwfb.dwf_analog_out_node_data_set(
+        device.handle, channel, dwfb.ANALOG_OUT_NODE_CARRIER, ptr, len(buf)
+    )
+
+
+class DwfInstrument:
+    """
+    Analog Discovery via dwfpy. The scope and trigger are set up once;
+    after the first record only the wavegen carrier frequency/amplitude
+    change per shot and the scope is re-armed without reconfiguring.
+    """
+
+    def __init__(self, device=None, rx_channel=1, tx_channel=0, trigger_level=0.01):
+        import dwfpy as dwf
+
+        self._own_device = device is None
+        self.device = dwf.Device() if device is None else device
+        if self._own_device:
+            self.device.open()
+        self.rx_channel = rx_channel
+        self.tx_channel = tx_channel
+        self.scope = self.device.analog_input
+        self.wavegen = self.device.analog_output[tx_channel]
+        self.trigger_level = trigger_level
+        self.sample_rate = None
+        self.record_s = None
+        self._configured = False
+        self._started = False
+
+    def configure(self, sample_rate, record_s, rx_range):
+        self.sample_rate = sample_rate
+        self.record_s = record_s
+        self.scope.reset()
+        self.scope[self.rx_channel].setup(range=rx_range)
+        self.scope.setup_edge_trigger(
+            mode="normal", channel=self.rx_channel, slope="rising",
+            level=self.trigger_level, hysteresis=0.01,
+        )
+        self.wavegen.reset()
+        self._configured = False
+        self._started = False
+
+    def tune(self, freq, amp):
+        if not self._started:
+            self.wavegen.setup("sine", frequency=freq, amplitude=amp, start=True)
+            self._started = True
+            return
+        carrier = self.wavegen.nodes.carrier
+        carrier.frequency = freq
+        carrier.amplitude = amp
+        self.wavegen.configure(start=True)
+
+    def play_chirp(self, f_start, f_stop, period_s, amp):
+        """Linear sweep by FM of the carrier with a ramp (as WaveForms' sweep does)."""
+        fc = (f_start + f_stop) / 2
+        self.wavegen.setup("sine", frequency=fc, amplitude=amp, start=False)
+        self.wavegen.nodes.fm.setup(
+            "ramp_up", frequency=1.0 / period_s, amplitude=100.0 * (f_stop - f_start) / 2 / fc
+        )
+        self.wavegen.configure(start=True)
+        self._started = False  # tune() must set the plain sine up again
+
+    def play_buffer(self, samples, buffer_hz, amp):
+        upload_custom(self.device, self.tx_channel, samples)
+        self.wavegen.setup("custom", frequency=buffer_hz, amplitude=amp, start=True)
+        self._started = False
+
+    def record(self):
+        rec = self.scope.record(
+            sample_rate=self.sample_rate, length=self.record_s,
+            configure=not self._configured, start=True,
+        )
+        self._configured = True
+        # a record with gaps would pass for a shorter, discontinuous one
+        lost = rec.lost_samples + rec.corrupted_samples
+        if lost:
+            raise RuntimeError(f"record lost {lost} of {rec.total_samples} samples on USB")
+        return np.asarray(rec.channels[self.rx_channel].data_samples, dtype=np.float32)
+
+    def close(self):
+        try:
+            self.wavegen.reset()
+        finally:
+            if self._own_device:
+                self.device.close()
+
+
+def lorentzian(f, f0, fwhm):
+    """Unit-height Lorentzian line."""
+    x = 2.0 * (f - f0) / fwhm
+    return 1.0 / (1.0 + x * x)
+
+
+class SimInstrument:
+    """
+    Tone response of a resonant probe: the RX amplitude follows a smooth
+    front-end gain times (1 - depth * Lorentzian(f0, fwhm)), i.e. an
+    absorption dip at f0, plus white noise and a shot-to-shot gain jitter
+    (relative). record() optionally takes as long as the real record would
+    (realtime=True).
+    """
+
+    def __init__(self, f0=2.5e6, fwhm=5e3, depth=0.6, gain=0.1, noise_v=2e-3,
+                 gain_jitter=0.002, realtime=False, overhead_s=0.0, seed=0):
+        self.f0 = f0
+        self.fwhm = fwhm
+        self.depth = depth
+        self.gain = gain
+        self.noise_v = noise_v
+        self.gain_jitter = gain_jitter
+        self.realtime = realtime
+        self.overhead_s = overhead_s
+        self.rng = np.random.default_rng(seed)
+        self.freq = 0.0
+        self.amp = 0.0
+        self._t = None
+        self._play = None  # ("chirp", f_start, f_stop, period_s) or ("buffer", samples, buffer_hz)
+
+    def configure(self, sample_rate, record_s, rx_range):
+        self.sample_rate = sample_rate
+        self.record_s = record_s
+        n = int(round(sample_rate * record_s))
+        self._t = np.arange(n, dtype=np.float64) / sample_rate
+
+    def response(self, freq):
+        """RX amplitude per volt of drive at freq."""
+        rolloff = 1.0 / np.sqrt(1.0 + (np.asarray(freq) / 8e6) ** 2)
+        return self.gain * rolloff * (1.0 - self.depth * lorentzian(freq, self.f0, self.fwhm))
+
+    def tune(self, freq, amp):
+        self.freq = freq
+        self.amp = amp
+        self._play = None
+
+    def play_chirp(self, f_start, f_stop, period_s, amp):
+        self.amp = amp
+        self._play = ("chirp", f_start, f_stop, period_s)
+
+    def play_buffer(self, samples, buffer_hz, amp):
+        self.amp = amp
+        self._play = ("buffer", np.asarray(samples, float), buffer_hz)
+
+    def _chirp(self, f_start, f_stop, period_s):
+        # quasi-static: the response follows the instantaneous frequency,
+        # which holds while the sweep rate is well below fwhm**2
+        t = (self._t + self.rng.uniform(0, period_s)) % period_s
+        rate = (f_stop - f_start) / period_s
+        phase = 2 * np.pi * (f_start * t + 0.5 * rate * t * t)
+        return self.response(f_start + rate * t) * np.sin(phase)
+
+    def _buffer(self, samples, buffer_hz):
+        # steady state: every tone of the periodic buffer scaled by the response
+        n = len(samples)
+        spec = np.fft.rfft(samples)
+        spec *= self.response(np.arange(len(spec)) * buffer_hz)
+        period = np.fft.irfft(spec, n)
+        pos = (np.arange(len(self._t)) * buffer_hz * n / self.sample_rate
+               + self.rng.integers(0, n)) % n
+        return np.interp(pos, np.arange(n + 1), np.append(period, period[0]))
+
+    def record(self):
+        t0 = time.perf_counter()
+        a = self.amp * (1.0 + self.rng.normal(0.0, self.gain_jitter))
+        if self._play is None:
+            phase = self.rng.uniform(0, 2 * np.pi)
+            x = a * self.response(self.freq) * np.sin(2 * np.pi * self.freq * self._t + phase)
+        elif self._play[0] == "chirp":
+            x = a * self._chirp(*self._play[1:])
+        else:
+            x = a * self._buffer(*self._play[1:])
+        x += self.rng.normal(0.0, self.noise_v, len(x))
+        if self.realtime:
+            left = self.record_s + self.overhead_s - (time.perf_counter() - t0)
+            if left > 0:
+                time.sleep(left)
+        return x.astype(np.float32)
+
+    def close(self):
+        pass
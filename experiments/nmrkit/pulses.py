@@ -0,0 +1,256 @@
+"""
+Shaped RF pulses: AD2 custom-waveform buffers and Bloch-simulated
+excitation profiles.
+
+A Pulse holds the parameters fid.ipynb uses (shape, duration, Gaussian
+SIGMA_FACTOR or trapezoid RISE_FRAC, carrier f0, AWG rate). buffer() gives
+the normalised samples W1 replays once per trigger; profile() simulates
+the magnetisation after the pulse for many off-resonance isochromats:
+
+    pulse = Pulse("gaussian", 50e-6, f0=F0_HZ, sigma_factor=8)
+    prof = pulse.profile(volts=3.0, rabi_hz_per_v=2e3, offsets=np.linspace(-50e3, 50e3, 2001))
+    prof.flip_deg[prof.offsets == 0], prof.bandwidth_hz
+    pulse.volts_for(90, rabi_hz_per_v=2e3)
+
+rabi_hz_per_v is the nutation rate (Hz) per volt of wavegen amplitude for
+the whole TX chain and coil; measure it once, e.g. as 1 / (4 * area_s *
+V90) from the amplitude V90 that maximises the FID. Relaxation during the
+pulse is ignored.
+
+Bloch simulation: the envelope is averaged into n_steps intervals, each a
+rotation about (w1, 0, 2 pi offset) in the rotating frame, written as
+Cayley-Klein parameters (alpha, beta) for every step x isochromat at once.
+The steps are then composed pairwise, log2(n_steps) array operations in
+all, rather than a Python loop over time.
+
+Buffers and profiles are memoised on disk (npz, keyed by a hash of every
+parameter) in $NMRKIT_CACHE or ~/.cache/nmrkit, so sweeping designs
+repeats no work.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from nmrkit.instrument import upload_custom
+from nmrkit.sweep import save_npz
+
+CACHE_VERSION = 1  # bump when a computation changes, to ignore old entries
+SHAPES = ("gaussian", "trapezoid", "rect")
+
+
+# ====================================
+# DISK CACHE
+# ====================================
+
+
+def cache_dir():
+    return os.environ.get("NMRKIT_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "nmrkit")
+
+
+def _key(kind, params):
+    blob = json.dumps({"kind": kind, "version": CACHE_VERSION, **params}, sort_keys=True)
+    return f"{kind}-{hashlib.sha1(blob.encode()).hexdigest()[:16]}"
+
+
+def memoized(kind, params, compute, enabled=True):
+    """
+    compute() -> dict of arrays, stored as <cache_dir>/<kind>-<hash>.npz and
+    loaded from there next time. params must be JSON-serialisable.
+    """
+    if not enabled:
+        return compute()
+    path = os.path.join(cache_dir(), _key(kind, params) + ".npz")
+    if os.path.exists(path):
+        with np.load(path) as d:
+            return {k: d[k] for k in d.files}
+    result = compute()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_npz(path, **result)
+    return result
+
+
+# ====================================
+# BLOCH SIMULATION
+# ====================================
+
+
+def _compose(a1, b1, a2, b2):
+    """Cayley-Klein parameters of rotation 1 followed by rotation 2."""
+    return a2 * a1 - np.conj(b2) * b1, b2 * a1 + np.conj(a2) * b1
+
+
+def bloch_rotations(w1, dt, offsets):
+    """
+    Net rotation of piecewise-constant RF w1 (rad/s, complex: x + i y, one
+    value per step of dt seconds) at each offset (Hz). Returns (alpha, beta)
+    arrays shaped like offsets.
+    """
+    w1 = np.asarray(w1, dtype=np.complex128)[:, None]
+    wz = 2 * np.pi * np.asarray(offsets, dtype=float)[None, :]
+    w = np.sqrt(np.abs(w1) ** 2 + wz**2)
+    half = 0.5 * w * dt
+    with np.errstate(invalid="ignore", divide="ignore"):
+        s = np.where(w > 0, np.sin(half) / w, 0.0)
+    a = np.cos(half) - 1j * wz * s
+    b = -1j * w1 * s
+
+    # pairwise composition in time order: (0, 1), (2, 3), ... then again
+    while len(a) > 1:
+        if len(a) % 2:
+            a = np.concatenate((a, np.ones_like(a[:1])))
+            b = np.concatenate((b, np.zeros_like(b[:1])))
+        a, b = _compose(a[0::2], b[0::2], a[1::2], b[1::2])
+    return a[0], b[0]
+
+
+class PulseProfile:
+    """Magnetisation after the pulse, starting from +z, per offset (Hz)."""
+
+    def __init__(self, offsets, mxy, mz):
+        self.offsets = np.asarray(offsets)
+        self.mxy = np.asarray(mxy)  # transverse, complex (x + i y)
+        self.mz = np.asarray(mz)
+
+    @property
+    def flip_deg(self):
+        return np.degrees(np.arccos(np.clip(self.mz, -1.0, 1.0)))
+
+    @property
+    def bandwidth_hz(self):
+        """Full width of |mxy| at half its maximum (0 if no half-max crossing)."""
+        m = np.abs(self.mxy)
+        above = np.nonzero(m >= m.max() / 2)[0]
+        if not len(above):
+            return 0.0
+        return float(self.offsets[above[-1]] - self.offsets[above[0]])
+
+    def at(self, offset=0.0):
+        """(flip_deg, |mxy|) at the offset nearest to the given one."""
+        i = int(np.argmin(np.abs(self.offsets - offset)))
+        return float(self.flip_deg[i]), float(np.abs(self.mxy[i]))
+
+
+# ====================================
+# PULSES
+# ====================================
+
+
+class Pulse:
+    """
+    shape: 'gaussian' (sigma = duration / sigma_factor, centred),
+    'trapezoid' (linear edges of rise_frac * duration) or 'rect'.
+    f0 and fs set the carrier of the AD2 buffer (and, through its sampled
+    peak, the RF amplitude per volt).
+    """
+
+    def __init__(self, shape="gaussian", duration_s=50e-6, f0=3.406772e6, fs=100e6,
+                 sigma_factor=8.0, rise_frac=0.10, cache=True):
+        if shape not in SHAPES:
+            raise ValueError(f"Unknown pulse shape: {shape} (one of {', '.join(SHAPES)})")
+        self.shape = shape
+        self.duration_s = float(duration_s)
+        self.f0 = float(f0)
+        self.fs = float(fs)
+        self.sigma_factor = float(sigma_factor)
+        self.rise_frac = float(rise_frac)
+        self.cache = cache
+
+    @property
+    def params(self):
+        """Everything the buffer depends on (the cache key)."""
+        p = {"shape": self.shape, "duration_s": self.duration_s, "f0": self.f0, "fs": self.fs}
+        if self.shape == "gaussian":
+            p["sigma_factor"] = self.sigma_factor
+        elif self.shape == "trapezoid":
+            p["rise_frac"] = self.rise_frac
+        return p
+
+    @property
+    def n_samples(self):
+        return int(self.fs * self.duration_s)
+
+    @property
+    def replay_hz(self):
+        """Custom-waveform frequency that plays the buffer once per duration_s."""
+        return 1.0 / self.duration_s
+
+    def envelope(self, n=None):
+        """Envelope (peak 1) on n points across the pulse, default one per AWG sample."""
+        n = self.n_samples if n is None else n
+        t = np.arange(n) * (self.duration_s / n)
+        if self.shape == "gaussian":
+            sigma = self.duration_s / self.sigma_factor
+            return np.exp(-0.5 * ((t - self.duration_s / 2) / sigma) ** 2)
+        env = np.ones(n)
+        if self.shape == "trapezoid":
+            n_edge = max(1, int(self.rise_frac * n))
+            env[:n_edge] = np.linspace(0, 1, n_edge)
+            env[-n_edge:] = np.linspace(1, 0, n_edge)
+        return env
+
+    def _burst(self):
+        n = self.n_samples
+        return self.envelope(n) * np.sin(2 * np.pi * self.f0 * np.arange(n) / self.fs)
+
+    @property
+    def scale(self):
+        """RF amplitude per volt: the buffer is normalised by its sampled peak, just under 1."""
+        return 1.0 / float(np.max(np.abs(self._burst())))
+
+    @property
+    def area_s(self):
+        """Time integral of the RF amplitude per volt: the duration of a 1 V rect pulse of equal flip."""
+        return float(self.envelope().sum() / self.fs) * self.scale
+
+    def buffer(self):
+        """AD2 custom buffer: envelope times the f0 carrier, normalised to +-1."""
+        def compute():
+            return {"samples": self._burst() * self.scale}
+
+        return memoized("buffer", self.params, compute, self.cache)["samples"]
+
+    # ------------------------------------------------------------------
+    # flip angle
+    # ------------------------------------------------------------------
+
+    def flip_deg(self, volts, rabi_hz_per_v):
+        """On-resonance flip angle (exact there: every step rotates about x)."""
+        return 360.0 * rabi_hz_per_v * volts * self.area_s
+
+    def volts_for(self, flip_deg, rabi_hz_per_v):
+        """Wavegen amplitude for an on-resonance flip of flip_deg."""
+        return flip_deg / (360.0 * rabi_hz_per_v * self.area_s)
+
+    def profile(self, volts, rabi_hz_per_v, offsets, n_steps=256):
+        """Bloch-simulated PulseProfile over offsets (Hz from f0)."""
+        offsets = np.asarray(offsets, dtype=float)
+        params = dict(self.params, volts=float(volts), rabi_hz_per_v=float(rabi_hz_per_v),
+                      n_steps=int(n_steps),
+                      offsets=hashlib.sha1(offsets.tobytes()).hexdigest())
+
+        def compute():
+            # step averages of the envelope keep its area exact
+            fine = self.envelope(max(self.n_samples, n_steps))
+            edges = np.linspace(0, len(fine), n_steps + 1).astype(int)
+            steps = np.add.reduceat(fine, edges[:-1]) / np.diff(edges)
+            w1 = 2 * np.pi * rabi_hz_per_v * volts * self.scale * steps
+            a, b = bloch_rotations(w1, self.duration_s / n_steps, offsets)
+            return {"mxy": 2 * np.conj(a) * b, "mz": np.abs(a) ** 2 - np.abs(b) ** 2}
+
+        r = memoized("profile", params, compute, self.cache)
+        return PulseProfile(offsets, r["mxy"], r["mz"])
+
+    # ------------------------------------------------------------------
+    # hardware
+    # ------------------------------------------------------------------
+
+    def upload(self, device, wavegen, volts, channel=0):
+        """Load the buffer into W<channel+1> as a single-shot custom waveform (fired by configure(start=True))."""
+        upload_custom(device, channel, self.buffer())
+        wavegen.setup(function="custom", frequency=self.replay_hz,
+                      amplitude=volts, offset=0.0, start=False)
+        wavegen.run_duration = self.duration_s
+        wavegen.repeat_count = 1
@@ -0,0 +1,711 @@
+"""
+Simulated Analog Discovery 2: a stand-in for the part of dwfpy the
+notebooks and nmrkit use, synthesising NMR records from a spin model so
+acquisition and analysis run (and can be benchmarked) without hardware.
+
+    from nmrkit import simdwf
+    simdwf.install(simdwf.SpinModel(larmor_hz=3.4068e6, t2_s=1e-3))
+    import dwfpy as dwf                  # now the simulator, as is dwfpy.bindings
+
+Covered: Device / AnalogDiscovery2 (open/close or `with`, name,
+serial_number, handle); analog_input reset, [ch].setup(range, offset,
+coupling), setup_edge_trigger, record(sample_rate, length, configure,
+start) -> .channels[i].data_samples, total_samples, lost_samples,
+corrupted_samples; analog_output[ch] reset, setup, configure,
+nodes.carrier.frequency / amplitude, nodes.fm.setup, run_duration,
+repeat_count; dwfpy.bindings.dwf_analog_out_node_data_set for custom
+buffers (nmrkit.instrument.upload_custom).
+
+Wiring: W1 drives the coil (W2 is not connected); scope ch0 monitors W1
+through the T-connector (monitor_gain), ch1 is the RX.
+
+  single shot  run_duration > 0 and repeat_count 1 (fid.ipynb): each
+               configure(start=True) fires one pulse. Its flip comes from
+               a Bloch simulation at the Larmor frequency (nmrkit.pulses),
+               the magnetisation left over from the last pulse recovers
+               with T1, and the RX holds the coil feedthrough and ringdown
+               plus the FID, m0_v * |Mxy| decaying with T2*.
+  continuous   sine, sine with an FM ramp (chirp) or a custom buffer: the
+               RX is the steady-state tone response of the probe, as
+               SimInstrument models it.
+
+record() waits for its trigger like the hardware: in normal mode the
+running output, or the next pulse fired after it was armed, must cross the
+level on the trigger channel; otherwise TimeoutError after
+trigger_timeout_s. Records start at the pulse start, within a sample
+(trigger jitter). Channels are clipped to their range and quantised to
+adc_bits.
+
+With realtime=True (default) calls take as long as they do over USB:
+call_s per setup/configure/reset, and a record its length plus
+overhead_s plus the transfer at usb_bytes_per_s. With stream_sps set,
+records longer than buffer_samples lose whole chunks of chunk_samples
+wherever the stream falls behind, as AD2 record mode does at high rates;
+data_samples then holds only what arrived.
+
+    python -m nmrkit.simdwf sweep --fast     # SweepEngine throughput
+    python -m nmrkit.simdwf fid --shots 32   # averaging + DDC + fit throughput
+"""
+
+import argparse
+import ctypes
+import itertools
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+from nmrkit.instrument import lorentzian
+from nmrkit.pulses import bloch_rotations
+
+N_CHANNELS = 2
+TX_MONITOR, RX = 0, 1  # scope channels
+ANALOG_OUT_NODE_CARRIER, ANALOG_OUT_NODE_FM, ANALOG_OUT_NODE_AM = 0, 1, 2
+
+DEVICE_DEFAULTS = {
+    "model": None,  # SpinModel; None gives each device its own default one
+    "realtime": True,
+    "call_s": 1e-3,  # USB round trip per setup / configure / reset
+    "overhead_s": 5e-3,  # per record: arm, status polling, readout setup
+    "usb_bytes_per_s": 20e6,
+    "stream_sps": None,  # sustained record-mode rate per channel; None: no loss
+    "buffer_samples": 16384,
+    "chunk_samples": 4096,
+    "trigger_timeout_s": 10.0,
+    "monitor_gain": 0.5,  # T-connector into the 50 ohm TX monitor
+    "monitor_noise_v": 1e-3,
+    "adc_bits": 14,
+    "awg_rate": 100e6,  # W1 rate for single-shot standard waveforms
+    "seed": 0,
+}
+_defaults = dict(DEVICE_DEFAULTS)
+_devices = {}  # handle -> open Device, for the bindings stand-in
+_handles = itertools.count(1)
+
+
+# ====================================
+# SPIN MODEL
+# ====================================
+
+
+def _baseband(v, dt, f, n_steps):
+    """
+    Complex RF envelope (volts, rotating frame at f from the first sample)
+    of a real drive v, averaged over n_steps equal steps.
+    """
+    t = np.arange(len(v)) * dt
+    z = v * np.exp(-2j * np.pi * f * t)
+    per = max(1, int(round(1.0 / (f * dt))))
+    z = np.convolve(z, np.ones(per) / per, mode="same")  # drops the 2 f term
+    n_steps = min(n_steps, len(z))
+    edges = np.linspace(0, len(z), n_steps + 1).astype(int)
+    return 2.0 * np.add.reduceat(z, edges[:-1]) / np.diff(edges)
+
+
+class SpinModel:
+    """
+    Sample and probe.
+
+    Pulsed: larmor_hz, t2_s (FID decay, T2*), t1_s (recovery between
+    pulses, 0 for full recovery), m0_v (RX volts of the whole
+    magnetisation tipped transverse), rabi_hz_per_v (nutation rate per W1
+    volt, as in nmrkit.pulses) and larmor_jitter_hz (rms field drift from
+    shot to shot). The coil, tuned to coil_hz (default larmor_hz) with
+    quality coil_q, couples `coupling` V per W1 volt into the RX while
+    driven and rings down after.
+
+    Continuous: rx_gain * rolloff * (1 - cw_depth * Lorentzian(larmor_hz,
+    cw_fwhm)), SimInstrument's tone response. noise_v: RX noise, rms.
+    """
+
+    def __init__(self, larmor_hz=3.406772e6, t2_s=1e-3, t1_s=0.5, m0_v=1e-3, rabi_hz_per_v=5e3,
+                 larmor_jitter_hz=0.0, coil_hz=None, coil_q=30.0, coupling=0.2,
+                 rx_gain=0.5, cw_depth=0.6, cw_fwhm=5e3, noise_v=2e-3):
+        self.larmor_hz = larmor_hz
+        self.t2_s = t2_s
+        self.t1_s = t1_s
+        self.m0_v = m0_v
+        self.rabi_hz_per_v = rabi_hz_per_v
+        self.larmor_jitter_hz = larmor_jitter_hz
+        self.coil_hz = larmor_hz if coil_hz is None else coil_hz
+        self.coil_q = coil_q
+        self.coupling = coupling
+        self.rx_gain = rx_gain
+        self.cw_depth = cw_depth
+        self.cw_fwhm = cw_fwhm
+        self.noise_v = noise_v
+        self.mz = 1.0  # longitudinal magnetisation after the last pulse
+        self.last_pulse = None  # its monotonic time
+
+    @property
+    def ringdown_s(self):
+        """Coil energy decay time constant (amplitude)."""
+        return self.coil_q / (np.pi * self.coil_hz)
+
+    def response(self, freq):
+        """RX amplitude per volt of continuous drive at freq."""
+        rolloff = 1.0 / np.sqrt(1.0 + (np.asarray(freq) / 8e6) ** 2)
+        return self.rx_gain * rolloff * (1.0 - self.cw_depth * lorentzian(freq, self.larmor_hz,
+                                                                          self.cw_fwhm))
+
+    def excite(self, v, dt, when, rng, n_steps=64):
+        """
+        Apply the pulse v (W1 volts, one sample per dt) at monotonic time
+        `when`. Returns this shot's Larmor frequency and the transverse
+        magnetisation after it (fraction of m0, complex, in the frame
+        rotating at that frequency from the pulse start).
+        """
+        f = self.larmor_hz
+        if self.larmor_jitter_hz:
+            f += rng.normal(0.0, self.larmor_jitter_hz)
+        mz0 = 1.0
+        if self.last_pulse is not None and self.t1_s > 0:
+            mz0 = 1.0 - (1.0 - self.mz) * np.exp(-(when - self.last_pulse) / self.t1_s)
+        env = _baseband(v, dt, f, n_steps)
+        a, b = bloch_rotations(2 * np.pi * self.rabi_hz_per_v * env, len(v) * dt / len(env), [0.0])
+        self.mz = mz0 * float(np.abs(a[0]) ** 2 - np.abs(b[0]) ** 2)
+        self.last_pulse = when
+        return f, mz0 * complex(2 * np.conj(a[0]) * b[0])
+
+    def coil(self, v, dt):
+        """Complex envelope at coil_hz of the coil current driven by v (first-order resonator)."""
+        from scipy.signal import lfilter
+
+        t = np.arange(len(v)) * dt
+        a = np.exp(-dt / self.ringdown_s)
+        return lfilter([1 - a], [1, -a], 2.0 * v * np.exp(-2j * np.pi * self.coil_hz * t))
+
+
+# ====================================
+# ANALOG OUT
+# ====================================
+
+
+class _Node:
+    def __init__(self):
+        self.enabled = False
+        self.function = "sine"
+        self.frequency = 1e3
+        self.amplitude = 0.0
+        self.offset = 0.0
+
+    def setup(self, function=None, frequency=None, amplitude=None, offset=None, **_):
+        self.enabled = True
+        if function is not None:
+            self.function = function
+        if frequency is not None:
+            self.frequency = frequency
+        if amplitude is not None:
+            self.amplitude = amplitude
+        if offset is not None:
+            self.offset = offset
+
+
+class _Nodes:
+    def __init__(self):
+        self.carrier = _Node()
+        self.fm = _Node()
+        self.am = _Node()
+
+
+class AnalogOutputChannel:
+    def __init__(self, device, index):
+        self._device = device
+        self.index = index
+        self.data = None  # custom carrier buffer
+        self.reset()
+
+    def reset(self):
+        self._device._call()
+        self.nodes = _Nodes()
+        self.run_duration = 0.0
+        self.repeat_count = 0
+        self.running = False
+
+    @property
+    def single_shot(self):
+        return self.run_duration > 0 and self.repeat_count >= 1
+
+    def setup(self, function="sine", frequency=None, amplitude=None, offset=None, start=False, **_):
+        self.nodes.carrier.setup(function, frequency, amplitude, offset)
+        self.nodes.fm.enabled = False
+        self.nodes.am.enabled = False
+        self.configure(start=start)
+
+    def configure(self, start=False):
+        self._device._call()
+        self.running = False
+        if start:
+            if self.single_shot:
+                self._device._fire(self)
+            else:
+                self.running = True
+
+    def pulse(self, awg_rate):
+        """(samples, dt) of one single-shot burst: run_duration of the carrier."""
+        c = self.nodes.carrier
+        if c.function == "custom":
+            if self.data is None:
+                raise RuntimeError("custom waveform without data (dwf_analog_out_node_data_set)")
+            dt = 1.0 / (len(self.data) * c.frequency)
+            n = max(1, int(round(self.run_duration / dt)))
+            wave = np.resize(self.data, n)
+        elif c.function == "sine":
+            dt = 1.0 / awg_rate
+            n = max(1, int(round(self.run_duration / dt)))
+            wave = np.sin(2 * np.pi * c.frequency * np.arange(n) * dt)
+        else:
+            raise ValueError(f"simulated wavegen plays 'sine' or 'custom', not {c.function!r}")
+        return c.amplitude * wave + c.offset, dt
+
+
+class AnalogOutput:
+    def __init__(self, device):
+        self._channels = [AnalogOutputChannel(device, i) for i in range(N_CHANNELS)]
+
+    def __getitem__(self, index):
+        return self._channels[index]
+
+    def __len__(self):
+        return len(self._channels)
+
+    def reset(self):
+        for ch in self._channels:
+            ch.reset()
+
+
+# ====================================
+# ANALOG IN
+# ====================================
+
+
+class AnalogInputChannel:
+    def __init__(self):
+        self.range = 5.0  # peak to peak, V
+        self.offset = 0.0
+        self.coupling = "dc"
+
+    def setup(self, range=None, offset=None, coupling=None, **_):
+        if range is not None:
+            self.range = float(range)
+        if offset is not None:
+            self.offset = float(offset)
+        if coupling is not None:
+            self.coupling = coupling
+
+
+class _Trigger:
+    def __init__(self, mode, channel, slope, level, hysteresis):
+        self.mode = mode
+        self.channel = channel
+        self.slope = slope
+        self.level = level
+        self.hysteresis = hysteresis
+
+    def crossed(self, x):
+        if self.mode in ("none", "auto"):
+            return True
+        if self.slope == "rising":
+            return bool(x.max() >= self.level)
+        if self.slope == "falling":
+            return bool(x.min() <= self.level)
+        return bool(x.max() >= self.level or x.min() <= self.level)
+
+
+class RecorderChannel:
+    def __init__(self, data_samples):
+        self.data_samples = data_samples
+
+
+class Recorder:
+    def __init__(self, channels, total_samples, lost_samples):
+        self.channels = [RecorderChannel(x) for x in channels]
+        self.total_samples = total_samples
+        self.lost_samples = lost_samples
+        self.corrupted_samples = 0
+
+
+class AnalogInput:
+    def __init__(self, device):
+        self._device = device
+        self._channels = [AnalogInputChannel() for _ in range(N_CHANNELS)]
+        self._trigger = None
+
+    def __getitem__(self, index):
+        return self._channels[index]
+
+    def __len__(self):
+        return len(self._channels)
+
+    def reset(self):
+        self._device._call()
+        self._channels = [AnalogInputChannel() for _ in range(N_CHANNELS)]
+        self._trigger = None
+
+    def setup_edge_trigger(self, mode="normal", channel=0, slope="rising", level=0.0,
+                           hysteresis=0.01, **_):
+        self._trigger = _Trigger(mode, channel, slope, level, hysteresis)
+
+    def record(self, sample_rate, length, configure=True, start=True):
+        dev = self._device
+        dev._call()
+        n = int(round(sample_rate * length))
+        trig = self._trigger or _Trigger("none", 0, "rising", 0.0, 0.0)
+        w1 = dev.analog_output[0]
+        deadline = time.monotonic() + dev.trigger_timeout_s
+        with dev._cond:
+            seen = dev._fired
+
+        while True:
+            if w1.running or trig.mode in ("none", "auto"):
+                when = time.monotonic()
+                x = dev._continuous(w1, n, sample_rate)
+            else:
+                with dev._cond:
+                    if not dev._cond.wait_for(lambda: dev._fired > seen,
+                                              timeout=max(0.0, deadline - time.monotonic())):
+                        raise TimeoutError("simulated AD2: no trigger")
+                    seen = dev._fired
+                    shot = dev._shot
+                when = shot["when"]
+                x = dev._pulsed(shot, n, sample_rate)
+            x = [self._digitise(ch, xi) for ch, xi in zip(self._channels, x)]
+            if trig.crossed(x[trig.channel]):
+                break
+            if w1.running:
+                # a running output will not start crossing the level by itself
+                if dev.realtime:
+                    time.sleep(max(0.0, deadline - time.monotonic()))
+                raise TimeoutError("simulated AD2: no trigger")
+
+        keep = dev._received(n, sample_rate)
+        lost = 0 if keep is None else int(n - keep.sum())
+        if keep is not None:
+            x = [xi[keep] for xi in x]
+        if dev.realtime:
+            done = (when + length + dev.overhead_s
+                    + N_CHANNELS * 2 * (n - lost) / dev.usb_bytes_per_s)
+            time.sleep(max(0.0, done - time.monotonic()))
+        return Recorder(x, n, lost)
+
+    def _digitise(self, ch, x):
+        half = ch.range / 2
+        step = ch.range / 2**self._device.adc_bits
+        x = np.clip(x, ch.offset - half, ch.offset + half)
+        return np.round(x / step) * step
+
+
+# ====================================
+# DEVICE
+# ====================================
+
+
+class Device:
+    """
+    Simulated AD2. Settings (DEVICE_DEFAULTS) default to those given to
+    install(); model is a SpinModel, shared by devices given the same one.
+    """
+
+    name = "Analog Discovery 2"
+
+    def __init__(self, serial_number=None, **settings):
+        unknown = set(settings) - set(DEVICE_DEFAULTS)
+        if unknown:
+            raise TypeError(f"unknown simulator settings: {', '.join(sorted(unknown))}")
+        for k, v in dict(_defaults, **settings).items():
+            setattr(self, k, v)
+        if self.model is None:
+            self.model = SpinModel()
+        self.serial_number = serial_number or "SIM00000001"
+        self.handle = None
+        fire_seed, noise_seed = np.random.SeedSequence(self.seed).spawn(2)
+        self._fire_rng = np.random.default_rng(fire_seed)
+        self._noise_rng = np.random.default_rng(noise_seed)
+        self._cond = threading.Condition()
+        self._fired = 0  # pulses fired so far
+        self._shot = None  # the last one
+        self.analog_input = AnalogInput(self)
+        self.analog_output = AnalogOutput(self)
+
+    def open(self):
+        if self.handle is None:
+            self.handle = next(_handles)
+            _devices[self.handle] = self
+        return self
+
+    def close(self):
+        _devices.pop(self.handle, None)
+        self.handle = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _call(self):
+        if self.realtime:
+            time.sleep(self.call_s)
+
+    # ------------------------------------------------------------------
+    # synthesis
+    # ------------------------------------------------------------------
+
+    def _fire(self, channel):
+        """Single-shot start of a wavegen channel: excite the spins (W1 only)."""
+        with self._cond:
+            when = time.monotonic()
+            v, dt = channel.pulse(self.awg_rate)
+            shot = {"when": when, "v": v, "dt": dt, "larmor_hz": None, "mxy": 0j, "coil": None}
+            if channel.index == 0:
+                m = self.model
+                shot["larmor_hz"], shot["mxy"] = m.excite(v, dt, when, self._fire_rng)
+                shot["coil"] = m.coil(v, dt)
+            self._shot = shot
+            self._fired += 1
+            self._cond.notify_all()
+
+    def _noise(self, n):
+        """Float64 noise records for (tx_monitor, rx), drawn in float32 (twice as fast)."""
+        with self._cond:
+            rng = self._noise_rng
+            return (rng.standard_normal(n, dtype=np.float32) * np.float64(self.monitor_noise_v),
+                    rng.standard_normal(n, dtype=np.float32) * np.float64(self.model.noise_v))
+
+    def _pulsed(self, shot, n, fs):
+        """(tx_monitor, rx) of a record starting at the pulse start."""
+        m = self.model
+        tx, rx = self._noise(n)
+        with self._cond:
+            jitter = self._noise_rng.uniform(0.0, 1.0 / fs)
+        t = np.arange(n) / fs + jitter
+        v, dt, coil = shot["v"], shot["dt"], shot["coil"]
+        if coil is None:  # W2: not connected
+            return tx, rx
+        t_end = len(v) * dt
+        tp = np.arange(len(v)) * dt
+        n_on = min(n, int(np.ceil((t_end - jitter) * fs)))  # samples while W1 drives
+        td = t[:n_on]
+        tx[:n_on] += self.monitor_gain * np.interp(td, tp, v)
+        env = np.interp(td, tp, coil.real) + 1j * np.interp(td, tp, coil.imag)
+        rx[:n_on] += m.coupling * np.real(env * np.exp(2j * np.pi * m.coil_hz * td))
+
+        # ringdown, until it is 40 time constants down
+        n_ring = min(n, n_on + int(np.ceil(40 * m.ringdown_s * fs)))
+        ta = t[n_on:n_ring]
+        ring = coil[-1] * np.exp(-(ta - t_end) / m.ringdown_s + 2j * np.pi * m.coil_hz * ta)
+        rx[n_on:n_ring] += m.coupling * ring.real
+
+        ta = t[n_on:]
+        mxy = shot["mxy"]
+        decay = (m.m0_v * abs(mxy)) * np.exp(-(ta - t_end) / m.t2_s)
+        rx[n_on:] += decay * np.cos(2 * np.pi * shot["larmor_hz"] * ta + np.angle(mxy))
+        return tx, rx
+
+    def _continuous(self, w1, n, fs):
+        """(tx_monitor, rx) for a running W1 (or silence), from a random point of the waveform."""
+        m = self.model
+        tx, rx = self._noise(n)
+        if not w1.running:
+            return tx, rx
+        c = w1.nodes.carrier
+        with self._cond:
+            u = self._noise_rng.uniform()
+        t = np.arange(n) / fs
+        if c.function == "custom":
+            # steady state: every tone of the periodic buffer scaled by the response
+            k = len(w1.data)
+            spec = np.fft.rfft(w1.data)
+            wave = np.fft.irfft(spec, k)
+            resp = np.fft.irfft(spec * m.response(np.arange(len(spec)) * c.frequency), k)
+            pos = (t * c.frequency * k + u * k) % k
+            grid = np.arange(k + 1)
+            drive = np.interp(pos, grid, np.append(wave, wave[0]))
+            out = np.interp(pos, grid, np.append(resp, resp[0]))
+        elif c.function != "sine":
+            raise ValueError(f"simulated wavegen plays 'sine' or 'custom', not {c.function!r}")
+        elif w1.nodes.fm.enabled:
+            fm = w1.nodes.fm
+            if fm.function != "ramp_up":
+                raise ValueError(f"simulated FM is 'ramp_up' only, not {fm.function!r}")
+            # quasi-static: the response follows the instantaneous frequency
+            period = 1.0 / fm.frequency
+            dev = c.frequency * fm.amplitude / 100.0
+            tl = (t + u * period) % period
+            phase = 2 * np.pi * ((c.frequency - dev) * tl + dev * fm.frequency * tl * tl)
+            drive = np.sin(phase)
+            out = m.response(c.frequency - dev + 2 * dev * fm.frequency * tl) * drive
+        else:
+            drive = np.sin(2 * np.pi * (c.frequency * t + u))
+            out = m.response(c.frequency) * drive
+        tx += self.monitor_gain * (c.amplitude * drive + c.offset)
+        rx += c.amplitude * out
+        return tx, rx
+
+    def _received(self, n, fs):
+        """Mask of the samples a record-mode stream delivers (None: all of them)."""
+        if self.stream_sps is None or n <= self.buffer_samples:
+            return None
+        r = min(1.0, self.stream_sps / fs)
+        chunk = self.chunk_samples
+        c = np.arange(-(-(n - self.buffer_samples) // chunk))
+        kept = np.floor((c + 1) * r) > np.floor(c * r)
+        keep = np.ones(n, dtype=bool)
+        keep[self.buffer_samples:] = np.repeat(kept, chunk)[: n - self.buffer_samples]
+        return keep
+
+
+class AnalogDiscovery2(Device):
+    pass
+
+
+# ====================================
+# MODULE STAND-INS
+# ====================================
+
+
+def dwf_analog_out_node_data_set(hdwf, channel, node, data, n):
+    """dwfpy.bindings stand-in: load a custom carrier buffer of n doubles."""
+    if hdwf not in _devices:
+        raise RuntimeError(f"simulated AD2: no open device with handle {hdwf}")
+    if node != ANALOG_OUT_NODE_CARRIER:
+        raise ValueError("simulated wavegen takes custom data on the carrier node only")
+    samples = np.ctypeslib.as_array(ctypes.cast(data, ctypes.POINTER(ctypes.c_double)), shape=(n,))
+    _devices[hdwf].analog_output[channel].data = np.array(samples, dtype=np.float64)
+
+
+def _modules():
+    bindings = types.ModuleType("dwfpy.bindings")
+    bindings.dwf_analog_out_node_data_set = dwf_analog_out_node_data_set
+    bindings.ANALOG_OUT_NODE_CARRIER = ANALOG_OUT_NODE_CARRIER
+    bindings.ANALOG_OUT_NODE_FM = ANALOG_OUT_NODE_FM
+    bindings.ANALOG_OUT_NODE_AM = ANALOG_OUT_NODE_AM
+    dwfpy = types.ModuleType("dwfpy")
+    dwfpy.__doc__ = "Simulated AD2 (nmrkit.simdwf)"
+    dwfpy.Device = Device
+    dwfpy.AnalogDiscovery2 = AnalogDiscovery2
+    dwfpy.bindings = bindings
+    return dwfpy, bindings
+
+
+def install(model=None, **settings):
+    """
+    Make `import dwfpy` and `import dwfpy.bindings` give the simulator, in
+    place of the real package if loaded. Devices created afterwards use
+    model (shared between them) and settings unless given their own.
+    """
+    unknown = set(settings) - set(DEVICE_DEFAULTS)
+    if unknown:
+        raise TypeError(f"unknown simulator settings: {', '.join(sorted(unknown))}")
+    if model is not None:
+        _defaults["model"] = model
+    _defaults.update(settings)
+    if getattr(sys.modules.get("dwfpy"), "Device", None) is not Device:
+        sys.modules["dwfpy"], sys.modules["dwfpy.bindings"] = _modules()
+    return sys.modules["dwfpy"]
+
+
+# ====================================
+# BENCHMARKS
+# ====================================
+
+
+def bench_sweep(args):
+    from nmrkit.instrument import DwfInstrument
+    from nmrkit.sweep import SweepEngine
+
+    freq_axis = np.linspace(args.f0 - args.span / 2, args.f0 + args.span / 2, args.n_freq)
+    amp_axis = np.linspace(0.1, 2.0, args.n_amp)
+    inst = DwfInstrument()
+    engine = SweepEngine(inst, freq_axis, amp_axis, fs=10e6, record_s=500e-6, rx_range=2.0)
+    try:
+        energy_map = engine.run()
+    finally:
+        inst.close()
+    print(engine.stats.report())
+    f_dip = freq_axis[np.argmin(energy_map.mean(axis=0))]
+    print(f"dip at {f_dip/1e6:.4f} MHz (model {args.f0/1e6:.4f} MHz)")
+
+
+def bench_fid(args, model):
+    import dwfpy as dwf
+
+    from nmrkit.averaging import AveragingEngine, CoherentAverage
+    from nmrkit.ddc import DDC
+    from nmrkit.fitting import FidFitter
+    from nmrkit.pulses import Pulse
+
+    fs, record_s, f0 = 100e6, 5e-3, args.f0 - args.offset
+    n = int(fs * record_s)
+    pulse = Pulse("gaussian", 50e-6, f0=f0, fs=fs)
+    volts = pulse.volts_for(90, model.rabi_hz_per_v)
+
+    with dwf.AnalogDiscovery2() as device:
+        scope, wavegen = device.analog_input, device.analog_output[0]
+        scope[0].setup(range=5.0)
+        scope[1].setup(range=0.5)
+        scope.setup_edge_trigger(mode="normal", channel=0, slope="rising", level=0.1)
+        pulse.upload(device, wavegen, volts)
+
+        def shot():
+            # fid.ipynb's acquire_once: arm the record, then fire
+            out = {}
+            th = threading.Thread(target=lambda: out.setdefault(
+                "rec", scope.record(sample_rate=fs, length=record_s, configure=True, start=True)))
+            th.start()
+            time.sleep(args.arm_s)
+            wavegen.configure(start=True)
+            th.join()
+            rec = out["rec"]
+            if rec.lost_samples or rec.corrupted_samples:
+                return None  # dropped: padding would fake FID samples in the noise tail
+            return rec.channels[0].data_samples, rec.channels[1].data_samples
+
+        ddc = DDC(f0, fs, decimation=80)
+        avg = CoherentAverage(ddc.time_axis(n // ddc.decimation), signal=(100e-6, 1.1e-3),
+                              tail=(record_s - 1e-3, None), tx_window=(0, 50e-6))
+        engine = AveragingEngine(shot, avg, tr=args.tr, max_shots=args.shots, ddc=ddc)
+        engine.run()
+
+    print(engine.stats.report())
+    if not avg.n:
+        print("every shot lost samples: --stream-sps is below what the record needs")
+        return
+    keep = avg.t >= 100e-6
+    fit = FidFitter(avg.t[keep]).fit(avg.mean[keep])
+    print(f"SNR {avg.snr:.1f}  offset {fit.freq[0]:+.1f} +- {fit.freq_sigma[0]:.1f} Hz "
+          f"(model {args.offset:+.1f})  T2* {fit.t2[0]*1e3:.3f} ms (model {model.t2_s*1e3:.3f})")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Throughput benchmarks on the simulated AD2")
+    ap.add_argument("bench", choices=("sweep", "fid"))
+    ap.add_argument("--fast", action="store_true", help="no USB timing: as fast as the host runs")
+    ap.add_argument("--f0", type=float, default=None, help="Larmor frequency, Hz")
+    ap.add_argument("--t2-ms", type=float, default=1.0)
+    ap.add_argument("--t1-s", type=float, default=0.0, help="0: full recovery between shots")
+    ap.add_argument("--stream-sps", type=float, default=None,
+                    help="record-mode stream rate; loses samples above it")
+    ap.add_argument("--n-freq", type=int, default=100, help="sweep")
+    ap.add_argument("--n-amp", type=int, default=4, help="sweep")
+    ap.add_argument("--span", type=float, default=200e3, help="sweep, Hz")
+    ap.add_argument("--shots", type=int, default=16, help="fid")
+    ap.add_argument("--tr", type=float, default=0.0, help="fid, s")
+    ap.add_argument("--offset", type=float, default=500.0, help="fid: Larmor minus NCO, Hz")
+    ap.add_argument("--arm-s", type=float, default=0.05, help="fid: wait before firing")
+    args = ap.parse_args()
+
+    if args.f0 is None:
+        args.f0 = 2.5e6 if args.bench == "sweep" else 3.406772e6
+    model = SpinModel(larmor_hz=args.f0, t2_s=args.t2_ms * 1e-3, t1_s=args.t1_s)
+    install(model, realtime=not args.fast, stream_sps=args.stream_sps)
+    if args.bench == "sweep":
+        bench_sweep(args)
+    else:
+        bench_fid(args, model)
+
+
+if __name__ == "__main__":
+    main()
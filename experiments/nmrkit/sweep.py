@@ -0,0 +1,257 @@
+"""
+Pipelined Larmor sweep: RX energy over a (amplitude x frequency) grid.
+
+An acquisition thread tunes the instrument and records each shot into a
+bounded queue; the calling thread computes energies, fills energy_map and
+checkpoints it. Analysis of shot k thus overlaps the record of shot k+1.
+
+The checkpoint is the usual npz (energy_map, freq_axis, amp_axis) plus a
+`done` mask, rewritten atomically every checkpoint_s seconds. Running the
+same sweep again with the same path resumes from it.
+
+    engine = SweepEngine(SimInstrument(), freq_axis, amp_axis, fs=10e6, record_s=500e-6)
+    energy_map = engine.run("data/h2_tube_4.npz")
+    print(engine.stats.report())
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+STAGES = ("tune", "settle", "record", "wait", "analysis", "checkpoint")
+
+
+class SweepStats:
+    """Shot count and seconds spent per stage (acquisition and analysis threads)."""
+
+    def __init__(self, stages=STAGES):
+        self.stages = stages
+        self.seconds = defaultdict(float)
+        self.shots = 0
+        self.failed = 0
+        self.skipped = 0  # already done in a resumed checkpoint
+        self.started = None
+        self.elapsed = 0.0
+
+    def shots_per_s(self):
+        return self.shots / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        head = (f"{self.shots} shots in {self.elapsed:.1f} s ({self.shots_per_s():.1f} shots/s), "
+                f"{self.failed} failed")
+        lines = [head + (f", {self.skipped} resumed" if self.skipped else "")]
+        for stage in self.stages:
+            s = self.seconds.get(stage, 0.0)
+            per = s / self.shots * 1e3 if self.shots else 0.0
+            lines.append(f"  {stage:<10} {s:8.2f} s  {per:7.3f} ms/shot")
+        return "\n".join(lines)
+
+
+def rx_energy(x):
+    """Mean square of a record (V^2)."""
+    x = np.asarray(x, dtype=np.float32)
+    return float(np.dot(x, x)) / len(x) if len(x) else 0.0
+
+
+def save_npz(path, **arrays):
+    """np.savez to path via a temporary file, so a crash never leaves half a file."""
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+class SweepEngine:
+    """
+    instrument: see nmrkit.instrument. Shots run frequency-major (all
+    amplitudes at one frequency, then the next frequency), as in the
+    original notebook loop.
+    """
+
+    def __init__(self, instrument, freq_axis, amp_axis, fs=10e6, record_s=500e-6,
+                 rx_range=None, settle_s=0.001, analyse=rx_energy,
+                 checkpoint_s=10.0, queue_size=8):
+        self.instrument = instrument
+        self.freq_axis = np.asarray(freq_axis, dtype=float)
+        self.amp_axis = np.asarray(amp_axis, dtype=float)
+        self.fs = fs
+        self.record_s = record_s
+        self.rx_range = rx_range if rx_range is not None else float(self.amp_axis.max())
+        self.settle_s = settle_s
+        self.analyse = analyse
+        self.checkpoint_s = checkpoint_s
+        self.queue_size = queue_size
+
+        shape = (len(self.amp_axis), len(self.freq_axis))
+        self.energy_map = np.zeros(shape)
+        self.done = np.zeros(shape, dtype=bool)
+        self.stats = SweepStats()
+        self.on_shot = None  # optional callback(i_a, i_f, energy) from the analysis thread
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------
+    # checkpoints
+    # ------------------------------------------------------------------
+
+    def resume(self, path):
+        """Load finished shots from a checkpoint of the same grid; returns how many."""
+        if not os.path.exists(path):
+            return 0
+        with np.load(path) as d:
+            if "done" not in d:
+                raise ValueError(f"{path} exists and is not a sweep checkpoint")
+            if not (np.array_equal(d["freq_axis"], self.freq_axis)
+                    and np.array_equal(d["amp_axis"], self.amp_axis)):
+                raise ValueError(f"{path} is a checkpoint of a different grid")
+            self.energy_map[:] = d["energy_map"]
+            self.done[:] = d["done"]
+        return int(self.done.sum())
+
+    def checkpoint(self, path):
+        save_npz(path, energy_map=self.energy_map, freq_axis=self.freq_axis,
+                 amp_axis=self.amp_axis, done=self.done)
+
+    # ------------------------------------------------------------------
+    # run
+    # ------------------------------------------------------------------
+
+    def stop(self):
+        """Ask a running sweep to finish the current shot, checkpoint and return."""
+        self._stop.set()
+
+    def _acquire(self, shots, q, errors):
+        inst = self.instrument
+        sec = self.stats.seconds
+        try:
+            for i_a, i_f in shots:
+                if self._stop.is_set():
+                    break
+                t0 = time.perf_counter()
+                try:
+                    inst.tune(self.freq_axis[i_f], self.amp_axis[i_a])
+                    t1 = time.perf_counter()
+                    if self.settle_s:
+                        time.sleep(self.settle_s)
+                    t2 = time.perf_counter()
+                    data = inst.record()
+                except Exception as ex:  # one bad shot should not end the sweep
+                    q.put((i_a, i_f, ex))
+                    continue
+                t3 = time.perf_counter()
+                sec["tune"] += t1 - t0
+                sec["settle"] += t2 - t1
+                sec["record"] += t3 - t2
+                q.put((i_a, i_f, data))
+        except BaseException as ex:
+            errors.append(ex)
+        finally:
+            q.put(None)
+
+    def run(self, path=None, resume=True):
+        """
+        Sweep every shot not yet done and return energy_map. With a path,
+        progress is checkpointed there (and resumed from it when resume is
+        set); the finished file keeps the `done` mask.
+        """
+        if path is not None and resume:
+            self.stats.skipped = self.resume(path)
+        shots = [
+            (i_a, i_f)
+            for i_f in range(len(self.freq_axis))
+            for i_a in range(len(self.amp_axis))
+            if not self.done[i_a, i_f]
+        ]
+        self._stop.clear()
+        self.instrument.configure(self.fs, self.record_s, self.rx_range)
+
+        q = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        producer = threading.Thread(target=self._acquire, args=(shots, q, errors), daemon=True)
+        stats = self.stats
+        sec = stats.seconds
+        stats.started = time.perf_counter()
+        next_checkpoint = stats.started + self.checkpoint_s
+        producer.start()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                item = q.get()
+                t1 = time.perf_counter()
+                sec["wait"] += t1 - t0
+                if item is None:
+                    break
+                i_a, i_f, data = item
+                if isinstance(data, Exception):
+                    stats.failed += 1
+                    e = 0.0
+                    print(f"WARN shot ({i_f},{i_a}) failed: {data}")
+                else:
+                    e = self.analyse(data)
+                    self.done[i_a, i_f] = True
+                self.energy_map[i_a, i_f] = e
+                stats.shots += 1
+                if self.on_shot is not None:
+                    self.on_shot(i_a, i_f, e)
+                t2 = time.perf_counter()
+                sec["analysis"] += t2 - t1
+                if path is not None and t2 >= next_checkpoint:
+                    self.checkpoint(path)
+                    next_checkpoint = time.perf_counter() + self.checkpoint_s
+                    sec["checkpoint"] += time.perf_counter() - t2
+        finally:
+            self._stop.set()  # also stops the producer if we got here by an exception
+            while producer.is_alive():  # unblock a producer waiting on a full queue
+                try:
+                    q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            stats.elapsed = time.perf_counter() - stats.started
+            if path is not None:
+                t = time.perf_counter()
+                self.checkpoint(path)
+                sec["checkpoint"] += time.perf_counter() - t
+        if errors:
+            raise errors[0]
+        return self.energy_map
+
+    @property
+    def complete(self):
+        return bool(self.done.all())
+
+
+def main():
+    import argparse
+
+    from nmrkit.instrument import DwfInstrument, SimInstrument
+
+    ap = argparse.ArgumentParser(description="Larmor sweep (RX energy over amplitude x frequency)")
+    ap.add_argument("out", help="npz file; an unfinished one is resumed")
+    ap.add_argument("--sim", action="store_true", help="simulated instrument instead of an AD2")
+    ap.add_argument("--f0", type=float, default=2.5e6, help="centre frequency, Hz")
+    ap.add_argument("--span", type=float, default=4e6)
+    ap.add_argument("--n-freq", type=int, default=500)
+    ap.add_argument("--amp", type=float, nargs=2, default=(0.1, 2.0), metavar=("MIN", "MAX"))
+    ap.add_argument("--n-amp", type=int, default=100)
+    ap.add_argument("--fs", type=float, default=10e6)
+    ap.add_argument("--record-us", type=float, default=500.0)
+    ap.add_argument("--no-resume", action="store_true")
+    args = ap.parse_args()
+
+    freq_axis = np.linspace(args.f0 - args.span / 2, args.f0 + args.span / 2, args.n_freq)
+    amp_axis = np.linspace(args.amp[0], args.amp[1], args.n_amp)
+    inst = SimInstrument(f0=args.f0, realtime=True) if args.sim else DwfInstrument()
+    engine = SweepEngine(inst, freq_axis, amp_axis, fs=args.fs, record_s=args.record_us * 1e-6)
+    try:
+        engine.run(args.out, resume=not args.no_resume)
+    except KeyboardInterrupt:
+        print("interrupted; progress saved to", args.out)
+    finally:
+        inst.close()
+        print(engine.stats.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+import re
+import threading
 import time
+from collections import deque
+
 import serial
 
 # Tiny GRBL cheat-sheet:
@@ -7,6 +11,37 @@ import serial
 # G92 X0 Y0   = set "here" as (0,0)  (use after you manually move to origin)
 # G91         = relative moves (move by +dx, +dy)
 # G1 X.. Y.. F.. = move with feedrate (mm/min)
+# $J=G91 X.. Y.. F.. = jog (cancellable with 0x85, no G-code state change)
+#
+# Real-time commands are single bytes picked out of the serial stream by
+# GRBL's RX interrupt, so they act immediately even when the planner and
+# the line buffer are full:
+# !     = feed hold          ~    = cycle start / resume
+# ?     = status report      0x18 = soft reset (Ctrl-X)
+# 0x85  = jog cancel
+# 0x90..0x94 = feed override (100%, +10, -10, +1, -1)
+# 0x95..0x97 = rapid override (100%, 50%, 25%)
+
+RT_FEED_HOLD = b"!"
+RT_CYCLE_START = b"~"
+RT_STATUS = b"?"
+RT_SOFT_RESET = b"\x18"
+RT_JOG_CANCEL = b"\x85"
+RT_FEED_100 = b"\x90"
+RT_FEED_PLUS_10 = b"\x91"
+RT_FEED_MINUS_10 = b"\x92"
+RT_FEED_PLUS_1 = b"\x93"
+RT_FEED_MINUS_1 = b"\x94"
+RT_RAPID = {100: b"\x95", 50: b"\x96", 25: b"\x97"}
+
+# GRBL's serial RX buffer; lines in flight must fit in it.
+RX_BUFFER_SIZE = 127
+# How long _send_line waits for acks to free buffer room. GRBL acks a line
+# only once it fits in the planner, so a full planner of slow moves can hold
+# the ack back for a while.
+ACK_TIMEOUT_S = 30.0
+
+_STATUS_RE = re.compile(r"<([^|>]+)(.*)>")
 
 
 class GRBL:
@@ -16,7 +51,17 @@ class GRBL:
         self.bed_x, self.bed_y = bed_x, bed_y
         self.x, self.y = 0.0, 0.0
 
-        self.s = serial.Serial(port, baud, timeout=2)
+        self.feed_ovr = 100
+        self.rapid_ovr = 100
+        self.last_status = ""
+        self._wco = (0.0, 0.0, 0.0)  # work coordinate offset, GRBL reports it only now and then
+
+        # Byte lengths of lines sent but not yet acknowledged (char counting).
+        self._pending = deque()
+        self._rx_lock = threading.RLock()
+        self._status_event = threading.Event()
+
+        self.s = serial.Serial(port, baud, timeout=2, write_timeout=2)
         time.sleep(2)  # GRBL resets when serial opens
         self.s.write(b"\r\n\r\n")  # wake
         time.sleep(0.2)
@@ -25,21 +70,198 @@ class GRBL:
         self.cmd("$X")  # unlock
         self.cmd("G21")  # mm
 
-    def cmd(self, gcode):
-        self.s.write((gcode.strip() + "\n").encode("ascii"))
+    # ====================================
+    # LINE PROTOCOL
+    # ====================================
+
+    def _readline(self):
+        """
+        Read one line and do its bookkeeping, whoever the reader is: an
+        ok/error releases the oldest pending line from the RX count, an alarm
+        drops them all (GRBL will not ack them), a status report is stored.
+        """
+        r = self.s.readline().decode("ascii", errors="ignore").strip()
+        if r.startswith("<"):
+            # status report answering a '?', may arrive in between acks
+            self.last_status = r
+            self._status_event.set()
+        elif r == "ok" or r.startswith("error"):
+            if self._pending:
+                self._pending.popleft()
+        elif r.startswith("ALARM"):
+            self._pending.clear()
+        return r
+
+    def _read_ack(self):
+        """Read until the next ok/error/ALARM; returns "" on timeout."""
         while True:
-            r = self.s.readline().decode("ascii", errors="ignore").strip()
-            if r == "ok" or r.startswith("error"):
+            r = self._readline()
+            if not r or r == "ok" or r.startswith(("error", "ALARM")):
                 return r
+
+    def _send_line(self, line):
+        """
+        Queue one line without waiting for its ok (blocks only if GRBL's RX
+        buffer is full). Raises TimeoutError, without writing, if no ack frees
+        enough room within ACK_TIMEOUT_S.
+        """
+        data = (line.strip() + "\n").encode("ascii")
+        with self._rx_lock:
+            end = time.time() + ACK_TIMEOUT_S
+            while self._pending and sum(self._pending) + len(data) > RX_BUFFER_SIZE:
+                if time.time() > end:
+                    raise TimeoutError(f"GRBL RX buffer still full after {ACK_TIMEOUT_S:.0f} s")
+                self._read_ack()
+            self._pending.append(len(data))
+            self.s.write(data)
+
+    def cmd(self, gcode):
+        """Send a line and wait for its ok/error (and any earlier unacked lines)."""
+        with self._rx_lock:
+            self._send_line(gcode)
+            r = ""
+            while self._pending:
+                r = self._read_ack()
+                if not r or r.startswith("ALARM"):
+                    break
+            return r
+
+    # ====================================
+    # REAL-TIME COMMANDS (out-of-band)
+    # ====================================
+
+    def realtime(self, byte):
+        """
+        Write a real-time command byte straight to the port. It does not take
+        the line lock and does not wait for a reply, so it can be called from
+        another thread while cmd() is blocked waiting for the planner.
+        """
+        self.s.write(byte)
+        self.s.flush()
+
+    def feed_hold(self):
+        self.realtime(RT_FEED_HOLD)
+
+    def cycle_start(self):
+        self.realtime(RT_CYCLE_START)
+
+    def jog_cancel(self):
+        """Cancel the current jog and flush queued jogs; position stays valid."""
+        self.realtime(RT_JOG_CANCEL)
+
+    def estop(self):
+        """
+        Soft reset immediately: motion stops at once and all queued lines are
+        discarded. If the machine was moving, GRBL raises an alarm and the
+        position is lost (re-home or origin_here() after unlock()).
+        """
+        self.realtime(RT_SOFT_RESET)
+        self._after_reset()
+
+    def cancel(self, timeout_s=5.0):
+        """
+        Abort queued motion without losing position: feed hold (decelerate),
+        wait for Hold/Idle, then soft reset to flush the planner. Tracked
+        x/y are resynced from the machine.
+        """
+        self.realtime(RT_FEED_HOLD)
+        end = time.time() + timeout_s
+        while time.time() < end:
+            st = self.status()
+            if st and st["state"].split(":")[0] in ("Hold", "Idle"):
+                if st["state"] != "Hold:1":  # Hold:1 = still decelerating
+                    break
+            time.sleep(0.02)
+        self.realtime(RT_SOFT_RESET)
+        self._after_reset()
+        self.sync_position()
+
+    def soft_reset(self):
+        self.realtime(RT_SOFT_RESET)
+        self._after_reset()
+
+    def _after_reset(self, timeout_s=2.0):
+        # GRBL drops its line buffer on reset, nothing pending will be acked.
+        with self._rx_lock:
+            self._pending.clear()
+            end = time.time() + timeout_s
+            while time.time() < end:
+                r = self._readline()
+                if r.startswith("Grbl"):
+                    break
+        self.feed_ovr = 100
+        self.rapid_ovr = 100
+
+    def unlock(self):
+        return self.cmd("$X")
+
+    def feed_override(self, percent):
+        """Set feed override (10..200 %) using the fewest +/-10 and +/-1 steps."""
+        percent = max(10, min(200, int(round(percent))))
+        delta = percent - 100
+        tens, ones = divmod(abs(delta), 10)
+        plus = delta >= 0
+        seq = RT_FEED_100
+        seq += (RT_FEED_PLUS_10 if plus else RT_FEED_MINUS_10) * tens
+        seq += (RT_FEED_PLUS_1 if plus else RT_FEED_MINUS_1) * ones
+        self.realtime(seq)
+        self.feed_ovr = percent
+        return percent
+
+    def rapid_override(self, percent):
+        """Set rapid override to 100, 50 or 25 %."""
+        if percent not in RT_RAPID:
+            raise ValueError("rapid override must be one of 100, 50, 25")
+        self.realtime(RT_RAPID[percent])
+        self.rapid_ovr = percent
+
+    def status(self, timeout_s=0.5):
+        """
+        Request a status report ('?') and return it parsed as
+        {"state": "Idle", "MPos": (x, y, z), ...}, or None on timeout.
+        Safe to call while another thread is inside cmd(); that thread's
+        reader will pick up the report.
+        """
+        self._status_event.clear()
+        self.realtime(RT_STATUS)
+        end = time.time() + timeout_s
+        while not self._status_event.is_set() and time.time() < end:
+            if self._rx_lock.acquire(blocking=False):
+                try:
+                    self._readline()
+                finally:
+                    self._rx_lock.release()
             else:
-                return r
+                self._status_event.wait(0.01)
+        if not self._status_event.is_set():
+            return None
+        return parse_status(self.last_status)
+
+    def sync_position(self):
+        """Update tracked x/y from the machine's work position."""
+        st = self.status()
+        if st is None:
+            return None
+        pos = st.get("WPos")
+        if pos is None and "MPos" in st:
+            wco = st.get("WCO", self._wco)
+            pos = tuple(m - o for m, o in zip(st["MPos"], wco))
+        if "WCO" in st:
+            self._wco = st["WCO"]
+        if pos is not None:
+            self.x, self.y = pos[0], pos[1]
+        return self.x, self.y
+
+    # ====================================
+    # MOTION
+    # ====================================
 
     def origin_here(self):
         # After you manually place the head at physical origin:
         self.cmd("G92 X0 Y0")
         self.x, self.y = 0.0, 0.0
 
-    def move(self, dx=0.0, dy=0.0, F=1500):
+    def _clamp(self, dx, dy):
         # clamp to the bed (0..bed_x, 0..bed_y)
         nx, ny = self.x + dx, self.y + dy
         if nx < 0:
@@ -50,6 +272,10 @@ class GRBL:
             dx = self.bed_x - self.x
         if ny > self.bed_y:
             dy = self.bed_y - self.y
+        return dx, dy
+
+    def move(self, dx=0.0, dy=0.0, F=1500):
+        dx, dy = self._clamp(dx, dy)
 
         self.cmd("G91")  # relative mode
         self.cmd(f"G1 X{dx:.3f} Y{dy:.3f} F{F}")
@@ -58,5 +284,34 @@ class GRBL:
         self.y += dy
         return self.x, self.y
 
+    def jog(self, dx=0.0, dy=0.0, F=1500):
+        """
+        Relative jog ($J=). Returns as soon as the line is written; the ok is
+        collected by the next cmd(). Use jog_cancel() to stop it, then
+        sync_position() for the actual position.
+        """
+        dx, dy = self._clamp(dx, dy)
+        self._send_line(f"$J=G91 G21 X{dx:.3f} Y{dy:.3f} F{F}")
+        self.x += dx
+        self.y += dy
+        return self.x, self.y
+
     def close(self):
         self.s.close()
+
+
+def parse_status(line):
+    """Parse '<Idle|MPos:1.000,2.000,0.000|FS:0,0>' into a dict."""
+    m = _STATUS_RE.match(line or "")
+    if not m:
+        return None
+    out = {"state": m.group(1)}
+    for field in m.group(2).split("|"):
+        if ":" not in field:
+            continue
+        key, val = field.split(":", 1)
+        try:
+            out[key] = tuple(float(v) for v in val.split(","))
+        except ValueError:
+            out[key] = val
+    return out
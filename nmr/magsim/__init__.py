@@ -0,0 +1,4 @@
+from .magnets import MagnetArray, halbach_ring, rot_z
+from .field import compute_field, cuboid_field, dipole_field
+from .analysis import GAMMA_H, grid, homogeneity, larmor_frequency, sphere_points
+from .optimize import Design, HalbachOptimizer, field_basis
@@ -0,0 +1,47 @@
+import numpy as np
+
+GAMMA_H = 42.577478e6  # 1H gyromagnetic ratio / 2pi [Hz/T]
+
+
+def grid(extent, n):
+    """
+    Regular grid of points spanning +-extent/2 along each axis.
+    extent and n may be scalars or 3-tuples. Returns (nx, ny, nz, 3).
+    """
+    extent = np.broadcast_to(np.asarray(extent, dtype=np.float64), (3,))
+    n = np.broadcast_to(np.asarray(n, dtype=int), (3,))
+    axes = [np.linspace(-e / 2, e / 2, k) if k > 1 else np.zeros(1) for e, k in zip(extent, n)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+
+
+def sphere_points(radius, n=21, center=(0.0, 0.0, 0.0)):
+    """Points of an n^3 grid that fall inside a sphere, shape (P, 3)."""
+    pts = grid(2 * radius, n).reshape(-1, 3)
+    pts = pts[np.einsum("pi,pi->p", pts, pts) <= radius * radius * (1 + 1e-12)]
+    return pts + np.asarray(center)
+
+
+def homogeneity(b, gamma=GAMMA_H):
+    """
+    Summarise a field sample b (..., 3) [T].
+
+    Homogeneity is taken on |B|, which is what sets the Larmor frequency.
+    Returns a dict with the mean field, peak-to-peak and RMS deviation in
+    ppm, the mean field direction and the predicted Larmor frequency.
+    """
+    b = np.asarray(b).reshape(-1, 3)
+    mag = np.linalg.norm(b, axis=1)
+    b0 = mag.mean()
+    mean_vec = b.mean(axis=0)
+    return {
+        "b0": b0,
+        "ppm_pp": (mag.max() - mag.min()) / b0 * 1e6,
+        "ppm_rms": mag.std() / b0 * 1e6,
+        "direction": mean_vec / np.linalg.norm(mean_vec),
+        "larmor_hz": larmor_frequency(b0, gamma),
+    }
+
+
+def larmor_frequency(b, gamma=GAMMA_H):
+    """Larmor frequency [Hz] for a field magnitude b [T]."""
+    return gamma * np.asarray(b)
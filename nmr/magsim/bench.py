@@ -0,0 +1,47 @@
+"""
+Throughput benchmark for the field models.
+
+    python -m magsim.bench            (from nmr/)
+    python -m magsim.bench --workers 4 --sizes 20 60 120
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from .analysis import grid
+from .field import compute_field
+from .magnets import halbach_ring
+
+
+def run(sizes=(20, 40, 80), models=("dipole", "cuboid"), workers=None, repeat=3):
+    ring = halbach_ring()
+    rows = []
+    for n in sizes:
+        pts = grid(10e-3, n).reshape(-1, 3)
+        for model in models:
+            compute_field(ring, pts[:64], model=model)  # warm-up
+            best = np.inf
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                compute_field(ring, pts, model=model, workers=workers)
+                best = min(best, time.perf_counter() - t0)
+            rows.append((model, len(pts), best, len(pts) / best))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[20, 40, 80])
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print("{:>8} {:>10} {:>10} {:>14}".format("model", "points", "time [s]", "points/s"))
+    for model, n, dt, rate in run(args.sizes, workers=args.workers, repeat=args.repeat):
+        print("{:>8} {:>10d} {:>10.4f} {:>14,.0f}".format(model, n, dt, rate))
+
+
+if __name__ == "__main__":
+    main()
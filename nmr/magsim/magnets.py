@@ -0,0 +1,111 @@
+import numpy as np
+
+# All quantities are SI: metres, tesla.
+# Each magnet is a uniformly magnetised cuboid (or a point dipole when the
+# dipole model is used) described by:
+#   position      (3,)    centre of the magnet
+#   rotation      (3, 3)  local -> global rotation, columns are the cuboid edges
+#   dims          (3,)    full edge lengths in the local frame
+#   polarization  (3,)    J = mu0 * M in the global frame, |J| = remanence Br
+
+MU0 = 4e-7 * np.pi
+DEFAULT_BR = 1.3  # N42-ish NdFeB remanence [T]
+
+
+def rot_z(angle):
+    """Rotation matrix about +z by angle [rad]."""
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+class MagnetArray:
+    """Struct-of-arrays container for a set of permanent magnets."""
+
+    def __init__(self, positions, polarizations, dims, rotations=None):
+        self.positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+        self.polarizations = np.atleast_2d(
+            np.asarray(polarizations, dtype=np.float64)
+        )
+        m = len(self.positions)
+
+        dims = np.asarray(dims, dtype=np.float64)
+        self.dims = np.broadcast_to(dims, (m, 3)).copy()
+
+        if rotations is None:
+            rotations = np.broadcast_to(np.eye(3), (m, 3, 3))
+        self.rotations = np.asarray(rotations, dtype=np.float64).reshape(m, 3, 3)
+
+        if self.polarizations.shape != (m, 3):
+            raise ValueError("polarizations must have shape (M, 3)")
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def remanence(self):
+        return np.linalg.norm(self.polarizations, axis=1)
+
+    @property
+    def moments(self):
+        """Dipole moments m = J * V / mu0 [A m^2], shape (M, 3)."""
+        volume = np.prod(self.dims, axis=1)
+        return self.polarizations * (volume / MU0)[:, None]
+
+    def local_polarizations(self):
+        """Polarization expressed in each magnet's own frame, shape (M, 3)."""
+        return np.einsum("mji,mj->mi", self.rotations, self.polarizations)
+
+    def subset(self, index):
+        return MagnetArray(
+            self.positions[index],
+            self.polarizations[index],
+            self.dims[index],
+            self.rotations[index],
+        )
+
+    def concat(self, other):
+        return MagnetArray(
+            np.concatenate([self.positions, other.positions]),
+            np.concatenate([self.polarizations, other.polarizations]),
+            np.concatenate([self.dims, other.dims]),
+            np.concatenate([self.rotations, other.rotations]),
+        )
+
+    def coordinates(self):
+        """
+        Rows of (x, y, z, angle_deg, Br) in mm / deg / T, for printing and
+        export. angle_deg is the in-plane magnetisation angle.
+        """
+        j = self.polarizations
+        angle = np.degrees(np.arctan2(j[:, 1], j[:, 0]))
+        return np.column_stack(
+            [self.positions * 1e3, angle, self.remanence]
+        )
+
+
+def halbach_ring(
+    n=16,
+    radius=20e-3,
+    cube=6e-3,
+    br=DEFAULT_BR,
+    z_offsets=(0.0,),
+    k=1,
+):
+    """
+    Build a dipolar Halbach ring (or a stack of rings) of cubes.
+
+    Magnet i sits at angle theta_i = 2*pi*i/n on the given radius and is
+    magnetised at (k + 1) * theta_i in the xy-plane, which gives a uniform
+    transverse field in the bore for k = 1. The cube is rotated with its
+    magnetisation so the printed holder pockets match.
+    """
+    positions, pols, rots = [], [], []
+    for z in z_offsets:
+        for i in range(n):
+            theta = 2 * np.pi * i / n
+            phi = (k + 1) * theta
+            rot = rot_z(phi)
+            positions.append([radius * np.cos(theta), radius * np.sin(theta), z])
+            pols.append(br * rot[:, 0])
+            rots.append(rot)
+    return MagnetArray(positions, pols, (cube, cube, cube), rots)
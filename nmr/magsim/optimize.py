@@ -0,0 +1,375 @@
+import numpy as np
+
+from .analysis import homogeneity
+from .field import compute_field
+from .magnets import MagnetArray, rot_z
+
+# ====================================
+# LINEAR FIELD BASIS
+# ====================================
+# Every slot (ring magnet or shim site) contributes
+#
+#     B_s(p) = br_s * w_s * (G_s(p) + d_s * D_s(p)) @ [cos phi_s, sin phi_s]
+#
+# where G_s is the field of the slot's magnet for unit in-plane polarization
+# along x and y, D_s its derivative along the slot's radial direction, d_s a
+# small radial offset, phi_s the magnetisation angle and w_s a 0..1 scale
+# (1 for ring magnets, optimised for shims). G and D are precomputed once,
+# so evaluating a candidate is two matrix-vector products.
+
+OBJ_SCALE = 1e12  # objective in ppm^2
+
+
+def field_basis(magnets, points, model="cuboid", dr=1e-5):
+    """
+    Per-magnet response to unit in-plane polarization.
+
+    Returns (G, D), each (M, P, 3, 2): the field for J = x_hat and
+    J = y_hat, and its central-difference derivative with respect to a
+    radial displacement of the magnet.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    m = len(magnets)
+    G = np.empty((m, len(points), 3, 2))
+    D = np.empty_like(G)
+    radial = _radial_dirs(magnets.positions)
+    for s in range(m):
+        one = magnets.subset([s])
+        for j in range(2):
+            pol = np.zeros((1, 3))
+            pol[0, j] = 1.0
+            unit = MagnetArray(one.positions, pol, one.dims, one.rotations)
+            G[s, :, :, j] = compute_field(unit, points, model=model)
+
+            plus = MagnetArray(one.positions + dr * radial[s], pol, one.dims, one.rotations)
+            minus = MagnetArray(one.positions - dr * radial[s], pol, one.dims, one.rotations)
+            D[s, :, :, j] = (
+                compute_field(plus, points, model=model)
+                - compute_field(minus, points, model=model)
+            ) / (2 * dr)
+    return G, D
+
+
+def _radial_dirs(positions):
+    xy = positions.copy()
+    xy[:, 2] = 0.0
+    norm = np.linalg.norm(xy, axis=1, keepdims=True)
+    return np.divide(xy, norm, out=np.zeros_like(xy), where=norm > 0)
+
+
+# ====================================
+# DESIGN RESULT
+# ====================================
+
+
+class Design:
+    """One optimised magnet layout and its predicted homogeneity."""
+
+    def __init__(self, magnets, angles, offsets, weights, assignment, objective, report):
+        self.magnets = magnets  # realised MagnetArray (unused shims dropped)
+        self.angles = angles  # [rad] per slot
+        self.offsets = offsets  # [m] radial offset per slot
+        self.weights = weights  # 0..1 per slot
+        self.assignment = assignment  # inventory index per ring slot, or None
+        self.objective = objective  # linearised objective [ppm^2]
+        self.report = report  # homogeneity() of the exact forward model
+
+    @property
+    def ppm(self):
+        return self.report["ppm_pp"]
+
+    def coordinates(self):
+        """Rows of (x, y, z [mm], angle [deg], Br [T])."""
+        return self.magnets.coordinates()
+
+    def save_csv(self, path):
+        np.savetxt(
+            path,
+            self.coordinates(),
+            delimiter=",",
+            fmt="%.4f",
+            header="x_mm,y_mm,z_mm,angle_deg,br_t",
+            comments="",
+        )
+
+    def __repr__(self):
+        return "Design({} magnets, {:.1f} ppm p-p, B0={:.2f} mT)".format(
+            len(self.magnets), self.ppm, self.report["b0"] * 1e3
+        )
+
+
+# ====================================
+# OPTIMISER
+# ====================================
+
+
+class HalbachOptimizer:
+    """
+    Choose magnetisation angles, radial offsets, shim magnets and the
+    assignment of physical magnets to ring slots that minimise B0
+    inhomogeneity over the sample points.
+
+    ring        MagnetArray of the nominal ring (e.g. halbach_ring()).
+    points      (P, 3) sample volume (e.g. sphere_points()).
+    shims       optional MagnetArray of candidate shim sites; each shim is
+                switched on/off and its angle optimised.
+    measured    optional measured field map (P, 3) of the as-built nominal
+                ring. The part the model does not explain is kept as a
+                fixed background, so the optimiser corrects the real magnet.
+    background  optional extra fixed field (P, 3), e.g. the lab field.
+    target      optional desired field map (P, 3). When given the objective
+                is the squared error to it instead of |B| variance.
+    """
+
+    def __init__(
+        self,
+        ring,
+        points,
+        shims=None,
+        model="cuboid",
+        measured=None,
+        background=None,
+        target=None,
+        max_offset=0.5e-3,
+        max_angle=np.radians(10.0),
+    ):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.model = model
+        self.n_ring = len(ring)
+        self.slots = ring if shims is None else ring.concat(shims)
+        self.n_slots = len(self.slots)
+        self.max_offset = max_offset
+        self.max_angle = max_angle
+
+        pol = self.slots.polarizations
+        self.br = np.linalg.norm(pol, axis=1)
+        self.angles0 = np.arctan2(pol[:, 1], pol[:, 0])
+
+        G, D = field_basis(self.slots, self.points, model=model)
+        p = len(self.points)
+        # (3P, 2S) matrices so B = A @ c + Dm @ (d * c)
+        self.A = G.transpose(1, 2, 0, 3).reshape(3 * p, 2 * self.n_slots)
+        self.Dm = D.transpose(1, 2, 0, 3).reshape(3 * p, 2 * self.n_slots)
+
+        bg = np.zeros((p, 3))
+        if background is not None:
+            bg += np.asarray(background, dtype=np.float64).reshape(p, 3)
+        if measured is not None:
+            nominal = compute_field(ring, self.points, model=model)
+            bg += np.asarray(measured, dtype=np.float64).reshape(p, 3) - nominal
+        self.background = bg.ravel()
+        self.target = None if target is None else np.asarray(target, dtype=np.float64).reshape(-1)
+
+    # ---------- forward model ----------
+
+    def _coeffs(self, angles, weights, br):
+        amp = br * weights
+        return np.column_stack([amp * np.cos(angles), amp * np.sin(angles)])
+
+    def field(self, angles, offsets, weights, br=None):
+        """Linearised field (P, 3) for a parameter set."""
+        c = self._coeffs(angles, weights, self.br if br is None else br)
+        b = self.background + self.A @ c.ravel() + self.Dm @ (offsets[:, None] * c).ravel()
+        return b.reshape(-1, 3)
+
+    def _loss_grad_b(self, b):
+        """Objective [ppm^2] and its gradient with respect to B (P, 3)."""
+        p = len(b)
+        if self.target is not None:
+            t = self.target.reshape(-1, 3)
+            ref2 = np.sum(t.mean(axis=0) ** 2)
+            diff = b - t
+            loss = OBJ_SCALE * np.sum(diff * diff) / (p * ref2)
+            return loss, OBJ_SCALE * 2 * diff / (p * ref2)
+
+        mag = np.linalg.norm(b, axis=1)
+        mu = mag.mean()
+        m2 = np.mean(mag * mag)
+        loss = OBJ_SCALE * (m2 / (mu * mu) - 1.0)
+        dm = OBJ_SCALE * (2 * mag / (p * mu * mu) - 2 * m2 / (p * mu ** 3))
+        return loss, dm[:, None] * b / mag[:, None]
+
+    def loss(self, angles, offsets, weights, br=None):
+        return self._loss_grad_b(self.field(angles, offsets, weights, br))[0]
+
+    # ---------- continuous stage ----------
+
+    def _unpack(self, x):
+        s = self.n_slots
+        return x[:s], x[s : 2 * s], x[2 * s :]
+
+    def _fun_grad(self, x, br):
+        angles, offsets, weights = self._unpack(x)
+        amp = br * weights
+        cos, sin = np.cos(angles), np.sin(angles)
+        c = np.column_stack([amp * cos, amp * sin])
+
+        b = self.background + self.A @ c.ravel() + self.Dm @ (offsets[:, None] * c).ravel()
+        loss, gb = self._loss_grad_b(b.reshape(-1, 3))
+        gb = gb.ravel()
+
+        ga = (self.A.T @ gb).reshape(-1, 2)
+        gd = (self.Dm.T @ gb).reshape(-1, 2)
+        gc = ga + offsets[:, None] * gd  # dL/dc
+
+        g_angle = amp * (-sin * gc[:, 0] + cos * gc[:, 1])
+        g_offset = np.sum(gd * c, axis=1)
+        g_weight = br * (cos * gc[:, 0] + sin * gc[:, 1])
+        return loss, np.concatenate([g_angle, g_offset, g_weight])
+
+    def _bounds(self, shim_weights=None):
+        """L-BFGS-B bounds; shim_weights freezes the shims at given values."""
+        bounds = []
+        for a in self.angles0:
+            bounds.append((a - self.max_angle, a + self.max_angle))
+        for s in range(self.n_slots):
+            m = self.max_offset if s < self.n_ring else 0.0
+            bounds.append((-m, m))
+        for s in range(self.n_slots):
+            if s < self.n_ring:
+                bounds.append((1.0, 1.0))
+            elif shim_weights is not None:
+                bounds.append((shim_weights[s], shim_weights[s]))
+            else:
+                bounds.append((0.0, 1.0))
+        return bounds
+
+    def optimize_continuous(self, angles, offsets, weights, br=None, freeze_shims=False, maxiter=200):
+        from scipy.optimize import minimize
+
+        br = self.br if br is None else br
+        x0 = np.concatenate([angles, offsets, weights])
+        res = minimize(
+            self._fun_grad,
+            x0,
+            args=(br,),
+            jac=True,
+            method="L-BFGS-B",
+            bounds=self._bounds(weights if freeze_shims else None),
+            options={"maxiter": maxiter},
+        )
+        return self._unpack(res.x) + (res.fun,)
+
+    # ---------- discrete stage ----------
+
+    def optimize_discrete(self, angles, offsets, weights, br, inventory=None, assignment=None, max_sweeps=20):
+        """
+        Greedy local search over slot assignment:
+          - swap two ring slots' magnets, or replace one with an unused
+            inventory magnet (inventory = measured Br of spare magnets)
+          - switch shim sites fully on or off
+        Each move is a rank-1/rank-2 update of B, so a full sweep costs
+        O(S^2 * P).
+        """
+        br = br.copy()
+        weights = weights.copy()
+        n = self.n_ring
+        c = self._coeffs(angles, np.ones(self.n_slots), np.ones(self.n_slots))
+        # field per unit br*w for each slot, (S, 3P)
+        unit = (
+            self.A.reshape(-1, self.n_slots, 2) * c[None]
+            + self.Dm.reshape(-1, self.n_slots, 2) * (offsets[:, None] * c)[None]
+        ).sum(axis=2).T
+
+        b = self.background + (br * weights) @ unit
+
+        pool = np.array([], dtype=int)
+        if inventory is not None:
+            inventory = np.asarray(inventory, dtype=np.float64)
+            if assignment is None:
+                assignment = np.arange(n)
+            pool = np.setdiff1d(np.arange(len(inventory)), assignment)
+            br[:n] = inventory[assignment]
+
+        # shims start from the rounded continuous solution
+        for s in range(n, self.n_slots):
+            new_w = 1.0 if weights[s] >= 0.5 else 0.0
+            b = b + br[s] * (new_w - weights[s]) * unit[s]
+            weights[s] = new_w
+        best = self._loss_grad_b(b.reshape(-1, 3))[0]
+
+        for _ in range(max_sweeps):
+            improved = False
+
+            if inventory is not None:
+                for s in range(n):
+                    for t in range(s + 1, n):
+                        db = (br[t] - br[s]) * (unit[s] - unit[t])
+                        val = self._loss_grad_b((b + db).reshape(-1, 3))[0]
+                        if val < best:
+                            b, best = b + db, val
+                            br[s], br[t] = br[t], br[s]
+                            assignment[s], assignment[t] = assignment[t], assignment[s]
+                            improved = True
+                    for k_idx, k in enumerate(pool):
+                        db = (inventory[k] - br[s]) * unit[s]
+                        val = self._loss_grad_b((b + db).reshape(-1, 3))[0]
+                        if val < best:
+                            b, best = b + db, val
+                            pool[k_idx], assignment[s] = assignment[s], k
+                            br[s] = inventory[k]
+                            improved = True
+
+            for s in range(n, self.n_slots):
+                new_w = 1.0 - weights[s]
+                db = br[s] * (new_w - weights[s]) * unit[s]
+                val = self._loss_grad_b((b + db).reshape(-1, 3))[0]
+                if val < best:
+                    b, best = b + db, val
+                    weights[s] = new_w
+                    improved = True
+
+            if not improved:
+                break
+
+        return weights, br, assignment, best
+
+    # ---------- full search ----------
+
+    def realize(self, angles, offsets, weights, br):
+        """Build the physical MagnetArray; magnets rotate with their magnetisation."""
+        keep = weights > 0
+        radial = _radial_dirs(self.slots.positions)
+        pos = self.slots.positions + offsets[:, None] * radial
+        pol = np.column_stack([br * weights * np.cos(angles), br * weights * np.sin(angles), np.zeros(self.n_slots)])
+        rots = np.stack(
+            [rot_z(a - a0) @ r for a, a0, r in zip(angles, self.angles0, self.slots.rotations)]
+        )
+        return MagnetArray(pos[keep], pol[keep], self.slots.dims[keep], rots[keep])
+
+    def run(self, n_starts=8, inventory=None, seed=0, jitter=np.radians(3.0), top=None):
+        """
+        Multi-start search: random jitter of the angles, continuous
+        L-BFGS-B with analytic gradients, discrete slot search, then a
+        continuous polish. Designs are re-evaluated with the exact
+        (non-linearised) forward model and returned best first.
+        """
+        rng = np.random.default_rng(seed)
+        designs = []
+        for start in range(n_starts):
+            angles = self.angles0 + (rng.uniform(-jitter, jitter, self.n_slots) if start else 0.0)
+            offsets = np.zeros(self.n_slots)
+            weights = np.where(np.arange(self.n_slots) < self.n_ring, 1.0, 0.5)
+            br = self.br.copy()
+            assignment = None
+            if inventory is not None:
+                assignment = rng.permutation(len(inventory))[: self.n_ring] if start else np.arange(self.n_ring)
+                br[: self.n_ring] = np.asarray(inventory)[assignment]
+
+            angles, offsets, weights, _ = self.optimize_continuous(angles, offsets, weights, br)
+            weights, br, assignment, _ = self.optimize_discrete(
+                angles, offsets, weights, br, inventory, assignment
+            )
+            angles, offsets, weights, obj = self.optimize_continuous(
+                angles, offsets, weights, br, freeze_shims=True
+            )
+
+            magnets = self.realize(angles, offsets, weights, br)
+            report = homogeneity(
+                compute_field(magnets, self.points, model=self.model)
+                + self.background.reshape(-1, 3)
+            )
+            designs.append(Design(magnets, angles, offsets, weights, assignment, obj, report))
+
+        designs.sort(key=lambda d: d.ppm)
+        return designs[:top] if top else designs
@@ -1,4 +1,8 @@
-from machine import Pin, SoftI2C, PWM
+import _thread
+import time
+from array import array
+
+from machine import Pin, SoftI2C, PWM, Timer
 
 # ====================================
 # CONFIGURATION FOR GENERATORS
@@ -8,6 +12,24 @@ INA219_ADDR = 0x40
 SHUNT_RESISTOR_OHMS = 0.1  # typical value 0.1Ω (R100)
 GENERATOR_MAX_DUTY = 65535  # duty_u16 range
 
+# Sampler thread: sensor polling + PI current regulation at CONTROL_RATE_HZ,
+# publishing one telemetry sample every CONTROL_RATE_HZ // SAMPLE_RATE_HZ ticks
+CONTROL_RATE_HZ = 500
+SAMPLE_RATE_HZ = 100
+DEFAULT_KP = 20000.0  # duty per A
+DEFAULT_KI = 500000.0  # duty per A*s
+
+# Feed-forward table size per regulator
+FF_MAX_POINTS = 32
+
+# Setpoint sequencer
+SEQUENCER_TIMER_ID = 1
+SEQUENCER_TICK_HZ = 1000
+SEQUENCER_MAX_STEPS = 512
+
+# Telemetry history ring (samples); ~44 bytes each with 5 generators
+HISTORY_LEN = 1024
+
 # One combined pin map for I2C + H-bridge per generator
 # Index 0 -> Generator 1, index 1 -> Generator 2, etc.
 GENERATOR_PINS = [
@@ -23,6 +45,24 @@ GENERATOR_PINS = [
 # ====================================
 
 
+# ADC setting per channel: name -> (BADC/SADC code, conversion time in us)
+# "fast" = 12-bit single sample, "slow" = 12-bit averaged over 128 samples.
+INA219_ADC_MODES = {
+    "fast": (0b0011, 532),
+    "x2": (0b1001, 1060),
+    "x4": (0b1010, 2130),
+    "x8": (0b1011, 4260),
+    "x16": (0b1100, 8510),
+    "x32": (0b1101, 17020),
+    "x64": (0b1110, 34050),
+    "slow": (0b1111, 68100),
+}
+
+# ADC mode per generator (index 0 -> Generator 1); change with
+# INA219.configure() or /api/sensors?g=&adc=
+SENSOR_ADC = ["fast", "fast", "fast", "fast", "fast"]
+
+
 class INA219:
     REG_CONFIG = 0x00
     REG_SHUNT_VOLTAGE = 0x01
@@ -31,22 +71,53 @@ class INA219:
     REG_CURRENT = 0x04
     REG_CALIBRATION = 0x05
 
-    def __init__(self, i2c, addr=INA219_ADDR, shunt_ohms=SHUNT_RESISTOR_OHMS):
+    # Config fields: 32V bus range, /8 PGA, shunt+bus continuous
+    CFG_BASE = (1 << 13) | (0b11 << 11) | 0b111
+
+    # Bus voltage register flags
+    CNVR = 0x02  # conversion ready, cleared by reading the power register
+    OVF = 0x01  # math overflow
+
+    def __init__(self, i2c, addr=INA219_ADDR, shunt_ohms=SHUNT_RESISTOR_OHMS, adc="slow"):
         self.i2c = i2c
         self.addr = addr
         self.shunt = shunt_ohms
 
-        # 32V range, ±160mV shunt, 12-bit, 128 samples, continuous mode
-        config = 0x3FFF
-        self._write16(self.REG_CONFIG, config)
-
         # Calibration: 0.1mA per bit
         self.current_lsb = 0.0001
         self.calibration = int(0.04096 / (self.current_lsb * self.shunt))
-        self._write16(self.REG_CALIBRATION, self.calibration)
-
         self.power_lsb = self.current_lsb * 20
 
+        # Preallocated buffer for the fast path (no heap allocation per read)
+        self._buf = bytearray(2)
+
+        # Latest conversion, updated by poll()
+        self.v = 0.0
+        self.i = 0.0
+        self.v_raw = 0  # bus voltage, 4 mV / bit
+        self.i_raw = 0  # current, current_lsb / bit
+        self.overflow = False
+        self.seq = 0  # number of fresh conversions read
+        self.polls = 0
+        self.resets = 0  # chip resets detected (calibration rewritten)
+        self.ok = True  # False after a failed read, until the next good one
+        self.errors = 0
+
+        self.configure(adc)
+
+    def configure(self, adc="slow"):
+        """
+        Set ADC resolution/averaging for both shunt and bus ("fast", "x2"..
+        "x64", "slow") and (re)write config and calibration.
+        """
+        code, conv_us = INA219_ADC_MODES[adc]
+        self.adc = adc
+        # shunt and bus convert back to back in continuous mode
+        self.conversion_us = 2 * conv_us
+        self.config = self.CFG_BASE | (code << 7) | (code << 3)
+        self._write16(self.REG_CONFIG, self.config)
+        self._write16(self.REG_CALIBRATION, self.calibration)
+
     def _write16(self, reg, value):
         buf = bytearray(2)
         buf[0] = (value >> 8) & 0xFF
@@ -54,8 +125,9 @@ class INA219:
         self.i2c.writeto_mem(self.addr, reg, buf)
 
     def _read16(self, reg):
-        data = self.i2c.readfrom_mem(self.addr, reg, 2)
-        return (data[0] << 8) | data[1]
+        buf = self._buf
+        self.i2c.readfrom_mem_into(self.addr, reg, buf)
+        return (buf[0] << 8) | buf[1]
 
     def _read_signed_16(self, reg):
         raw = self._read16(reg)
@@ -63,14 +135,51 @@ class INA219:
             raw -= 65536
         return raw
 
+    def check_reset(self):
+        """
+        Rewrite config + calibration if the chip lost them (brown-out/reset).
+        Calibration powers up as 0; config can't tell, since "fast" equals
+        the power-on default.
+        """
+        if self._read16(self.REG_CALIBRATION) != self.calibration:
+            self._write16(self.REG_CONFIG, self.config)
+            self._write16(self.REG_CALIBRATION, self.calibration)
+            self.resets += 1
+            return True
+        return False
+
+    def poll(self):
+        """
+        Read a new conversion if one is ready (CNVR set). Returns True and
+        updates v / i / seq when fresh, False (one register read) otherwise.
+        """
+        self.polls += 1
+        raw = self._read16(self.REG_BUS_VOLTAGE)
+        if not raw & self.CNVR:
+            return False
+
+        cur = self._read_signed_16(self.REG_CURRENT)
+        self._read16(self.REG_POWER)  # clears CNVR
+
+        # A reset chip has calibration 0 and reports exactly 0 A; only then
+        # is the calibration register worth checking.
+        if cur == 0 and self.check_reset():
+            return False
+
+        self.v_raw = raw >> 3
+        self.i_raw = cur
+        self.v = self.v_raw * 0.004  # 4 mV / bit
+        self.i = cur * self.current_lsb
+        self.overflow = bool(raw & self.OVF)
+        self.seq += 1
+        return True
+
     def bus_voltage(self):
         raw = self._read16(self.REG_BUS_VOLTAGE)
         raw >>= 3
         return raw * 0.004  # 4 mV / bit
 
     def current_once(self):
-        # Rewrite calibration (can be lost)
-        self._write16(self.REG_CALIBRATION, self.calibration)
         raw = self._read_signed_16(self.REG_CURRENT)
         return raw * self.current_lsb
 
@@ -80,6 +189,17 @@ class INA219:
             total += self.current_once()
         return total / samples
 
+    def stats(self):
+        return {
+            "adc": self.adc,
+            "conversion_us": self.conversion_us,
+            "fresh": self.seq,
+            "polls": self.polls,
+            "resets": self.resets,
+            "errors": self.errors,
+            "overflow": self.overflow,
+        }
+
 
 # ====================================
 # H-BRIDGE CLASS
@@ -109,6 +229,102 @@ class HBridge:
         self.en_pwm.duty_u16(duty)
 
 
+# ====================================
+# PI CURRENT REGULATOR
+# ====================================
+
+
+class PIController:
+    """
+    PI regulator on current magnitude with conditional-integration
+    anti-windup: the integrator is frozen while the output is clamped and
+    the error would push it further into saturation.
+
+    setpoint is signed amps; the sign selects the H-bridge direction, the
+    measured (unsigned) current is regulated to |setpoint|.
+
+    An optional feed-forward table (|amps| -> duty, from host-side tuning)
+    supplies the bulk of the duty, so the PI terms only trim the model error.
+    """
+
+    def __init__(self, kp=DEFAULT_KP, ki=DEFAULT_KI, dt=1.0 / CONTROL_RATE_HZ):
+        self.kp = kp
+        self.ki = ki
+        self.dt = dt
+        self.enabled = False
+        self.setpoint = 0.0
+        self.ff_amps = None  # ascending |amps| breakpoints
+        self.ff_duty = None
+        self.ff = 0.0  # feed-forward duty for the current setpoint
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.last_seq = -1  # sensor seq of the last conversion used
+        self.last_us = None
+        self.error = 0.0
+        self.measured = 0.0
+        self.output = 0
+        self.saturated = 0  # -1 low, 0 none, +1 high
+        self.err_sq_sum = 0.0
+        self.err_count = 0
+
+    def update(self, measured, dt=None):
+        """Return the new duty (0..GENERATOR_MAX_DUTY) for a measured |current|."""
+        self.measured = measured
+        e = abs(self.setpoint) - measured
+        self.error = e
+        self.err_sq_sum += e * e
+        self.err_count += 1
+
+        integral = self.integral + self.ki * e * (self.dt if dt is None else dt)
+        u = self.ff + self.kp * e + integral
+        if u >= GENERATOR_MAX_DUTY:
+            u = GENERATOR_MAX_DUTY
+            self.saturated = 1
+            if e < 0:
+                self.integral = integral
+        elif u <= 0:
+            u = 0
+            self.saturated = -1
+            if e > 0:
+                self.integral = integral
+        else:
+            self.saturated = 0
+            self.integral = integral
+        self.output = int(u)
+        return self.output
+
+    def rms_error(self):
+        if not self.err_count:
+            return 0.0
+        return (self.err_sq_sum / self.err_count) ** 0.5
+
+    def set_feedforward(self, amps, duty):
+        """Install (or with empty lists clear) the |amps| -> duty table."""
+        if len(amps) != len(duty) or len(amps) > FF_MAX_POINTS:
+            raise ValueError("bad feed-forward table")
+        for k in range(1, len(amps)):
+            if amps[k] <= amps[k - 1]:
+                raise ValueError("feed-forward amps must be ascending")
+        self.ff_amps = list(amps) if amps else None
+        self.ff_duty = list(duty) if amps else None
+        self.ff = self.feedforward(abs(self.setpoint))
+
+    def feedforward(self, amps):
+        """Duty for |amps| by linear interpolation (clamped to the table ends)."""
+        xs, ys = self.ff_amps, self.ff_duty
+        if not xs or amps <= 0:
+            return 0.0
+        if amps <= xs[0]:
+            return ys[0] * amps / xs[0] if xs[0] > 0 else ys[0]
+        for k in range(1, len(xs)):
+            if amps <= xs[k]:
+                f = (amps - xs[k - 1]) / (xs[k] - xs[k - 1])
+                return ys[k - 1] + f * (ys[k] - ys[k - 1])
+        return ys[-1]
+
+
 # ====================================
 # GLOBAL HARDWARE STATE
 # ====================================
@@ -117,7 +333,40 @@ i2c_buses = []
 sensors = []  # list of INA219 or None
 generators = []  # list of HBridge
 generator_states = []  # [{'dir': 'stop'|'fwd'|'rev', 'duty': int}, ...]
-sensor_values = []  # [{'v': float, 'i': float} or None, ...]
+sample_seq = 0  # sequence number of the latest published sample
+sample_ticks_ms = 0  # time.ticks_ms() of the latest sample
+regulators = []  # one PIController per generator
+# Held by the sampler from a regulator's enabled check to its bridge write,
+# and by every path that enables or disables a regulator, so a stop from the
+# web thread or the sequencer is never overwritten by a stale duty. Never
+# taken from a Timer callback: it is not reentrant, and an IRQ that fires
+# while the main thread holds it would deadlock the board.
+regulator_lock = _thread.allocate_lock()
+
+# Latest sample, double buffered: the sampler fills the back buffer and
+# swaps it in under sample_lock; the web task copies the front one with
+# read_latest(). A buffer is {"seq", "ts", "v": [..], "i": [..], "duty": [..]}
+# with v/i None where a sensor is missing or failed.
+sample_lock = _thread.allocate_lock()
+sample_buffers = [None, None]
+sample_front = 0
+
+# Sampler thread; sampler_done is held while it runs
+sampler_running = False
+sampler_done = _thread.allocate_lock()
+publish_every = 1  # sampler ticks per published sample, see set_sample_rate()
+pending_adc = {}  # gen_index -> ADC mode, applied by the sampler between polls
+
+# History ring, column-wise so /api/history can send slices as-is.
+# Sample with sequence number s lives in slot s % HISTORY_LEN; per-generator
+# columns are indexed slot * n_generators + gen_index.
+history_ts = None  # array('I') ticks_ms
+history_v = None  # array('h') raw bus voltage, -1 = no sensor
+history_i = None  # array('h') raw current
+history_duty = None  # array('i') signed duty (negative = rev)
+
+# Sampler loop timing (microseconds)
+control_stats = {}
 
 
 # ====================================
@@ -127,7 +376,7 @@ sensor_values = []  # [{'v': float, 'i': float} or None, ...]
 
 def setup_hardware(i2c_freq):
     """Initialise all I2C buses, sensors, and generator drivers."""
-    global i2c_buses, sensors, generators, generator_states, sensor_values
+    global i2c_buses, sensors, generators, generator_states
 
     from machine import SoftI2C, Pin  # local import for MicroPython
 
@@ -156,31 +405,34 @@ def setup_hardware(i2c_freq):
             )
             sensors.append(None)
         else:
-            sensor = INA219(i2c, INA219_ADDR, SHUNT_RESISTOR_OHMS)
+            sensor = INA219(i2c, INA219_ADDR, SHUNT_RESISTOR_OHMS, SENSOR_ADC[idx])
             sensors.append(sensor)
 
     # --- H-bridges for generators ---
     print("Setting up H-bridges for generators...")
+    regulators.clear()
     generators = []
     generator_states = []
-    sensor_values = []
 
     for idx, pins in enumerate(GENERATOR_PINS):
         gen_id = idx + 1
         g = HBridge(pins["en"], pins["in1"], pins["in2"])
         generators.append(g)
         generator_states.append({"dir": "stop", "duty": 0})
-        sensor_values.append({"v": 0.0, "i": 0.0})
+        regulators.append(PIController())
         print(
             "Generator {} -> EN={}, IN1={}, IN2={}".format(
                 gen_id, pins["en"], pins["in1"], pins["in2"]
             )
         )
 
+    init_history(len(generators))
+    sample_buffers[0] = new_sample(len(generators))
+    sample_buffers[1] = new_sample(len(generators))
+
     # Rebind globals
     globals()["generators"] = generators
     globals()["generator_states"] = generator_states
-    globals()["sensor_values"] = sensor_values
 
     return sensors, generators
 
@@ -217,21 +469,525 @@ def stop_all_generators():
         set_generator(idx, "stop", 0)
 
 
+def _write_duty(gen_index, duty):
+    """Drive a generator from a signed duty (negative = rev)."""
+    if duty > 0:
+        set_generator(gen_index, "fwd", duty)
+    elif duty < 0:
+        set_generator(gen_index, "rev", -duty)
+    else:
+        set_generator(gen_index, "stop", 0)
+
+
+def apply_duties(duties):
+    """
+    Set every generator from a list of signed duties (negative = rev) in
+    one pass, releasing their PI regulators first. Release and writes are
+    one critical section, so neither the sampler nor a sequencer step can
+    re-enable a regulator halfway through.
+    """
+    with regulator_lock:
+        for idx in range(min(len(duties), len(generators))):
+            if idx < len(regulators):
+                regulators[idx].enabled = False
+            _write_duty(idx, duties[idx])
+
+
 # ====================================
 # SENSOR UPDATE
 # ====================================
 
 
-def update_sensors():
-    """Read all sensors and store in sensor_values."""
+def init_history(n_generators):
+    global history_ts, history_v, history_i, history_duty
+    history_ts = array("I", [0] * HISTORY_LEN)
+    history_v = array("h", [0] * (HISTORY_LEN * n_generators))
+    history_i = array("h", [0] * (HISTORY_LEN * n_generators))
+    history_duty = array("i", [0] * (HISTORY_LEN * n_generators))
+
+
+def new_sample(n_generators):
+    n = n_generators
+    return {"seq": 0, "ts": 0, "v": [None] * n, "i": [None] * n, "duty": [0] * n}
+
+
+def poll_sensors():
+    """
+    Poll every sensor once; only fresh conversions (CNVR) are read out.
+    Pending ADC mode changes are applied here so the bus has one user.
+    """
     for idx, sensor in enumerate(sensors):
         if sensor is None:
-            sensor_values[idx] = None
             continue
         try:
-            v_bus = sensor.bus_voltage()
-            current = sensor.current_avg(4)
-            sensor_values[idx] = {"v": v_bus, "i": current}
-        except Exception as e:
-            print("Sensor read error on G{}:".format(idx + 1), e)
-            sensor_values[idx] = None
+            if idx in pending_adc:
+                sensor.configure(pending_adc.pop(idx))
+            sensor.poll()
+            sensor.ok = True
+        except OSError as e:
+            if sensor.ok:  # report once per failure, not every tick
+                print("Sensor read error on G{}:".format(idx + 1), e)
+            sensor.ok = False
+            sensor.errors += 1
+
+
+def publish_sample():
+    """
+    Record the latest conversions as the next sample: fill the back buffer
+    and the history ring slot, then swap the buffers under sample_lock.
+    """
+    global sample_front, sample_seq, sample_ticks_ms
+    seq = sample_seq + 1
+    slot = seq % HISTORY_LEN
+    base = slot * len(generators)
+    back = sample_buffers[sample_front ^ 1]
+    v, i, d = back["v"], back["i"], back["duty"]
+    for idx, sensor in enumerate(sensors):
+        state = generator_states[idx]
+        duty = state["duty"]
+        if state["dir"] == "rev":
+            duty = -duty
+        elif state["dir"] == "stop":
+            duty = 0
+        d[idx] = duty
+        history_duty[base + idx] = duty
+
+        if sensor is None or not sensor.ok:
+            v[idx] = None
+            i[idx] = None
+            history_v[base + idx] = -1
+            history_i[base + idx] = 0
+        else:
+            v[idx] = sensor.v
+            i[idx] = sensor.i
+            history_v[base + idx] = sensor.v_raw
+            history_i[base + idx] = sensor.i_raw
+
+    ts = time.ticks_ms()
+    back["seq"] = seq
+    back["ts"] = ts
+    history_ts[slot] = ts
+    with sample_lock:
+        sample_front ^= 1
+        sample_seq = seq
+        sample_ticks_ms = ts
+
+
+def read_latest(out=None):
+    """
+    Copy the latest published sample into out (a new_sample() dict,
+    allocated if None) and return it. The lock is only held for the copy.
+    """
+    if out is None:
+        out = new_sample(len(generators))
+    with sample_lock:
+        src = sample_buffers[sample_front]
+        out["seq"] = src["seq"]
+        out["ts"] = src["ts"]
+        out["v"][:] = src["v"]
+        out["i"][:] = src["i"]
+        out["duty"][:] = src["duty"]
+    return out
+
+
+def update_sensors():
+    """Poll all sensors and publish one sample (single-loop use, no sampler thread)."""
+    poll_sensors()
+    publish_sample()
+
+
+def set_adc_mode(gen_index, mode):
+    """Change a sensor's ADC mode; done by the sampler thread when it runs."""
+    if sampler_running:
+        pending_adc[gen_index] = mode
+    else:
+        sensors[gen_index].configure(mode)
+
+
+def history_range(since, max_samples, guard=32):
+    """
+    (first_seq, count) of the samples newer than since that are still in
+    the ring. The oldest `guard` slots are skipped because the sampler may
+    overwrite them while a response is being sent.
+    """
+    oldest = max(1, sample_seq - HISTORY_LEN + 1 + guard)
+    first = max(since + 1, oldest)
+    count = min(max_samples, sample_seq - first + 1)
+    return first, max(0, count)
+
+
+# ====================================
+# CLOSED-LOOP CONTROL
+# ====================================
+
+
+def reset_control_stats():
+    for reg in regulators:
+        reg.err_sq_sum = 0.0
+        reg.err_count = 0
+    control_stats.update(
+        {
+            "ticks": 0,
+            "period_min_us": 0,
+            "period_max_us": 0,
+            "period_sum_us": 0,
+            "exec_max_us": 0,
+            "exec_sum_us": 0,
+            "overruns": 0,
+            "_last_us": None,
+        }
+    )
+
+
+def set_gains(gen_index, kp=None, ki=None):
+    """
+    Retune a generator's PI loop without touching its setpoint. The
+    integral is held in duty units, so a running channel does not jump.
+    """
+    if gen_index < 0 or gen_index >= len(regulators):
+        return
+    reg = regulators[gen_index]
+    if kp is not None:
+        reg.kp = kp
+    if ki is not None:
+        reg.ki = ki
+
+
+def set_setpoint(gen_index, amps, kp=None, ki=None):
+    """
+    Enable PI regulation of a generator at a signed current (A).
+    amps == 0 stops the generator and disables its regulator.
+    """
+    if gen_index < 0 or gen_index >= len(regulators):
+        return
+    set_gains(gen_index, kp, ki)
+    with regulator_lock:
+        _set_setpoint(gen_index, amps)
+
+
+def _set_setpoint(gen_index, amps):
+    # caller holds regulator_lock
+    reg = regulators[gen_index]
+    if amps == 0:
+        reg.enabled = False
+        reg.setpoint = 0.0
+        set_generator(gen_index, "stop", 0)
+        return
+
+    # a sign change means the bridge reverses: restart from zero
+    if reg.setpoint * amps <= 0:
+        reg.reset()
+    reg.setpoint = amps
+    reg.ff = reg.feedforward(abs(amps))
+    reg.enabled = True
+
+
+def release_regulator(gen_index):
+    """
+    Hand a generator back to manual duty control. Once this returns the
+    sampler writes no more duties to it, so the caller's own write sticks.
+    """
+    if 0 <= gen_index < len(regulators):
+        with regulator_lock:
+            regulators[gen_index].enabled = False
+
+
+def _regulate(t0):
+    """Run every enabled PI regulator that has a new conversion since its last update."""
+    for idx in range(len(regulators)):
+        reg = regulators[idx]
+        sensor = sensors[idx]
+        with regulator_lock:
+            if not reg.enabled or sensor is None or not sensor.ok:
+                continue
+            # only act on a new conversion; in averaged ADC modes that is
+            # slower than the tick, so integrate over the real interval
+            if sensor.seq == reg.last_seq:
+                continue
+            reg.last_seq = sensor.seq
+            dt = None
+            if reg.last_us is not None:
+                dt = time.ticks_diff(t0, reg.last_us) / 1000000
+            reg.last_us = t0
+            duty = reg.update(abs(sensor.i), dt)
+            set_generator(idx, "fwd" if reg.setpoint > 0 else "rev", duty)
+
+
+def _record_timing(t0, t1):
+    st = control_stats
+    last = st["_last_us"]
+    st["ticks"] += 1
+    exec_us = time.ticks_diff(t1, t0)
+    st["exec_sum_us"] += exec_us
+    if exec_us > st["exec_max_us"]:
+        st["exec_max_us"] = exec_us
+    if last is not None:
+        period = time.ticks_diff(t0, last)
+        st["period_sum_us"] += period
+        if st["period_min_us"] == 0 or period < st["period_min_us"]:
+            st["period_min_us"] = period
+        if period > st["period_max_us"]:
+            st["period_max_us"] = period
+        if exec_us > 1000000 // st["rate_hz"]:
+            st["overruns"] += 1
+    st["_last_us"] = t0
+
+
+# ====================================
+# SAMPLER THREAD
+# ====================================
+# Sensor polling, PI regulation and sample publishing run in their own
+# _thread, so a slow HTTP client or handler cannot stretch the sampling
+# period. MicroPython threads share a GIL, which the web thread gets back
+# every time the sampler sleeps.
+
+
+def _sampler_main(period_us, on_sample):
+    ticks = 0
+    next_us = time.ticks_us()
+    try:
+        while sampler_running:
+            t0 = time.ticks_us()
+            poll_sensors()
+            sequencer.apply_due()
+            _regulate(t0)
+            ticks += 1
+            if ticks >= publish_every:
+                ticks = 0
+                publish_sample()
+                if on_sample is not None:
+                    on_sample()
+            _record_timing(t0, time.ticks_us())
+
+            next_us = time.ticks_add(next_us, period_us)
+            delay = time.ticks_diff(next_us, time.ticks_us())
+            if delay < 0:  # overran, resync instead of bursting
+                next_us = time.ticks_us()
+            elif delay >= 1000:
+                # whole ms only: sleep_us busy-waits holding the GIL;
+                # the remainder is made up on the next tick
+                time.sleep_ms(delay // 1000)
+    finally:
+        sampler_done.release()
+
+
+def start_sampler(rate_hz=CONTROL_RATE_HZ, sample_hz=SAMPLE_RATE_HZ, on_sample=None):
+    """
+    Start the sampler thread: poll sensors and run the PI regulators at
+    rate_hz, publish a sample at sample_hz (changed later with
+    set_sample_rate()). on_sample() is called from the
+    sampler thread after each publish, so it must be thread safe
+    (e.g. uasyncio.ThreadSafeFlag.set).
+    """
+    global sampler_running
+    if sampler_running:
+        return
+    reset_control_stats()
+    control_stats["rate_hz"] = rate_hz
+    for reg in regulators:
+        reg.dt = 1.0 / rate_hz
+    set_sample_rate(sample_hz)
+    sampler_running = True
+    sampler_done.acquire()
+    _thread.start_new_thread(_sampler_main, (1000000 // rate_hz, on_sample))
+
+
+def set_sample_rate(sample_hz):
+    """
+    Publish a sample every CONTROL_RATE_HZ // sample_hz sampler ticks
+    (telemetry stream and history ring). Returns the rate actually used.
+    """
+    global publish_every
+    rate_hz = control_stats.get("rate_hz") or CONTROL_RATE_HZ
+    publish_every = max(1, min(rate_hz, rate_hz // max(1, int(sample_hz))))
+    return rate_hz / publish_every
+
+
+def stop_sampler():
+    """Stop the sampler thread (waits for its current tick) and all regulators."""
+    global sampler_running
+    if sampler_running:
+        sampler_running = False
+        sampler_done.acquire()
+        sampler_done.release()
+    for reg in regulators:
+        reg.enabled = False
+
+
+def regulator_report():
+    """Per-channel tracking state plus loop timing statistics."""
+    st = control_stats
+    ticks = st.get("ticks", 0)
+    periods = max(1, ticks - 1)
+    channels = []
+    for idx, reg in enumerate(regulators):
+        channels.append(
+            {
+                "id": idx + 1,
+                "enabled": reg.enabled,
+                "setpoint": reg.setpoint,
+                "measured": reg.measured,
+                "error": reg.error,
+                "rms_error": reg.rms_error(),
+                "duty": reg.output,
+                "saturated": reg.saturated,
+                "kp": reg.kp,
+                "ki": reg.ki,
+                "ff": reg.ff,
+                "ff_points": len(reg.ff_amps) if reg.ff_amps else 0,
+            }
+        )
+    timing = {
+        "rate_hz": st.get("rate_hz", 0),
+        "sample_hz": st.get("rate_hz", 0) / publish_every,
+        "ticks": ticks,
+        "period_min_us": st.get("period_min_us", 0),
+        "period_max_us": st.get("period_max_us", 0),
+        "period_mean_us": st.get("period_sum_us", 0) / periods,
+        "exec_max_us": st.get("exec_max_us", 0),
+        "exec_mean_us": st.get("exec_sum_us", 0) / max(1, ticks),
+        "overruns": st.get("overruns", 0),
+    }
+    return {"channels": channels, "timing": timing}
+
+
+# ====================================
+# SETPOINT SEQUENCER (timer driven)
+# ====================================
+
+
+class Sequencer:
+    """
+    Time-scheduled setpoint program. Entries are (t_ms, gen_index, kind,
+    value) with kind "amps" (PI setpoint) or "duty" (signed duty). Entries
+    sharing a t_ms form one step. The timer only queues due steps; the
+    sampler applies them (apply_due) under regulator_lock, one control
+    period later at most.
+    """
+
+    def __init__(self):
+        self.timer = None
+        self.clear()
+
+    def clear(self):
+        self.step_ms = []  # due time per step, relative to start
+        self.step_actions = []  # [(gen_index, kind, value), ...] per step
+        self.lateness_us = []  # lateness of each step's last execution
+        self.due = []  # (step index, due ticks_us) queued by _tick
+        self.loop = False
+        self.period_ms = 0
+        self.running = False
+        self.index = 0
+        self.iteration = 0
+        self.start_ms = 0  # time.ticks_ms() at start (telemetry time base)
+        self.max_lateness_us = 0
+
+    def load(self, entries, loop=False, period_ms=None):
+        """Load a program; raises ValueError on malformed entries."""
+        self.stop()
+        self.clear()
+        entries = sorted(entries, key=lambda e: e[0])
+        for t_ms, gen_id, kind, value in entries:
+            t_ms = int(t_ms)
+            gen_index = int(gen_id) - 1
+            if gen_index < 0 or gen_index >= len(generators) or t_ms < 0:
+                raise ValueError("bad entry")
+            if kind == "amps":
+                value = float(value)
+            elif kind == "duty":
+                value = int(value)
+            else:
+                raise ValueError("bad kind")
+            if not self.step_ms or self.step_ms[-1] != t_ms:
+                if len(self.step_ms) >= SEQUENCER_MAX_STEPS:
+                    raise ValueError("too many steps")
+                self.step_ms.append(t_ms)
+                self.step_actions.append([])
+            self.step_actions[-1].append((gen_index, kind, value))
+        self.lateness_us = [0] * len(self.step_ms)
+        self.loop = loop
+        # loop period defaults to one tick past the last step
+        last = self.step_ms[-1] if self.step_ms else 0
+        self.period_ms = int(period_ms) if period_ms else last + 1
+        if self.period_ms <= last:
+            raise ValueError("period_ms must be after the last step")
+        return len(self.step_ms)
+
+    def start(self, delay_ms=0):
+        if not self.step_ms:
+            return False
+        self.stop()
+        self.index = 0
+        self.iteration = 0
+        self.max_lateness_us = 0
+        now_us = time.ticks_us()
+        self._t0_us = time.ticks_add(now_us, delay_ms * 1000)
+        self.start_ms = time.ticks_add(time.ticks_ms(), delay_ms)
+        self.running = True
+        self.timer = Timer(SEQUENCER_TIMER_ID)
+        self.timer.init(freq=SEQUENCER_TICK_HZ, mode=Timer.PERIODIC, callback=self._tick)
+        return True
+
+    def stop(self):
+        self._stop_timer()
+        # drop queued steps, so none lands after a stop the caller writes next
+        with regulator_lock:
+            self.due = []
+
+    def _stop_timer(self):
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
+        self.running = False
+
+    def apply_due(self):
+        """Apply the queued steps; called by the sampler thread only."""
+        while self.due:
+            with regulator_lock:
+                if not self.due:  # cleared by stop() meanwhile
+                    return
+                index, due_us = self.due.pop(0)
+                for gen_index, kind, value in self.step_actions[index]:
+                    if kind == "amps":
+                        _set_setpoint(gen_index, value)
+                    else:
+                        regulators[gen_index].enabled = False
+                        _write_duty(gen_index, value)
+            late = time.ticks_diff(time.ticks_us(), due_us)
+            self.lateness_us[index] = late
+            if late > self.max_lateness_us:
+                self.max_lateness_us = late
+
+    def _tick(self, _timer):
+        # Timer callback: queue due steps, never touch regulator_lock here
+        now = time.ticks_us()
+        # catch up on every step that is due (normally at most one)
+        while self.running:
+            due = time.ticks_add(self._t0_us, self.step_ms[self.index] * 1000)
+            if time.ticks_diff(now, due) < 0:
+                return
+            self.due.append((self.index, due))
+            self.index += 1
+            if self.index >= len(self.step_ms):
+                if not self.loop:
+                    self._stop_timer()  # queued steps still get applied
+                    return
+                self.index = 0
+                self.iteration += 1
+                self._t0_us = time.ticks_add(self._t0_us, self.period_ms * 1000)
+
+    def report(self):
+        return {
+            "running": self.running,
+            "steps": len(self.step_ms),
+            "loop": self.loop,
+            "period_ms": self.period_ms,
+            "index": self.index,
+            "iteration": self.iteration,
+            "start_ms": self.start_ms,
+            "max_lateness_us": self.max_lateness_us,
+            "lateness_us": self.lateness_us,
+        }
+
+
+sequencer = Sequencer()
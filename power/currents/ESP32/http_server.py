@@ -1,4 +1,10 @@
-import socket
+try:
+    import uasyncio as asyncio
+except ImportError:  # CPython (host-side load tests)
+    import asyncio
+import struct
+import time
+
 import ujson
 
 import hardware
@@ -71,9 +77,28 @@ document.addEventListener('DOMContentLoaded', () => {
   }
   document.querySelector('tbody').innerHTML = rows.join('');
   refreshState();
-  setInterval(refreshState, 500);
+  startStream();
 });
 
+// Telemetry push: "seq,ts_ms,v1,i1,d1,v2,i2,d2,..." (d = signed duty)
+function startStream() {
+  const es = new EventSource('/api/stream');
+  es.onmessage = (ev) => {
+    const f = ev.data.split(',');
+    for (let id = 1; id <= NUM_GENERATORS; id++) {
+      const k = 2 + (id - 1) * 3;
+      const d = parseInt(f[k + 2]);
+      document.getElementById('dir' + id).textContent = d > 0 ? 'fwd' : (d < 0 ? 'rev' : 'stop');
+      document.getElementById('v' + id).textContent = f[k] !== '' ? parseFloat(f[k]).toFixed(2) : 'N/A';
+      document.getElementById('i' + id).textContent = f[k + 1] !== '' ? parseFloat(f[k + 1]).toFixed(3) : 'N/A';
+    }
+    document.getElementById('status').textContent = 'Sample ' + f[0];
+  };
+  es.onerror = () => {
+    document.getElementById('status').textContent = 'Stream lost, reconnecting...';
+  };
+}
+
 function sendControl(g, dir) {
   const duty = document.getElementById('duty' + g).value;
   fetch(`/api/control?g=${g}&dir=${dir}&duty=${duty}`)
@@ -125,6 +150,34 @@ def build_html():
 # HTTP HELPERS
 # ====================================
 
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+CT_JSON = "application/json"
+CT_HTML = "text/html"
+CT_TEXT = "text/plain"
+CT_BINARY = "application/octet-stream"
+
+MAX_HEADER_LINES = 32
+MAX_BODY = 16384  # sequencer programs
+
+# Full responses for "/" (headers + page) keyed by keep-alive, built once
+# in start_http_server
+_page_response = {}
+
+
+def unquote(s):
+    """Decode %XX escapes and '+' in a query string component."""
+    if "%" not in s and "+" not in s:
+        return s
+    s = s.replace("+", " ")
+    parts = s.split("%")
+    out = [parts[0]]
+    for part in parts[1:]:
+        try:
+            out.append(chr(int(part[:2], 16)) + part[2:])
+        except ValueError:
+            out.append("%" + part)
+    return "".join(out)
+
 
 def parse_query(path):
     """Return (route, params_dict) from a request path like /api/control?g=1&duty=100."""
@@ -137,108 +190,472 @@ def parse_query(path):
         for pair in qs.split("&"):
             if "=" in pair:
                 k, v = pair.split("=", 1)
-                params[k] = v
+                params[unquote(k)] = unquote(v)
     return route, params
 
 
-def handle_client(conn):
+def build_response(status, content_type, body, keep_alive=True):
+    """
+    Return the full HTTP response as bytes (body may be str or bytes).
+    A body given as a list of (buffer, nbytes) parts is not copied: the
+    result is then a list of buffers to write one after the other.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    if isinstance(body, list):
+        length = sum(n for _buf, n in body)
+    else:
+        length = len(body)
+    head = "HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+        status,
+        STATUS_TEXT.get(status, ""),
+        content_type,
+        length,
+        "keep-alive" if keep_alive else "close",
+    )
+    if isinstance(body, list):
+        return [head.encode()] + [buf for buf, _n in body]
+    return head.encode() + body
+
+
+def json_response(status, data):
+    return status, CT_JSON, ujson.dumps(data)
+
+
+# ====================================
+# API ROUTES
+# ====================================
+# Each handler takes (params, body) and returns (status, content_type, body).
+
+# Reused read_latest() buffer; handlers run one at a time on the event loop
+_state_sample = None
+
+
+def api_state(params, body):
+    sample = hardware.read_latest(_state_sample)
+    # seq/ts of the sample and the time of the reply (ticks_ms) tell a
+    # client how old the values are
+    data = {"generators": [], "seq": sample["seq"], "ts": sample["ts"], "now": time.ticks_ms()}
+    for idx in range(len(hardware.generators)):
+        state = hardware.generator_states[idx]
+        gen_id = idx + 1
+        data["generators"].append(
+            {
+                "id": gen_id,  # 1-based ID
+                "dir": state["dir"],
+                "duty": state["duty"],
+                "v": sample["v"][idx],
+                "i": sample["i"][idx],
+            }
+        )
+    return json_response(200, data)
+
+
+def api_control(params, body):
+    """
+    /api/control?g=1&dir=fwd&duty=30000 for one generator, or
+    /api/control?duties=30000,-20000,0,0,0 to set all at once (signed duty).
+    """
+    if "duties" in params:
+        try:
+            duties = [int(d) for d in params["duties"].split(",")]
+        except ValueError:
+            return json_response(400, {"ok": False, "message": "Invalid parameters"})
+        if len(duties) != len(hardware.generators):
+            return json_response(400, {"ok": False, "message": "Need one duty per generator"})
+        hardware.apply_duties(duties)
+        return json_response(200, {"ok": True, "message": "All generators set"})
+
+    try:
+        gen_id = int(params.get("g", "1"))  # 1-based from client
+        direction = params.get("dir", "stop")
+        duty = int(params.get("duty", "0"))
+    except ValueError:
+        return json_response(400, {"ok": False, "message": "Invalid parameters"})
+
+    gen_index = gen_id - 1  # convert to 0-based index
+    if gen_index < 0 or gen_index >= len(hardware.generators):
+        return json_response(400, {"ok": False, "message": "Generator ID out of range"})
+
+    hardware.release_regulator(gen_index)  # manual duty overrides the PI loop
+    hardware.set_generator(gen_index, direction, duty)
+    return json_response(
+        200,
+        {
+            "ok": True,
+            "message": "Generator {} set to {} duty {}".format(gen_id, direction, duty),
+        },
+    )
+
+
+def api_setpoint(params, body):
+    """/api/setpoint?g=1&amps=-0.25[&kp=..&ki=..]; amps=0 stops the channel."""
+    try:
+        gen_id = int(params.get("g", "1"))
+        amps = float(params.get("amps", "0"))
+        kp = float(params["kp"]) if "kp" in params else None
+        ki = float(params["ki"]) if "ki" in params else None
+    except ValueError:
+        return json_response(400, {"ok": False, "message": "Invalid parameters"})
+
+    gen_index = gen_id - 1
+    if gen_index < 0 or gen_index >= len(hardware.generators):
+        return json_response(400, {"ok": False, "message": "Generator ID out of range"})
+
+    hardware.set_setpoint(gen_index, amps, kp, ki)
+    return json_response(
+        200,
+        {"ok": True, "message": "Generator {} regulating to {} A".format(gen_id, amps)},
+    )
+
+
+def api_gains(params, body):
+    """/api/gains?g=1&kp=..&ki=..: retune the PI loop, leaving the setpoint as it is."""
+    try:
+        gen_index = int(params.get("g", "1")) - 1
+        kp = float(params["kp"]) if "kp" in params else None
+        ki = float(params["ki"]) if "ki" in params else None
+    except ValueError:
+        return json_response(400, {"ok": False, "message": "Invalid parameters"})
+    if gen_index < 0 or gen_index >= len(hardware.regulators):
+        return json_response(400, {"ok": False, "message": "Generator ID out of range"})
+    hardware.set_gains(gen_index, kp, ki)
+    reg = hardware.regulators[gen_index]
+    return json_response(200, {"ok": True, "kp": reg.kp, "ki": reg.ki})
+
+
+def _float_list(text):
+    return [float(x) for x in text.split(",")] if text else []
+
+
+def api_feedforward(params, body):
+    """
+    /api/feedforward?g=1&amps=0.1,0.2,..&duty=6000,11000,..: install the
+    |amps| -> duty table used by the regulator (empty lists clear it).
+    """
+    try:
+        gen_index = int(params.get("g", "1")) - 1
+        amps = _float_list(params.get("amps", ""))
+        duty = _float_list(params.get("duty", ""))
+    except ValueError:
+        return json_response(400, {"ok": False, "message": "Invalid parameters"})
+    if gen_index < 0 or gen_index >= len(hardware.regulators):
+        return json_response(400, {"ok": False, "message": "Generator ID out of range"})
+    try:
+        hardware.regulators[gen_index].set_feedforward(amps, duty)
+    except ValueError as e:
+        return json_response(400, {"ok": False, "message": str(e)})
+    return json_response(200, {"ok": True, "points": len(amps)})
+
+
+def api_regulator(params, body):
+    """Tracking error, saturation and loop timing; ?reset=1 clears the stats."""
+    if params.get("reset") == "1":
+        hardware.reset_control_stats()
+    return json_response(200, hardware.regulator_report())
+
+
+def api_sensors(params, body):
+    """
+    Per-sensor ADC mode and read counters; ?g=1&adc=fast|x2..x64|slow
+    reconfigures, ?sample_hz=N sets the telemetry/history sample rate.
+    """
+    if "sample_hz" in params:
+        try:
+            hardware.set_sample_rate(int(params["sample_hz"]))
+        except ValueError:
+            return json_response(400, {"ok": False, "message": "Invalid parameters"})
+    if "adc" in params:
+        try:
+            gen_index = int(params.get("g", "1")) - 1
+            sensor = hardware.sensors[gen_index] if gen_index >= 0 else None
+        except (ValueError, IndexError):
+            sensor = None
+        if sensor is None:
+            return json_response(400, {"ok": False, "message": "No sensor on that generator"})
+        if params["adc"] not in hardware.INA219_ADC_MODES:
+            return json_response(400, {"ok": False, "message": "Unknown ADC mode"})
+        hardware.set_adc_mode(gen_index, params["adc"])
+
+    rate_hz = hardware.control_stats.get("rate_hz", 0)
+    data = {"sensors": [], "sample_hz": rate_hz / hardware.publish_every}
+    for idx, sensor in enumerate(hardware.sensors):
+        entry = {"id": idx + 1}
+        if sensor is not None:
+            entry.update(sensor.stats())
+        data["sensors"].append(entry)
+    return json_response(200, data)
+
+
+def api_sequence(params, body):
+    """
+    POST a program as JSON:
+      {"steps": [[t_ms, g, "amps"|"duty", value], ...], "loop": false,
+       "period_ms": 1000, "start": true, "delay_ms": 0}
+    GET /api/sequence[?action=start&delay_ms=..|action=stop] for control
+    and status (start timestamp, per-step lateness in us).
+    """
+    seq = hardware.sequencer
+    if body:
+        try:
+            prog = ujson.loads(body)
+            n = seq.load(prog["steps"], prog.get("loop", False), prog.get("period_ms"))
+        except (ValueError, KeyError, TypeError) as e:
+            return json_response(400, {"ok": False, "message": "Bad program: {}".format(e)})
+        if prog.get("start"):
+            seq.start(int(prog.get("delay_ms", 0)))
+        return json_response(200, {"ok": True, "steps": n, "sequence": seq.report()})
+
+    action = params.get("action")
+    if action == "start":
+        try:
+            delay_ms = int(params.get("delay_ms", "0"))
+        except ValueError:
+            return json_response(400, {"ok": False, "message": "Invalid parameters"})
+        if not seq.start(delay_ms):
+            return json_response(400, {"ok": False, "message": "No program loaded"})
+    elif action == "stop":
+        seq.stop()
+    return json_response(200, {"ok": True, "sequence": seq.report()})
+
+
+# Binary /api/history block: header, then column arrays (little-endian)
+#   ts[count] u32 ticks_ms, v[count][n] i16, i[count][n] i16, duty[count][n] i32
+# v is in 4 mV steps (-1 = no sensor), i in current_lsb steps.
+HISTORY_MAGIC = b"HIST"
+HISTORY_VERSION = 1
+HISTORY_HEADER = "<4sBBHIIff"  # magic, version, n, count, first_seq, latest_seq, v_lsb, i_lsb
+HISTORY_MAX = 512
+
+
+def _ring_parts(buf, first, count, width, itemsize):
+    """(memoryview, nbytes) parts covering `count` samples of a ring array, split at the wrap."""
+    mv = memoryview(buf)
+    start = first % hardware.HISTORY_LEN
+    n1 = min(count, hardware.HISTORY_LEN - start)
+    parts = [(mv[start * width : (start + n1) * width], n1 * width * itemsize)]
+    if count > n1:
+        parts.append((mv[0 : (count - n1) * width], (count - n1) * width * itemsize))
+    return parts
+
+
+def api_history(params, body):
+    """
+    GET /api/history?since=<seq>[&max=N]: the samples after `since` that
+    are still buffered on the device, as one binary block (see HISTORY_HEADER).
+    A client that lost the stream asks again with since = last seq it has;
+    first_seq > since + 1 tells it how many samples are gone for good.
+    """
+    try:
+        since = int(params.get("since", "0"))
+        max_samples = min(HISTORY_MAX, int(params.get("max", str(HISTORY_MAX))))
+    except ValueError:
+        return json_response(400, {"ok": False, "message": "Invalid parameters"})
+    if max_samples < 0:
+        return json_response(400, {"ok": False, "message": "Invalid parameters"})
+
+    n = len(hardware.generators)
+    latest = hardware.sample_seq
+    first, count = hardware.history_range(since, max_samples)
+    lsb = 0.0001
+    for sensor in hardware.sensors:
+        if sensor is not None:
+            lsb = sensor.current_lsb
+            break
+    head = struct.pack(
+        HISTORY_HEADER, HISTORY_MAGIC, HISTORY_VERSION, n, count, first, latest, 0.004, lsb
+    )
+    parts = [(head, len(head))]
+    if count:
+        parts += _ring_parts(hardware.history_ts, first, count, 1, 4)
+        parts += _ring_parts(hardware.history_v, first, count, n, 2)
+        parts += _ring_parts(hardware.history_i, first, count, n, 2)
+        parts += _ring_parts(hardware.history_duty, first, count, n, 4)
+    return 200, CT_BINARY, parts
+
+
+ROUTES = {
+    "/api/state": api_state,
+    "/api/sequence": api_sequence,
+    "/api/history": api_history,
+    "/api/sensors": api_sensors,
+    "/api/control": api_control,
+    "/api/setpoint": api_setpoint,
+    "/api/regulator": api_regulator,
+    "/api/feedforward": api_feedforward,
+    "/api/gains": api_gains,
+}
+
+
+# ====================================
+# TELEMETRY STREAM (Server-Sent Events)
+# ====================================
+# One long-lived chunked response; every sensor update is pushed as one
+# HTTP chunk holding
+#   data: seq,ts_ms,v1,i1,d1,v2,i2,d2,...\n\n
+# where d is the signed duty (negative = rev) and empty v/i means no sensor.
+
+sample_event = asyncio.Event()
+
+
+def notify_sample():
+    """Wake the stream clients; called on the event loop after each published sample."""
+    sample_event.set()
+    sample_event.clear()
+
+
+def telemetry_line(sample):
+    parts = [str(sample["seq"]), str(sample["ts"])]
+    v, i, d = sample["v"], sample["i"], sample["duty"]
+    for idx in range(len(d)):
+        if v[idx] is None:
+            parts.append("")
+            parts.append("")
+        else:
+            parts.append("{:.3f}".format(v[idx]))
+            parts.append("{:.5f}".format(i[idx]))
+        parts.append(str(d[idx]))
+    return "data: " + ",".join(parts) + "\n\n"
+
+
+async def stream_telemetry(writer, params):
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+        b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+    await writer.drain()
+    sample = hardware.new_sample(len(hardware.generators))
+    last = -1
+    while True:
+        if hardware.sample_seq == last:
+            await sample_event.wait()
+            continue
+        hardware.read_latest(sample)
+        last = sample["seq"]
+        event = telemetry_line(sample).encode()
+        writer.write(("%x\r\n" % len(event)).encode() + event + b"\r\n")
+        await writer.drain()
+
+
+# Handlers that take over the connection: async (writer, params)
+STREAM_ROUTES = {
+    "/api/stream": stream_telemetry,
+}
+
+
+def handle_request(method, path, body=b""):
+    """Dispatch one request to (status, content_type, body), or None for the static page."""
+    route, params = parse_query(path)
+    if route == "/":
+        return None  # static page, served from _page_response
+    handler = ROUTES.get(route)
+    if handler is None:
+        return 404, CT_TEXT, "Not found"
+    return handler(params, body)
+
+
+# ====================================
+# ASYNC SERVER
+# ====================================
+
+
+async def _read_request(reader):
+    """
+    Read request line + headers (+ body). Returns (method, path, keep_alive,
+    body) or None at end of stream; raises ValueError (message for the 400
+    reply) on a malformed request.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.split()
+    if len(parts) < 2:
+        return None
     try:
-        req = conn.recv(1024)
-        if not req:
-            return
-        # First line: "GET /path HTTP/1.1"
-        line = req.split(b"\r\n", 1)[0]
-        parts = line.split()
-        if len(parts) < 2:
-            return
         method = parts[0].decode()
         path = parts[1].decode()
+    except UnicodeError:
+        raise ValueError("Bad request line")
+    keep_alive = len(parts) < 3 or parts[2] != b"HTTP/1.0"
 
-        route, params = parse_query(path)
-
-        if route == "/":
-            html = build_html()
-            response = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n" + html
-            conn.send(response)
-
-        elif route == "/api/state":
-            data = {"generators": []}
-            for idx in range(len(hardware.generators)):
-                state = hardware.generator_states[idx]
-                sv = hardware.sensor_values[idx]
-                gen_id = idx + 1
-                if sv is None:
-                    v = None
-                    i = None
-                else:
-                    v = sv["v"]
-                    i = sv["i"]
-                data["generators"].append(
-                    {
-                        "id": gen_id,  # 1-based ID
-                        "dir": state["dir"],
-                        "duty": state["duty"],
-                        "v": v,
-                        "i": i,
-                    }
-                )
-            body = ujson.dumps(data)
-            response = (
-                "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" + body
-            )
-            conn.send(response)
-
-        elif route == "/api/control":
+    length = 0
+    for _ in range(MAX_HEADER_LINES):
+        h = await reader.readline()
+        if not h or h == b"\r\n":
+            break
+        h = h.lower()
+        if h.startswith(b"content-length:"):
             try:
-                gen_id = int(params.get("g", "1"))  # 1-based from client
-                direction = params.get("dir", "stop")
-                duty = int(params.get("duty", "0"))
+                length = int(h[15:].strip())
             except ValueError:
-                body = ujson.dumps({"ok": False, "message": "Invalid parameters"})
-                response = (
-                    "HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n\r\n"
-                    + body
-                )
-                conn.send(response)
+                length = -1
+            if length < 0:
+                raise ValueError("Bad Content-Length")
+        elif h.startswith(b"connection:"):
+            value = h[11:].strip()
+            if value == b"close":
+                keep_alive = False
+            elif value == b"keep-alive":
+                keep_alive = True
+
+    body = b""
+    if length:
+        if length > MAX_BODY:
+            raise ValueError("Body too large")
+        body = await reader.readexactly(length)
+    return method, path, keep_alive, body
+
+
+async def serve_client(reader, writer):
+    """Serve requests on one connection until the client closes or asks to."""
+    try:
+        while True:
+            try:
+                req = await _read_request(reader)
+            except ValueError as e:  # unread input is left behind: close after replying
+                writer.write(build_response(400, CT_TEXT, str(e), False))
+                await writer.drain()
+                break
+            if req is None:
+                break
+            method, path, keep_alive, body = req
+
+            route, params = parse_query(path)
+            stream = STREAM_ROUTES.get(route)
+            if stream is not None:
+                await stream(writer, params)
+                break
+
+            result = handle_request(method, path, body)
+            if result is None:
+                resp = _page_response[keep_alive]
             else:
-                gen_index = gen_id - 1  # convert to 0-based index
-                if gen_index < 0 or gen_index >= len(hardware.generators):
-                    body = ujson.dumps(
-                        {"ok": False, "message": "Generator ID out of range"}
-                    )
-                    response = (
-                        "HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n\r\n"
-                        + body
-                    )
-                    conn.send(response)
-                else:
-                    hardware.set_generator(gen_index, direction, duty)
-                    body = ujson.dumps(
-                        {
-                            "ok": True,
-                            "message": "Generator {} set to {} duty {}".format(
-                                gen_id, direction, duty
-                            ),
-                        }
-                    )
-                    response = (
-                        "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n"
-                        + body
-                    )
-                    conn.send(response)
-        else:
-            resp = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n\r\nNot found"
-            conn.send(resp)
+                resp = build_response(result[0], result[1], result[2], keep_alive)
+
+            # write() + drain() pushes the whole buffer, unlike socket.send()
+            if isinstance(resp, list):
+                for buf in resp:
+                    writer.write(buf)
+                    await writer.drain()
+            else:
+                writer.write(resp)
+                await writer.drain()
+            if not keep_alive:
+                break
+    except OSError:
+        pass
     finally:
-        conn.close()
-
-
-def start_http_server():
-    addr = socket.getaddrinfo("0.0.0.0", HTTP_PORT)[0][-1]
-    s = socket.socket()
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind(addr)
-    s.listen(2)
-    s.settimeout(0.05)  # non-blocking accept with short timeout
-    print("HTTP server listening on port", HTTP_PORT)
-    return s
+        writer.close()
+        await writer.wait_closed()
+
+
+async def start_http_server(host="0.0.0.0", port=HTTP_PORT):
+    global _state_sample
+    _state_sample = hardware.new_sample(len(hardware.generators))
+    html = build_html()
+    _page_response[True] = build_response(200, CT_HTML, html, True)
+    _page_response[False] = build_response(200, CT_HTML, html, False)
+    server = await asyncio.start_server(serve_client, host, port, backlog=4)
+    print("HTTP server listening on port", port)
+    return server
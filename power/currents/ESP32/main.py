@@ -1,6 +1,8 @@
 import network
 import time
 
+import uasyncio as asyncio
+
 import hardware
 import http_server
 
@@ -12,11 +14,6 @@ import http_server
 WIFI_SSID = "Nafisah_wifi"
 WIFI_PASSWORD = "s123123s"
 
-# Timing
-SENSOR_UPDATE_INTERVAL = 0.2  # seconds
-SERVER_POLL_INTERVAL = 0.05  # seconds
-
-
 # ====================================
 # WIFI HELPER
 # ====================================
@@ -42,7 +39,30 @@ def connect_wifi(ssid, password, timeout_s=15):
 
 
 # ====================================
-# MAIN LOOP
+# TASKS
+# ====================================
+
+
+async def sample_relay(flag):
+    """Hand samples published by the sampler thread to the stream clients."""
+    while True:
+        await flag.wait()
+        http_server.notify_sample()
+
+
+async def run(ip):
+    # Set from the sampler thread; uasyncio.Event is not thread safe
+    flag = asyncio.ThreadSafeFlag()
+    hardware.start_sampler(on_sample=flag.set)
+    asyncio.create_task(sample_relay(flag))
+    await http_server.start_http_server()
+    print("Entering main loop. Open http://{}/ in your browser.".format(ip))
+    while True:
+        await asyncio.sleep(3600)
+
+
+# ====================================
+# MAIN
 # ====================================
 
 
@@ -54,45 +74,19 @@ def main():
         return
 
     # Hardware (sensors + generators)
-    hardware.setup_hardware(i2c_freq=100000)
-
-    # Start server
-    server = http_server.start_http_server()
-
-    last_sensor_update = 0
-
-    print(
-        "Entering main loop. Open http://{}/ in your browser.".format(
-            wlan.ifconfig()[0]
-        )
-    )
+    # 400 kHz keeps one INA219 read well under the control period
+    hardware.setup_hardware(i2c_freq=400000)
 
     try:
-        while True:
-            now = time.ticks_ms()
-
-            # Periodic sensor update
-            if time.ticks_diff(now, int(last_sensor_update * 1000)) > int(
-                SENSOR_UPDATE_INTERVAL * 1000
-            ):
-                hardware.update_sensors()
-                last_sensor_update = now / 1000.0
-
-            # Handle one client if present
-            try:
-                conn, addr = server.accept()
-            except OSError:
-                conn = None
-
-            if conn:
-                http_server.handle_client(conn)
-
-            time.sleep(SERVER_POLL_INTERVAL)
-
+        asyncio.run(run(wlan.ifconfig()[0]))
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt - stopping all generators.")
+        hardware.sequencer.stop()
+        hardware.stop_sampler()
         hardware.stop_all_generators()
         time.sleep(0.5)
+    finally:
+        asyncio.new_event_loop()  # clear uasyncio state for a clean re-run
 
 
 # Run main if this file is executed
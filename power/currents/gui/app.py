@@ -1,7 +1,9 @@
 import sys
+import threading
 
+import numpy as np
 import pyqtgraph as pg
-from PySide6.QtCore import QThreadPool, Slot
+from PySide6.QtCore import QThreadPool, Qt, QTimer, Slot
 from PySide6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -12,11 +14,21 @@ from PySide6.QtWidgets import (
     QLabel,
     QLineEdit,
     QSpinBox,
+    QGridLayout,
 )
 
-from esp32_client import ESP32Client
+import autotune
+from fleet import Fleet
+from ring_buffer import RingBuffer
+from telemetry_log import TelemetryLogger
 from worker import Worker
 
+DEFAULT_RATE_HZ = 100  # plot time base until the board reports its sample rate
+RATE_WINDOW_S = 2.0  # the sample rate is re-measured over this span
+REDRAW_HZ = 30
+LOG_DIR = "logs"
+PLOT_COLUMNS = 5
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -27,19 +39,25 @@ class MainWindow(QMainWindow):
         self.threadpool = QThreadPool()
         self.worker = None
         self.client = None
+        self.logger = None
 
-        self.num_generators = 5  # matches firmware
-        self.max_points = 200
+        self.num_generators = 0  # channels over all boards, set on connect
+        self.history_minutes = 60
 
-        # For each generator: list of currents
-        self.history_i = [[0.0] * self.max_points for _ in range(self.num_generators)]
+        # Signed current per generator; plotted against a fixed x array
+        # (seconds before the newest sample) by a display-rate timer
+        self.history_i = None
+        self.x = None
+        self.rate_hz = DEFAULT_RATE_HZ
+        self._rate_ref = None  # (seconds, samples received) where the rate window starts
+        self._dirty = False
+        self._reset_history(self.rate_hz)
 
-        # Closed-loop control state:
-        # { gen_id: {"target_a": float, "direction": "fwd"/"rev", "duty": int} }
+        # Closed-loop targets, regulated on the ESP32: { gen_id: signed amps }
         self.control_targets = {}
 
-        # Per-generator current setpoint widgets (index by generator_id, 1..N)
-        self.current_spins = [None] * (self.num_generators + 1)
+        # Per-channel current setpoint widgets (index by channel, 1..N)
+        self.current_spins = [None]
 
         # ========= UI Layouts =========
         main_layout = QVBoxLayout()
@@ -49,7 +67,7 @@ class MainWindow(QMainWindow):
 
         # ---- Top: connection + streaming ----
         self.host_edit = QLineEdit("192.168.8.48")
-        self.host_edit.setPlaceholderText("ESP32 IP or host")
+        self.host_edit.setPlaceholderText("hosts, comma separated, or a subnet like 192.168.8.0/24")
         self.connect_button = QPushButton("Connect")
         self.connect_button.clicked.connect(self.on_connect_clicked)
 
@@ -58,20 +76,78 @@ class MainWindow(QMainWindow):
         self.start_button.setEnabled(False)
         self.start_button.clicked.connect(self.on_start_clicked)
 
+        self.record_button = QPushButton("Record")
+        self.record_button.setCheckable(True)
+        self.record_button.setToolTip(f"Log every sample to {LOG_DIR}/ while sampling")
+
+        self.history_spin = QSpinBox()
+        self.history_spin.setRange(1, 720)
+        self.history_spin.setValue(self.history_minutes)
+
         self.status_label = QLabel("Disconnected")
 
-        top_layout.addWidget(QLabel("ESP32 Host:"))
+        top_layout.addWidget(QLabel("ESP32 Hosts:"))
         top_layout.addWidget(self.host_edit)
         top_layout.addWidget(self.connect_button)
+        top_layout.addWidget(QLabel("History (min):"))
+        top_layout.addWidget(self.history_spin)
+        top_layout.addWidget(self.record_button)
         top_layout.addWidget(self.start_button)
         top_layout.addWidget(self.status_label)
-        # ---- Body: 5 horizontal pyqtgraph plots ----
-        self.plot_boxes = []  # store per-generator (label, plot) for updates
+        # ---- Body + bottom: plot grid and control rows, one per channel,
+        # built by _build_channels() from what the boards report ----
+        self.plot_boxes = []  # store per-channel (label, plot) for updates
         self.plots = []
         self.curves = []
+        self.plot_area = QWidget()
+        self.control_area = QWidget()
+        body_layout.addWidget(self.plot_area)
+        bottom_layout.addWidget(self.control_area)
+        self.boards_label = QLabel("")
+        self.boards_label.setStyleSheet("font-size: 11px; color: #555;")
+        bottom_layout.addWidget(self.boards_label)
+
+        # ---- Assemble main widget ----
+        main_widget = QWidget()
+        main_layout.addLayout(top_layout)
+        main_layout.addLayout(body_layout)
+        main_layout.addLayout(bottom_layout)
+        main_widget.setLayout(main_layout)
+        self.setCentralWidget(main_widget)
+
+        # Redraw at display rate, however fast samples arrive
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.setInterval(1000 // REDRAW_HZ)
+        self.redraw_timer.timeout.connect(self._redraw)
+        self.redraw_timer.start()
 
-        for i in range(self.num_generators):
-            gen_id = i + 1  # 1-based
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(1000)
+        self.stats_timer.timeout.connect(self._update_board_stats)
+        self.stats_timer.start()
+
+    def _build_channels(self, channels):
+        """
+        Rebuild the plot grid and the control rows for
+        channels = [(channel, host, generator id), ...].
+        """
+        for area in (self.plot_area, self.control_area):
+            for child in area.findChildren(QWidget, options=Qt.FindDirectChildrenOnly):
+                child.deleteLater()
+            old = area.layout()
+            if old is not None:
+                QWidget().setLayout(old)  # reparent the layout so it goes too
+
+        plot_grid = QGridLayout(self.plot_area)
+        control_grid = QGridLayout(self.control_area)
+        self.plot_boxes, self.plots, self.curves = [], [], []
+        self.current_spins = [None] * (len(channels) + 1)
+        multi = len({host for _ch, host, _gen in channels}) > 1
+        cols = min(PLOT_COLUMNS, max(1, len(channels)))
+
+        for i, (channel, host, gen_id) in enumerate(channels):
+            name = f"Ch {channel}" if multi else f"Generator {gen_id}"
+            where = f" ({host.split('//')[-1]} G{gen_id})" if multi else ""
 
             vbox = QVBoxLayout()
 
@@ -82,47 +158,47 @@ class MainWindow(QMainWindow):
 
             plot = pg.PlotWidget()
             plot.setBackground("w")
-            plot.setTitle(f"Generator {gen_id} Current")
+            plot.setTitle(f"{name} Current{where}")
             plot.setLabel("left", "Current (A)")
-            plot.setLabel("bottom", "Sample")
+            plot.setLabel("bottom", "Time (s)")
             plot.showGrid(x=True, y=True)
             plot.setYRange(-1.0, 1.0)
             plot.enableAutoRange(axis="y", enable=False)
+            # only draw what is visible, at most ~ a few points per pixel
+            plot.setClipToView(True)
+            plot.setDownsampling(auto=True, mode="peak")
 
             pen = pg.mkPen(color="k")
-            x0 = list(range(self.max_points))
-            curve = plot.plot(x0, self.history_i[i], pen=pen)
+            curve = plot.plot(pen=pen)
 
             self.plot_boxes.append((current_label, plot))
             self.plots.append(plot)
             self.curves.append(curve)
 
             vbox.addWidget(plot)
-            body_layout.addLayout(vbox)
+            plot_grid.addLayout(vbox, i // cols, i % cols)
 
-        # ---- Bottom: control panel for ALL generators at once ----
-        for gen_id in range(1, self.num_generators + 1):
+            # ---- control row for this channel ----
             row = QHBoxLayout()
-
-            row.addWidget(QLabel(f"G{gen_id}"))
+            row.addWidget(QLabel(f"Ch{channel}" if multi else f"G{gen_id}"))
 
             spin = QSpinBox()
             spin.setRange(0, 1000)  # 0..1000 mA (0-1 A)
             spin.setValue(100)
-            self.current_spins[gen_id] = spin
+            self.current_spins[channel] = spin
 
             fwd_button = QPushButton("FWD")
             rev_button = QPushButton("REV")
             stop_button = QPushButton("STOP")
 
             fwd_button.clicked.connect(
-                lambda _, gid=gen_id: self.send_control(gid, "fwd")
+                lambda _, ch=channel: self.send_control(ch, "fwd")
             )
             rev_button.clicked.connect(
-                lambda _, gid=gen_id: self.send_control(gid, "rev")
+                lambda _, ch=channel: self.send_control(ch, "rev")
             )
             stop_button.clicked.connect(
-                lambda _, gid=gen_id: self.send_control(gid, "stop")
+                lambda _, ch=channel: self.send_control(ch, "stop")
             )
 
             row.addWidget(QLabel("Target (mA):"))
@@ -131,37 +207,54 @@ class MainWindow(QMainWindow):
             row.addWidget(rev_button)
             row.addWidget(stop_button)
 
-            bottom_layout.addLayout(row)
-
-        # ---- Assemble main widget ----
-        main_widget = QWidget()
-        main_layout.addLayout(top_layout)
-        main_layout.addLayout(body_layout)
-        main_layout.addLayout(bottom_layout)
-        main_widget.setLayout(main_layout)
-        self.setCentralWidget(main_widget)
+            control_grid.addLayout(row, i // cols, i % cols)
 
     # =========================
     # Connection / Worker logic
     # =========================
 
     def on_connect_clicked(self):
-        host = self.host_edit.text().strip()
-        if not host:
+        text = self.host_edit.text().strip()
+        if not text:
             self.status_label.setText("Host is empty")
             return
 
-        self.client = ESP32Client(host=host, port=80, timeout=2.0)
+        if self.client is not None:
+            self.client.close()
+            self.client = None
         try:
-            generators = self.client.get_state()  # quick test
-            self.status_label.setText(
-                f"Connected, {len(generators)} generators reported"
-            )
-            self.start_button.setEnabled(True)
+            if "/" in text and not text.startswith("http"):
+                self.status_label.setText(f"Scanning {text}...")
+                QApplication.processEvents()
+                hosts = Fleet.discover(text)
+                if not hosts:
+                    raise RuntimeError(f"no boards found in {text}")
+            else:
+                hosts = [h.strip() for h in text.split(",") if h.strip()]
+            # one board or many: the fleet numbers all channels 1..N
+            self.client = Fleet(hosts, port=80, timeout=2.0)
         except Exception as e:
-            self.client = None
             self.status_label.setText(f"Connection failed: {e}")
             self.start_button.setEnabled(False)
+            return
+
+        # boards forget their tuning on reset; push what autotune saved
+        tuned = 0
+        for board in self.client.boards:
+            try:
+                tuned += len(autotune.apply_saved(board.client))
+            except Exception as e:
+                print(f"Applying saved tuning to {board.host} failed: {e}")
+
+        channels = self.client.channels()
+        self.num_generators = len(channels)
+        self._build_channels(channels)
+        self._reset_history(self.rate_hz)
+        self.status_label.setText(
+            f"Connected, {len(self.client.boards)} board(s), {len(channels)} channels"
+            + (f", {tuned} tuned" if tuned else "")
+        )
+        self.start_button.setEnabled(True)
 
     def on_start_clicked(self, checked):
         if checked:
@@ -170,10 +263,24 @@ class MainWindow(QMainWindow):
                 self.start_button.setChecked(False)
                 return
 
+            self.history_minutes = self.history_spin.value()
+            # size the history for the rate the (first) board publishes at;
+            # on_sample() corrects the time axis from what actually arrives
+            try:
+                self.rate_hz = self.client.boards[0].client.get_sensors()["sample_hz"]
+            except Exception as e:
+                print(f"Reading the sample rate failed, assuming {self.rate_hz:g} Hz: {e}")
+            self._reset_history(self.rate_hz)
+
             # Start worker
-            self.worker = Worker(self.client, interval=0.15)
-            self.worker.signals.state.connect(self.on_state_update)
+            self.worker = Worker(self.client, interval=0.15, stream=True)
+            self.worker.signals.sample.connect(self.on_sample)
             self.worker.signals.error.connect(self.on_worker_error)
+            if self.record_button.isChecked():
+                self.logger = TelemetryLogger(LOG_DIR, self.num_generators).start()
+                # called in the worker thread; log() only enqueues
+                self.worker.signals.sample.connect(self.logger.log, Qt.DirectConnection)
+            self.record_button.setEnabled(False)
             self.threadpool.start(self.worker)
             self.start_button.setText("Stop Sampling")
             self.status_label.setText("Sampling...")
@@ -182,18 +289,63 @@ class MainWindow(QMainWindow):
                 self.worker.stop()
                 self.worker = None
             self.start_button.setText("Start Sampling")
+            self.record_button.setEnabled(True)
             self.status_label.setText("Stopped")
+            if self.logger is not None:
+                logger, self.logger = self.logger, None
+                # the writer thread drains the queue and closes the file itself
+                threading.Thread(target=logger.close, daemon=True).start()
+                self.status_label.setText(f"Stopped, logging to {LOG_DIR}/")
 
     # =========================
     # State updates + plotting
     # =========================
 
+    def _reset_history(self, rate_hz):
+        """Allocate history_minutes of samples at rate_hz and the matching x axis."""
+        capacity = int(self.history_minutes * 60 * rate_hz)
+        self.history_i = RingBuffer(capacity, self.num_generators)
+        self._set_rate(rate_hz)
+        self._rate_ref = None
+        self._sample = np.zeros(self.num_generators, dtype=np.float32)
+
+    def _set_rate(self, rate_hz):
+        """Rebuild the x axis (seconds before the newest sample) for rate_hz."""
+        self.rate_hz = rate_hz
+        capacity = self.history_i.capacity
+        self.x = (np.arange(capacity, dtype=np.float64) - (capacity - 1)) / rate_hz
+        self._dirty = True
+
+    @Slot(object)
+    def on_sample(self, sample):
+        """
+        sample: (host time, seq, ts_ms, generators) from the worker. Stores
+        the generators and keeps the x axis at the rate samples actually
+        arrive, timed by the board clock (ts_ms) or, when polled, the host.
+        """
+        host_t, seq, ts_ms, generators = sample
+        self.on_state_update(generators)
+        t = ts_ms / 1000 if ts_ms >= 0 else host_t
+        n = self.history_i.total
+        if self._rate_ref is None or t < self._rate_ref[0]:  # first sample, or board reset
+            self._rate_ref = (t, n)
+            return
+        t0, n0 = self._rate_ref
+        if t - t0 < RATE_WINDOW_S:
+            return
+        self._rate_ref = (t, n)
+        rate = (n - n0) / (t - t0)  # dropped samples are not in the history either
+        if rate > 0 and abs(rate - self.rate_hz) > 0.05 * self.rate_hz:
+            self._set_rate(rate)
+
     @Slot(list)
     def on_state_update(self, generators):
         """
         generators: list of dicts from /api/state, e.g.
           { "id": 1, "dir": "fwd", "duty": 30000, "v": 12.34, "i": 0.123 }
+        Only stores the sample; _redraw() plots it.
         """
+        sample = self._sample
         for g in generators:
             gen_id = g.get("id")
             if gen_id is None:
@@ -214,38 +366,41 @@ class MainWindow(QMainWindow):
             else:
                 i_display = i_meas
 
-            # Maintain rolling history for plotting
-            hist = self.history_i[idx]
-            hist.append(i_display)
-            if len(hist) > self.max_points:
-                hist.pop(0)
-
-            # Update label above plot
-            label, _plot = self.plot_boxes[idx]
-            label.setText(f"Last: {i_display * 1000:.1f} mA")
-
-            x = list(range(len(hist)))
-            self.curves[idx].setData(x, hist)
+            sample[idx] = i_display
 
-            # -------------------------
-            # CLOSED-LOOP CURRENT CONTROL
-            # -------------------------
-            ctl = self.control_targets.get(gen_id)
-            if ctl is not None and ctl["direction"] != "stop":
-                target_a = ctl["target_a"]
-                measured_abs = abs(i_meas)  # use magnitude for control
+        self.history_i.append(sample)
+        self._dirty = True
 
-                error = target_a - measured_abs  # A
-                Kp = 20000  # tune if needed
-                delta_duty = int(Kp * error)
-
-                new_duty = ctl["duty"] + delta_duty
-                new_duty = max(0, min(65535, new_duty))
+    def _redraw(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        hist = self.history_i
+        n = hist.count
+        x = self.x[len(self.x) - n :]
+        last = hist.last()
+        for idx in range(self.num_generators):
+            self.curves[idx].setData(x, hist.view(idx))
+            label, _plot = self.plot_boxes[idx]
+            label.setText(f"Last: {last[idx] * 1000:.1f} mA")
 
-                # Avoid flooding ESP32
-                if abs(new_duty - ctl["duty"]) > 50:
-                    ctl["duty"] = new_duty
-                    self._queue_command(gen_id, ctl["direction"], new_duty)
+    def _update_board_stats(self):
+        """Per-board round trip and sample age under the controls."""
+        if self.client is None:
+            self.boards_label.setText("")
+            return
+        parts = []
+        for b in self.client.board_stats():
+            rtt = "-" if b["rtt_ms"] is None else f"{b['rtt_ms']:.0f} ms"
+            state = b["latency"].get("state")
+            if state and self.worker is not None and not self.worker.stream:
+                rtt = f"{state['p50_ms']:.0f}/{state['p99_ms']:.0f} ms"
+            age = "-" if b["age_ms"] is None else f"{b['age_ms']:.0f} ms"
+            lo, hi = b["channels"]
+            parts.append(
+                f"{b['host'].split('//')[-1]} (ch {lo}-{hi}): rtt {rtt}, age {age}, errors {b['errors']}"
+            )
+        self.boards_label.setText("   |   ".join(parts))
 
     @Slot(str)
     def on_worker_error(self, msg):
@@ -269,43 +424,38 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 self.status_label.setText(f"Control error: {e}")
 
+    def _queue_setpoint(self, generator_id, amps):
+        """Enqueue an on-device PI setpoint (signed amps, 0 = stop)."""
+        if self.worker is not None:
+            self.worker.send_setpoint(generator_id, amps)
+        elif self.client is not None:
+            try:
+                self.client.set_current(generator_id, amps)
+            except Exception as e:
+                self.status_label.setText(f"Control error: {e}")
+
     def send_control(self, generator_id, direction):
         if self.client is None:
             self.status_label.setText("Not connected")
             return
 
-        # STOP: cancel control and send duty 0
+        # STOP: cancel regulation and send duty 0
         if direction == "stop":
             self.control_targets.pop(generator_id, None)
-            self._queue_command(generator_id, "stop", 0)
-            self.status_label.setText(f"Stopped G{generator_id}")
+            self._queue_setpoint(generator_id, 0.0)
+            self.status_label.setText(f"Stopped channel {generator_id}")
             return
 
-        # FWD / REV: set or update closed-loop target
+        # FWD / REV: the PI loop runs on the ESP32, we only send the target
         spin = self.current_spins[generator_id]
         target_ma = spin.value()
         target_a = target_ma / 1000.0  # convert to amps
+        signed = target_a if direction == "fwd" else -target_a
 
-        ctl = self.control_targets.get(generator_id)
-        if ctl is None:
-            initial_duty = (
-                int(min(max(target_a * 65535, 5000), 50000)) if target_a > 0 else 0
-            )
-            ctl = {
-                "target_a": target_a,
-                "direction": direction,
-                "duty": initial_duty,
-            }
-            self.control_targets[generator_id] = ctl
-        else:
-            ctl["target_a"] = target_a
-            ctl["direction"] = direction
-            if ctl["duty"] <= 0:
-                ctl["duty"] = int(min(max(target_a * 65535, 5000), 50000))
-
-        self._queue_command(generator_id, direction, ctl["duty"])
+        self.control_targets[generator_id] = signed
+        self._queue_setpoint(generator_id, signed)
         self.status_label.setText(
-            f"Closed-loop: G{generator_id} -> {direction}, {target_ma} mA"
+            f"Closed-loop: channel {generator_id} -> {direction}, {target_ma} mA"
         )
 
 
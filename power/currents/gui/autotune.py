@@ -0,0 +1,332 @@
+"""
+Plant identification and regulator tuning for one current channel.
+
+The board's sequencer plays a duty excitation on one generator: a staircase
+of levels, each held until settled, which gives the static duty -> current
+map, followed by a PRBS around mid-range for the dynamics. The samples come
+back through /api/history at the full control rate. From them we fit
+
+    first-order plus dead time   i[k+1] = a i[k] + b u[k-d] + c
+    (K = b / (1 - a) A/duty, tau = -Ts / ln a, theta = d Ts)
+
+and derive SIMC PI gains plus a |amps| -> duty feed-forward table. Both are
+saved per board under tuning/ and pushed to the device regulator, so a new
+setpoint starts at the right duty and the PI only trims the model error.
+
+    python gui/autotune.py --host 192.168.8.48 --gen 1 --max-duty 40000
+    python gui/autotune.py --host 192.168.8.48 --apply-saved
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from esp32_client import ESP32Client
+
+TUNING_DIR = "tuning"
+FF_POINTS = 16  # feed-forward table size (firmware allows 32)
+IDENT_SAMPLE_HZ = 500  # telemetry rate during identification (= control rate)
+
+
+# ====================================
+# EXCITATION
+# ====================================
+
+
+def prbs(n_bits, order=7, seed=1):
+    """Maximum-length pseudo-random binary sequence (0/1) from a Fibonacci LFSR."""
+    taps = {5: (5, 3), 6: (6, 5), 7: (7, 6), 9: (9, 5), 10: (10, 7), 11: (11, 9)}[order]
+    state = seed or 1
+    out = np.empty(n_bits, dtype=np.int8)
+    for k in range(n_bits):
+        bit = ((state >> (taps[0] - 1)) ^ (state >> (taps[1] - 1))) & 1
+        state = ((state << 1) | bit) & ((1 << order) - 1)
+        out[k] = bit
+    return out
+
+
+def excitation_program(gen_id, max_duty, levels=8, settle_ms=300, bit_ms=6, n_bits=127):
+    """
+    Sequencer steps [t_ms, gen, "duty", value] for the staircase + PRBS
+    excitation, the time the PRBS starts and the total duration (ms).
+    The program ends at duty 0.
+    """
+    steps = []
+    t = 0
+    for duty in np.linspace(max_duty / levels, max_duty, levels):
+        steps.append([t, gen_id, "duty", int(duty)])
+        t += settle_ms
+    low, high = int(0.35 * max_duty), int(0.65 * max_duty)
+    steps.append([t, gen_id, "duty", low])
+    t += settle_ms
+    prbs_ms = t
+    for bit in prbs(n_bits):
+        steps.append([t, gen_id, "duty", high if bit else low])
+        t += bit_ms
+    steps.append([t, gen_id, "duty", 0])
+    return steps, prbs_ms, t + settle_ms
+
+
+def record(client, gen_id, steps, total_ms, sample_hz=IDENT_SAMPLE_HZ, poll_s=0.2):
+    """
+    Run the program on the board and collect every sample it produced.
+    Returns {"t": s, "u": duty, "i": |amps|} for the generator, t from the
+    program start (the first sample at its first duty; earlier ones < 0).
+    """
+    g = gen_id - 1
+    old_hz = client.get_sensors()["sample_hz"]
+    client.get_sensors(sample_hz=sample_hz)
+    try:
+        last = client.get_history(since=0, max_samples=0)["latest_seq"]
+        client.upload_sequence(steps, start=True)
+        end = time.monotonic() + total_ms / 1000.0 + 0.1
+        ts, u, i = [], [], []
+        while True:
+            h = client.get_history(since=last)
+            if h["count"]:
+                if h["first_seq"] > last + 1:
+                    raise RuntimeError(
+                        f"lost {h['first_seq'] - last - 1} samples; poll faster or lower sample_hz"
+                    )
+                ts.append(h["ts_ms"])
+                u.append(h["duty"][:, g])
+                i.append(h["i"][:, g])
+                last = int(h["seq"][-1])
+            elif time.monotonic() > end:
+                break
+            else:
+                time.sleep(poll_s)
+    finally:
+        client.stop_sequence()
+        client.set_generator(gen_id, "stop", 0)
+        client.get_sensors(sample_hz=old_hz)
+
+    # samples are evenly spaced by the sampler; ticks_ms (1 ms steps) only
+    # gives the overall span
+    ts = np.concatenate(ts).astype(np.int64)
+    n = len(ts)
+    t = np.arange(n) * ((ts[-1] - ts[0]) / 1000.0 / max(1, n - 1))
+    u = np.concatenate(u).astype(float)
+    started = np.flatnonzero(u == steps[0][3])
+    if len(started):
+        t -= t[started[0]]
+    return {"t": t, "u": u, "i": np.abs(np.concatenate(i))}
+
+
+# ====================================
+# MODEL FITS
+# ====================================
+
+
+def _fill_gaps(y):
+    """Linearly interpolate over NaN samples (failed sensor reads)."""
+    bad = ~np.isfinite(y)
+    if bad.any():
+        y = y.copy()
+        y[bad] = np.interp(np.flatnonzero(bad), np.flatnonzero(~bad), y[~bad])
+    return y
+
+
+def fit_fopdt(t, u, y, max_delay=10):
+    """
+    Least-squares fit of y[k+1] = a y[k] + b u[k-d] + c for every delay
+    d = 0..max_delay at once (batched normal equations); the delay with the
+    smallest residual wins. Returns K, tau, theta, Ts, delay, r2.
+    """
+    y = _fill_gaps(np.asarray(y, float))
+    u = np.asarray(u, float)
+    ts = float(np.median(np.diff(t)))
+    D = max_delay
+    k = np.arange(D, len(y) - 1)
+    target = y[k + 1]
+    # X[d] = [y[k], u[k-d], 1], shape (D+1, M, 3)
+    X = np.empty((D + 1, len(k), 3))
+    X[:, :, 0] = y[k]
+    X[:, :, 1] = u[k[None, :] - np.arange(D + 1)[:, None]]
+    X[:, :, 2] = 1.0
+    XtX = np.einsum("dmi,dmj->dij", X, X)
+    Xty = np.einsum("dmi,m->di", X, target)
+    theta_hat = np.linalg.solve(XtX, Xty[..., None])[..., 0]  # (D+1, 3)
+    resid = target[None, :] - np.einsum("dmi,di->dm", X, theta_hat)
+    sse = (resid**2).sum(axis=1)
+    d = int(np.argmin(sse))
+    a, b, c = theta_hat[d]
+    if not 0.0 < a < 1.0 or b <= 0:
+        raise ValueError(f"fit is not a stable first-order plant (a={a:.4f}, b={b:.3g})")
+    r2 = 1.0 - sse[d] / ((target - target.mean()) ** 2).sum()
+    return {
+        "K": b / (1.0 - a),  # A per duty count
+        "tau": -ts / np.log(a),
+        "theta": d * ts,
+        "Ts": ts,
+        "delay": d,
+        "r2": float(r2),
+    }
+
+
+def static_map(u, y, min_len=20):
+    """
+    (duty, amps) steady-state points: for every run of constant duty at
+    least min_len samples long, the median current over its second half.
+    """
+    u = np.asarray(u)
+    y = np.asarray(y)
+    edges = np.flatnonzero(np.diff(u) != 0) + 1
+    starts = np.concatenate(([0], edges))
+    stops = np.concatenate((edges, [len(u)]))
+    long_runs = (stops - starts) >= min_len
+    duty, amps = [], []
+    for s, e in zip(starts[long_runs], stops[long_runs]):
+        seg = y[(s + e) // 2 : e]
+        seg = seg[np.isfinite(seg)]
+        if u[s] > 0 and len(seg):
+            duty.append(u[s])
+            amps.append(np.median(seg))
+    duty, amps = np.array(duty, float), np.array(amps, float)
+    order = np.argsort(duty, kind="stable")
+    return duty[order], amps[order]
+
+
+def feedforward_table(duty, amps, n=FF_POINTS):
+    """
+    Resample the static map as |amps| -> duty on n ascending breakpoints.
+    Current must rise with duty; points breaking that are dropped. Below
+    the first point the duty is extrapolated linearly from the origin.
+    """
+    keep = amps > np.maximum.accumulate(np.concatenate(([0.0], amps[:-1])))
+    duty, amps = duty[keep], amps[keep]
+    if len(amps) < 2:
+        raise ValueError("static map needs at least two increasing points")
+    grid = np.linspace(amps[0] / 2, amps[-1], n)
+    return grid, np.interp(grid, np.concatenate(([0.0], amps)), np.concatenate(([0.0], duty)))
+
+
+def pi_gains(K, tau, theta, Ts, tau_c=None):
+    """
+    SIMC PI for a FOPDT plant; the control period's hold adds Ts/2 of
+    delay. tau_c defaults to the effective delay (tight tuning).
+    Returns kp (duty/A) and ki (duty/(A s)) in firmware units.
+    """
+    theta_eff = theta + Ts / 2
+    if tau_c is None:
+        tau_c = max(theta_eff, Ts)
+    kp = tau / (K * (tau_c + theta_eff))
+    ti = min(tau, 4.0 * (tau_c + theta_eff))
+    return kp, kp / ti
+
+
+# ====================================
+# TUNE / PERSIST / APPLY
+# ====================================
+
+
+def tune(client, gen_id, max_duty=40000, tau_c=None, **program_kw):
+    """Excite, fit and derive gains + feed-forward for one generator."""
+    steps, prbs_ms, total_ms = excitation_program(gen_id, max_duty, **program_kw)
+    data = record(client, gen_id, steps, total_ms)
+
+    duty_pts, amp_pts = static_map(data["u"], data["i"])
+    ff_amps, ff_duty = feedforward_table(duty_pts, amp_pts)
+
+    # dynamics from the PRBS part only: after the staircase, up to the final
+    # duty-0 step (at prbs_ms + n_bits * bit_ms), whose decay and idle tail
+    # would otherwise dominate the fit
+    t, u = data["t"], data["u"]
+    start = np.searchsorted(t, prbs_ms / 1000.0)
+    stop = np.searchsorted(t, steps[-1][0] / 1000.0)
+    off = np.flatnonzero(u[start:stop] == 0)  # the stop seen early if sample timing drifted
+    sl = slice(start, start + off[0] if len(off) else stop)
+    model = fit_fopdt(data["t"][sl], data["u"][sl], data["i"][sl])
+    kp, ki = pi_gains(model["K"], model["tau"], model["theta"], model["Ts"], tau_c)
+    return {
+        "kp": float(kp),
+        "ki": float(ki),
+        "ff_amps": [float(a) for a in ff_amps],
+        "ff_duty": [float(d) for d in ff_duty],
+        "model": {k: float(v) for k, v in model.items()},
+        "static_map": {"duty": duty_pts.tolist(), "amps": amp_pts.tolist()},
+        "max_duty": max_duty,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def tuning_path(client, directory=TUNING_DIR):
+    name = re.sub(r"[^A-Za-z0-9.-]+", "_", client.base_url.split("//", 1)[-1])
+    return os.path.join(directory, name + ".json")
+
+
+def load_tuning(client, directory=TUNING_DIR):
+    """{generator id (int): tuning dict} saved for this board, {} if none."""
+    path = tuning_path(client, directory)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+
+def save_tuning(client, gen_id, result, directory=TUNING_DIR):
+    saved = load_tuning(client, directory)
+    saved[gen_id] = result
+    os.makedirs(directory, exist_ok=True)
+    path = tuning_path(client, directory)
+    with open(path, "w") as f:
+        json.dump({str(k): v for k, v in sorted(saved.items())}, f, indent=1)
+    return path
+
+
+def apply_tuning(client, gen_id, result):
+    """Push feed-forward and gains to the device; a running channel keeps its setpoint."""
+    client.set_feedforward(gen_id, result["ff_amps"], result["ff_duty"])
+    client.set_gains(gen_id, kp=result["kp"], ki=result["ki"])
+
+
+def apply_saved(client, directory=TUNING_DIR):
+    """Apply every saved tuning of this board; returns the generator ids done."""
+    saved = load_tuning(client, directory)
+    for gen_id, result in saved.items():
+        apply_tuning(client, gen_id, result)
+    return sorted(saved)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Identify a current channel and tune its regulator")
+    ap.add_argument("--host", required=True)
+    ap.add_argument("--port", type=int, default=80)
+    ap.add_argument("--gen", type=int, action="append", help="generator id (repeatable)")
+    ap.add_argument("--max-duty", type=int, default=40000)
+    ap.add_argument("--tau-c-ms", type=float, default=None, help="closed-loop time constant")
+    ap.add_argument("--no-apply", action="store_true", help="save only")
+    ap.add_argument("--apply-saved", action="store_true", help="push saved tunings and exit")
+    ap.add_argument("--dir", default=TUNING_DIR)
+    args = ap.parse_args()
+
+    client = ESP32Client(args.host, args.port, timeout=2.0)
+    if args.apply_saved:
+        done = apply_saved(client, args.dir)
+        print("applied:", ", ".join(f"G{g}" for g in done) or "nothing saved")
+        return
+    if not args.gen:
+        ap.error("give --gen or --apply-saved")
+
+    tau_c = None if args.tau_c_ms is None else args.tau_c_ms / 1000.0
+    for gen_id in args.gen:
+        result = tune(client, gen_id, args.max_duty, tau_c)
+        m = result["model"]
+        print(
+            f"G{gen_id}: K={m['K'] * 1e6:.2f} uA/duty  tau={m['tau'] * 1e3:.2f} ms  "
+            f"theta={m['theta'] * 1e3:.1f} ms  R2={m['r2']:.4f}\n"
+            f"     kp={result['kp']:.0f}  ki={result['ki']:.0f}  "
+            f"ff 0..{result['ff_amps'][-1]:.3f} A -> {result['ff_duty'][-1]:.0f} duty"
+        )
+        path = save_tuning(client, gen_id, result, args.dir)
+        print("     saved to", path)
+        if not args.no_apply:
+            apply_tuning(client, gen_id, result)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,32 @@
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class ESP32Client:
     """
     Simple client for the ESP32 HTTP API:
-      - GET /api/state  -> {"generators": [ { "id": 1, "dir": "...", "duty": ..., "v": ..., "i": ... }, ... ]}
+      - GET /api/state  -> {"generators": [ { "id": 1, "dir": "...", "duty": ..., "v": ..., "i": ... }, ... ],
+                            "seq": sample number, "ts": its ticks_ms, "now": ticks_ms of the reply}
       - GET /api/control?g=1&dir=fwd&duty=30000
+      - GET /api/setpoint?g=1&amps=-0.25  (on-device PI regulation)
+      - GET /api/regulator -> tracking error, saturation, loop timing
+      - GET /api/feedforward?g=1&amps=..&duty=.. -> feed-forward table for the PI loop
+      - GET /api/sensors[?sample_hz=N] -> ADC modes, read counters, telemetry rate
+      - GET /api/control?duties=d1,d2,... -> all generators at once (signed duty)
+      - POST /api/sequence -> upload/run a timed setpoint program
+      - GET /api/stream -> Server-Sent Events, one line per sensor sample
+      - GET /api/history?since=<seq> -> buffered samples (binary) to fill gaps
+
+    Requests go over persistent connections in two lanes: reads use the
+    "poll" session and control commands the "cmd" session, so a slow state
+    poll never holds up a command. Per-request latency is counted in
+    latency_stats().
     """
 
     def __init__(self, host="192.168.8.48", port=80, timeout=2.0):
@@ -22,23 +43,349 @@ class ESP32Client:
         self.base_url = base.rstrip("/")
         self.timeout = timeout
 
+        self._sessions = {"poll": _new_session(), "cmd": _new_session()}
+        self._latency = {}  # request name -> LatencyCounter
+        self._latency_lock = threading.Lock()
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+
+    def _request(self, lane, name, path, params=None, json=None):
+        """GET (or POST with json) on a lane's session, timed under `name`."""
+        session = self._sessions[lane]
+        url = self.base_url + path
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            if json is None:
+                r = session.get(url, params=params, timeout=self.timeout)
+            else:
+                r = session.post(url, json=json, timeout=self.timeout)
+            r.raise_for_status()
+            ok = True
+            return r
+        finally:
+            self._record(name, time.perf_counter() - t0, ok)
+
+    def _record(self, name, seconds, ok):
+        with self._latency_lock:
+            counter = self._latency.get(name)
+            if counter is None:
+                counter = self._latency[name] = LatencyCounter()
+            counter.add(seconds, ok)
+
+    def latency_stats(self, reset=False):
+        """{request name: {"count", "errors", "mean_ms", "p50_ms", "p99_ms", "max_ms"}}"""
+        with self._latency_lock:
+            out = {name: c.summary() for name, c in self._latency.items()}
+            if reset:
+                self._latency.clear()
+        return out
+
+    def command_lane(self, on_error=None):
+        """A CommandLane sending through this client (see Worker)."""
+        return CommandLane(self, on_error)
+
     def get_state(self):
         """Return list of generator dicts from /api/state."""
-        url = f"{self.base_url}/api/state"
-        r = requests.get(url, timeout=self.timeout)
-        r.raise_for_status()
-        data = r.json()
+        data = self._request("poll", "state", "/api/state").json()
         # firmware returns {"generators": [...]}
         return data.get("generators", [])
 
+    def get_snapshot(self):
+        """The whole /api/state reply, with the sample's seq/ts and the reply time ("now")."""
+        return self._request("poll", "state", "/api/state").json()
+
     def set_generator(self, generator_id, direction="stop", duty=0):
         """
         generator_id: 1..N  (1-based ID, as exposed by the ESP32 API)
         direction: 'stop', 'fwd', 'rev'
         duty: 0..65535
         """
-        url = f"{self.base_url}/api/control"
         params = {"g": generator_id, "dir": direction, "duty": duty}
-        r = requests.get(url, params=params, timeout=self.timeout)
-        r.raise_for_status()
-        return r.json()
+        return self._request("cmd", "control", "/api/control", params).json()
+
+    def set_all_duties(self, duties):
+        """Set every generator in one request; signed duties, negative = rev."""
+        params = {"duties": ",".join(str(int(d)) for d in duties)}
+        return self._request("cmd", "control", "/api/control", params).json()
+
+    def upload_sequence(self, steps, loop=False, period_ms=None, start=False, delay_ms=0):
+        """
+        Upload a setpoint program executed by the ESP32's timer.
+        steps: [(t_ms, generator_id, "amps" | "duty", value), ...]; entries
+        with the same t_ms are applied in the same tick.
+        """
+        program = {
+            "steps": [list(s) for s in steps],
+            "loop": loop,
+            "start": start,
+            "delay_ms": delay_ms,
+        }
+        if period_ms is not None:
+            program["period_ms"] = period_ms
+        return self._request("cmd", "sequence", "/api/sequence", json=program).json()
+
+    def start_sequence(self, delay_ms=0):
+        return self._sequence(action="start", delay_ms=delay_ms)
+
+    def stop_sequence(self):
+        return self._sequence(action="stop")
+
+    def get_sequence(self):
+        """Sequencer status: running, start_ms, per-step lateness_us, ..."""
+        return self._sequence()["sequence"]
+
+    def _sequence(self, **params):
+        lane = "cmd" if params else "poll"
+        return self._request(lane, "sequence", "/api/sequence", params or None).json()
+
+    def set_current(self, generator_id, amps, kp=None, ki=None):
+        """
+        Regulate a generator on the device to a signed current (A);
+        negative = reverse, 0 = stop. kp/ki optionally retune the PI loop.
+        """
+        params = {"g": generator_id, "amps": amps}
+        if kp is not None:
+            params["kp"] = kp
+        if ki is not None:
+            params["ki"] = ki
+        return self._request("cmd", "setpoint", "/api/setpoint", params).json()
+
+    def set_gains(self, generator_id, kp=None, ki=None):
+        """Retune a generator's PI loop on the device; its setpoint is left as it is."""
+        params = {"g": generator_id}
+        if kp is not None:
+            params["kp"] = kp
+        if ki is not None:
+            params["ki"] = ki
+        return self._request("cmd", "gains", "/api/gains", params).json()
+
+    def set_feedforward(self, generator_id, amps, duty):
+        """Install an |amps| -> duty feed-forward table on the device regulator ([] clears)."""
+        params = {
+            "g": generator_id,
+            "amps": ",".join(f"{a:.5g}" for a in amps),
+            "duty": ",".join(f"{d:.0f}" for d in duty),
+        }
+        return self._request("cmd", "feedforward", "/api/feedforward", params).json()
+
+    def get_sensors(self, sample_hz=None):
+        """Sensor ADC modes/counters and the telemetry sample rate; optionally change the rate."""
+        params = {"sample_hz": int(sample_hz)} if sample_hz else None
+        return self._request("poll", "sensors", "/api/sensors", params).json()
+
+    def get_regulator(self, reset=False):
+        """Return {"channels": [...], "timing": {...}} from /api/regulator."""
+        params = {"reset": 1} if reset else None
+        return self._request("poll", "regulator", "/api/regulator", params).json()
+
+    def get_history(self, since=0, max_samples=None):
+        """
+        Samples newer than `since` still held in the device's ring buffer,
+        decoded by parse_history(). Call again with since=result["seq"][-1]
+        until "count" is 0 to drain a longer gap.
+        """
+        params = {"since": since}
+        if max_samples is not None:
+            params["max"] = max_samples
+        return parse_history(self._request("poll", "history", "/api/history", params).content)
+
+    def stream(self, read_timeout=5.0):
+        """
+        Subscribe to /api/stream and yield one sample per sensor update:
+          (seq, ts_ms, generators)
+        where generators has the same dicts as get_state(). The connection
+        stays open until the generator is closed. It uses its own
+        connection, outside both lanes.
+        """
+        url = f"{self.base_url}/api/stream"
+        with requests.get(
+            url, stream=True, timeout=(self.timeout, read_timeout)
+        ) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(chunk_size=None):
+                if not line.startswith(b"data: "):
+                    continue
+                yield parse_sample(line[6:].decode())
+
+
+def _new_session():
+    # one kept-alive connection is all the ESP32 needs per lane
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class LatencyCounter:
+    """Request count, errors and latency (mean/max plus percentiles of the last `window`)."""
+
+    def __init__(self, window=500):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds, ok=True):
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def pct(q):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(q / 100.0 * len(recent)))] * 1e3
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+            "p50_ms": pct(50),
+            "p99_ms": pct(99),
+            "max_ms": self.max * 1e3,
+        }
+
+
+class CommandLane:
+    """
+    Sends control commands from its own thread, on the client's "cmd" lane.
+
+    Unsent commands are kept per key (normally the generator id) and a
+    newer one replaces the older, so only the latest value goes out. STOPs
+    are sent before any other pending command and drop the pending
+    non-stop command for their key.
+    """
+
+    def __init__(self, client, on_error=None):
+        self.client = client
+        self.on_error = on_error
+        self._stops = {}  # key -> (name, args)
+        self._pending = {}  # key -> (name, args), insertion ordered
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.sent = 0
+        self.coalesced = 0  # commands replaced before they were sent
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, key, name, args, stop=False):
+        """Queue client.<name>(*args) for `key`, replacing any unsent command for it."""
+        with self._cond:
+            if stop:
+                if self._stops.pop(key, None) is not None:
+                    self.coalesced += 1
+                if self._pending.pop(key, None) is not None:
+                    self.coalesced += 1
+                self._stops[key] = (name, args)
+            else:
+                if self._pending.pop(key, None) is not None:
+                    self.coalesced += 1
+                self._pending[key] = (name, args)
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._stops) + len(self._pending)
+
+    def _next(self):
+        with self._cond:
+            while self._running and not (self._stops or self._pending):
+                self._cond.wait()
+            if not self._running and not self._stops:
+                return None  # pending STOPs still go out on shutdown
+            queue = self._stops if self._stops else self._pending
+            key = next(iter(queue))
+            return queue.pop(key)
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            name, args = item
+            try:
+                getattr(self.client, name)(*args)
+                self.sent += 1
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(f"Control error: {e}")
+
+
+def parse_sample(payload):
+    """Decode 'seq,ts_ms,v1,i1,d1,v2,i2,d2,...' (d = signed duty)."""
+    f = payload.split(",")
+    seq, ts_ms = int(f[0]), int(f[1])
+    generators = []
+    for k in range(2, len(f) - 2, 3):
+        d = int(f[k + 2])
+        generators.append(
+            {
+                "id": (k - 2) // 3 + 1,
+                "dir": "fwd" if d > 0 else ("rev" if d < 0 else "stop"),
+                "duty": abs(d),
+                "v": float(f[k]) if f[k] else None,
+                "i": float(f[k + 1]) if f[k + 1] else None,
+            }
+        )
+    return seq, ts_ms, generators
+
+
+HISTORY_HEADER = struct.Struct("<4sBBHIIff")
+
+
+def parse_history(data):
+    """
+    Decode an /api/history block into numpy arrays:
+      {"first_seq", "latest_seq", "count", "seq"[count], "ts_ms"[count],
+       "v"[count, n], "i"[count, n], "duty"[count, n]}
+    v and i are in volts and amps, NaN where a generator has no sensor.
+    """
+    magic, version, n, count, first, latest, v_lsb, i_lsb = HISTORY_HEADER.unpack_from(data)
+    if magic != b"HIST" or version != 1:
+        raise ValueError(f"Not a history block: {magic!r} v{version}")
+    off = HISTORY_HEADER.size
+    ts = np.frombuffer(data, "<u4", count, off)
+    off += 4 * count
+    v_raw = np.frombuffer(data, "<i2", count * n, off).reshape(count, n)
+    off += 2 * count * n
+    i_raw = np.frombuffer(data, "<i2", count * n, off).reshape(count, n)
+    off += 2 * count * n
+    duty = np.frombuffer(data, "<i4", count * n, off).reshape(count, n)
+
+    missing = v_raw < 0
+    v = np.where(missing, np.nan, v_raw * v_lsb)
+    i = np.where(missing, np.nan, i_raw * i_lsb)
+    return {
+        "first_seq": first,
+        "latest_seq": latest,
+        "count": count,
+        "seq": np.arange(first, first + count),
+        "ts_ms": ts,
+        "v": v,
+        "i": i,
+        "duty": duty,
+    }
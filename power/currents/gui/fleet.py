@@ -0,0 +1,273 @@
+"""
+Several current-supply boards driven as one flat set of channels.
+
+Channels are numbered 1..N in board order: with boards A (5 generators)
+and B (3 generators), channel 6 is B's generator 1. A Fleet has the same
+read/control methods as ESP32Client (get_state, set_current, ...) with
+channel numbers in place of generator ids, so Worker and the GUI can use
+either.
+"""
+
+import ipaddress
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from esp32_client import ESP32Client
+
+
+class Board:
+    """One ESP32 in the fleet and its slice of the channel space."""
+
+    def __init__(self, client, n_channels, offset):
+        self.client = client
+        self.n_channels = n_channels
+        self.offset = offset  # channel number = offset + generator id
+        self.generators = []  # latest generator dicts, board-local ids
+        self.last_ok = None  # time.monotonic() of the latest good sample
+        self.last_rtt = None  # seconds, latest get_state round trip
+        self.errors = 0
+
+    @property
+    def host(self):
+        return self.client.base_url
+
+    def age(self):
+        """Seconds since the latest good sample (None before the first)."""
+        if self.last_ok is None:
+            return None
+        return time.monotonic() - self.last_ok
+
+
+class Fleet:
+    """
+    Connects to all boards at once and polls them concurrently, one pool
+    thread per board, so a poll takes as long as the slowest board rather
+    than the sum of all of them.
+    """
+
+    def __init__(self, hosts, port=80, timeout=2.0):
+        self.port = port
+        self.timeout = timeout
+        self.boards = []
+        self._routes = {}  # channel -> (board, generator id)
+        self._pool = None
+        self._connect(hosts)
+
+    # ====================================
+    # DISCOVERY / CONNECTION
+    # ====================================
+
+    @staticmethod
+    def discover(network, port=80, timeout=0.5, workers=64):
+        """
+        Hosts in `network` (e.g. "192.168.8.0/24") that answer /api/state
+        like a current supply, in address order.
+        """
+
+        def probe(host):
+            try:
+                r = requests.get(f"http://{host}:{port}/api/state", timeout=timeout)
+                if r.ok and "generators" in r.json():
+                    return host
+            except (requests.RequestException, ValueError):
+                pass
+            return None
+
+        hosts = [str(h) for h in ipaddress.ip_network(network, strict=False).hosts()]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return [h for h in pool.map(probe, hosts) if h is not None]
+
+    def _connect(self, hosts):
+        clients = [ESP32Client(host=h, port=self.port, timeout=self.timeout) for h in hosts]
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(clients)))
+        states = list(self._pool.map(lambda c: c.get_state(), clients))
+
+        offset = 0
+        for client, generators in zip(clients, states):
+            board = Board(client, len(generators), offset)
+            board.generators = generators
+            board.last_ok = time.monotonic()
+            self.boards.append(board)
+            for g in generators:
+                self._routes[offset + g["id"]] = (board, g["id"])
+            offset += len(generators)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        for board in self.boards:
+            board.client.close()
+
+    @property
+    def n_channels(self):
+        return sum(b.n_channels for b in self.boards)
+
+    def channels(self):
+        """[(channel, host, generator id), ...] in channel order."""
+        return [
+            (ch, board.host, gen_id)
+            for ch, (board, gen_id) in sorted(self._routes.items())
+        ]
+
+    def route(self, channel):
+        """(board, generator id) for a channel number; KeyError if unknown."""
+        return self._routes[channel]
+
+    # ====================================
+    # READS
+    # ====================================
+
+    def _flat(self):
+        out = []
+        for board in self.boards:
+            for g in board.generators:
+                g = dict(g)
+                g["board"] = board.host
+                g["gen"] = g["id"]
+                g["id"] = board.offset + g["id"]
+                out.append(g)
+        return out
+
+    def _poll_board(self, board):
+        t0 = time.perf_counter()
+        try:
+            board.generators = board.client.get_state()
+        except Exception:
+            board.errors += 1
+            raise
+        board.last_rtt = time.perf_counter() - t0
+        board.last_ok = time.monotonic()
+
+    def get_state(self):
+        """
+        Poll every board concurrently and return all channels as generator
+        dicts numbered by channel, plus "board" and "gen" (local id).
+        A board that fails keeps its previous values (see board_stats()
+        age); the call only raises if every board failed.
+        """
+        futures = [self._pool.submit(self._poll_board, b) for b in self.boards]
+        errors = [f.exception() for f in futures]
+        if errors and all(e is not None for e in errors):
+            raise errors[0]
+        return self._flat()
+
+    def stream(self, read_timeout=5.0):
+        """
+        Merge every board's /api/stream into (seq, ts_ms, generators) like
+        ESP32Client.stream(). One sample is yielded per sample of the first
+        board; the other boards' channels hold their latest values.
+        """
+        q = queue.Queue(maxsize=1000)
+        stop = threading.Event()
+
+        def reader(index, board):
+            # the first board paces the merged stream and ends it on error;
+            # the others reconnect on their own
+            while not stop.is_set():
+                try:
+                    samples = board.client.stream(read_timeout)
+                    for seq, ts_ms, generators in samples:
+                        board.generators = generators
+                        board.last_ok = time.monotonic()
+                        if index == 0:
+                            try:
+                                q.put_nowait((seq, ts_ms))
+                            except queue.Full:  # consumer gone or stalled
+                                pass
+                        if stop.is_set():
+                            break
+                    samples.close()
+                except Exception as e:
+                    board.errors += 1
+                    if index == 0:
+                        q.put(e)  # may block only if the consumer is gone
+                        return
+                    stop.wait(1.0)
+
+        for index, board in enumerate(self.boards):
+            threading.Thread(target=reader, args=(index, board), daemon=True).start()
+        try:
+            while True:
+                item = q.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item[0], item[1], self._flat()
+        finally:
+            stop.set()
+
+    def board_stats(self):
+        """Per board: host, channel range, latest round trip, sample age, errors and latency counters."""
+        out = []
+        for board in self.boards:
+            age = board.age()
+            out.append(
+                {
+                    "host": board.host,
+                    "channels": (board.offset + 1, board.offset + board.n_channels),
+                    "rtt_ms": None if board.last_rtt is None else board.last_rtt * 1e3,
+                    "age_ms": None if age is None else age * 1e3,
+                    "errors": board.errors,
+                    "latency": board.client.latency_stats(),
+                }
+            )
+        return out
+
+    # ====================================
+    # CONTROL (by channel)
+    # ====================================
+
+    def set_generator(self, channel, direction="stop", duty=0):
+        board, gen_id = self.route(channel)
+        return board.client.set_generator(gen_id, direction, duty)
+
+    def set_current(self, channel, amps, kp=None, ki=None):
+        board, gen_id = self.route(channel)
+        return board.client.set_current(gen_id, amps, kp, ki)
+
+    def stop_all(self):
+        """Set every channel of every board to 0 A, concurrently."""
+        futures = [
+            self._pool.submit(b.client.set_all_duties, [0] * b.n_channels) for b in self.boards
+        ]
+        for f in futures:
+            f.result()
+
+    def command_lane(self, on_error=None):
+        return FleetCommandLane(self, on_error)
+
+
+class FleetCommandLane:
+    """
+    CommandLane interface over one lane per board, so a slow board never
+    holds up commands (or STOPs) for the others.
+    """
+
+    def __init__(self, fleet, on_error=None):
+        self.fleet = fleet
+        self.lanes = {id(b): b.client.command_lane(on_error) for b in fleet.boards}
+
+    def start(self):
+        for lane in self.lanes.values():
+            lane.start()
+        return self
+
+    def stop(self, timeout=None):
+        for lane in self.lanes.values():
+            lane.stop(timeout)
+
+    def submit(self, key, name, args, stop=False):
+        """key and args[0] are channel numbers; they are mapped to the board's generator id."""
+        board, gen_id = self.fleet.route(args[0])
+        self.lanes[id(board)].submit(gen_id, name, (gen_id,) + tuple(args[1:]), stop)
+
+    def pending(self):
+        return sum(lane.pending() for lane in self.lanes.values())
+
+    @property
+    def coalesced(self):
+        return sum(lane.coalesced for lane in self.lanes.values())
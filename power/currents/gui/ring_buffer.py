@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity numpy ring of samples, one row per channel.
+
+    Every sample is written twice, `capacity` columns apart, so the most
+    recent `count` samples are always one contiguous slice: view() costs no
+    copy and no reordering, wherever the write position is.
+    """
+
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self.capacity = int(capacity)
+        self.channels = channels
+        self._data = np.zeros((channels, 2 * self.capacity), dtype=dtype)
+        self._pos = 0  # next write column, 0..capacity-1
+        self.count = 0  # samples held, <= capacity
+        self.total = 0  # samples ever appended
+
+    def clear(self):
+        self._pos = 0
+        self.count = 0
+        self.total = 0
+
+    def append(self, sample):
+        """Add one sample (a value per channel)."""
+        p = self._pos
+        self._data[:, p] = sample
+        self._data[:, p + self.capacity] = sample
+        self._pos = p + 1 if p + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+
+    def extend(self, samples):
+        """Add a block of samples shaped (channels, n)."""
+        samples = np.asarray(samples, dtype=self._data.dtype).reshape(self.channels, -1)
+        n = samples.shape[1]
+        self.total += n
+        if n > self.capacity:
+            samples = samples[:, -self.capacity :]
+            n = self.capacity
+        cap, p = self.capacity, self._pos
+        first = min(n, cap - p)
+        self._data[:, p : p + first] = samples[:, :first]
+        self._data[:, p + cap : p + cap + first] = samples[:, :first]
+        rest = n - first
+        if rest:
+            self._data[:, :rest] = samples[:, first:]
+            self._data[:, cap : cap + rest] = samples[:, first:]
+        self._pos = (p + n) % cap
+        self.count = min(cap, self.count + n)
+
+    def view(self, channel=None):
+        """
+        The held samples, oldest first, as a view into the buffer (shape
+        (channels, count), or (count,) for one channel). Copy it to keep it
+        past the next append.
+        """
+        end = self._pos + self.capacity
+        if channel is None:
+            return self._data[:, end - self.count : end]
+        return self._data[channel, end - self.count : end]
+
+    def last(self):
+        """The newest sample (one value per channel)."""
+        return self._data[:, self._pos + self.capacity - 1]
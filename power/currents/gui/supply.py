@@ -0,0 +1,362 @@
+"""
+Headless control of the current supply: set currents, ramps and step
+sequences, wait for settling, stream telemetry. No Qt involved, so it
+starts quickly and can be driven from scripts and notebooks:
+
+    from supply import Supply
+    with Supply(["192.168.8.48"]) as s:
+        s.set_current(1, 0.2, settle=True)
+        s.ramp(1, 0.2, -0.2, rate=0.1)
+        s.steps(1, [(0.1, 2.0), (0.3, 2.0), (0.0, 1.0)], settle=True)
+
+or from the shell:
+
+    python gui/supply.py --host 192.168.8.48 set 1 0.2 --settle
+    python gui/supply.py --host 192.168.8.48 --log run.csv ramp 1 0 0.5 --rate 0.05
+    python gui/supply.py --host 192.168.8.48 watch --duration 10
+    python gui/supply.py --host 192.168.8.48 stop
+
+On exit, however it exits (done, Ctrl-C or an error), the command line
+leaves every channel as it was last set; only `stop` turns channels off.
+So a ramp ends at its last level. Supply used as a context manager still
+stops every channel on close.
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from fleet import Fleet
+
+
+def signed_current(g):
+    """Measured current with the bridge direction applied (None if no sensor)."""
+    i = g.get("i")
+    if i is None:
+        return None
+    return -i if g.get("dir") == "rev" else i
+
+
+def signed_duty(g):
+    d = g.get("duty", 0)
+    return -d if g.get("dir") == "rev" else (0 if g.get("dir") == "stop" else d)
+
+
+class TelemetryWriter:
+    """
+    Streams samples to a text file (or stdout) as CSV from its own thread:
+      t,seq,ts_ms,v1,i1,d1,v2,i2,d2,...
+    with i and d signed (negative = rev) and empty v/i where there is no sensor.
+    """
+
+    def __init__(self, fleet, out, flush_every=50):
+        self.fleet = fleet
+        self.out = out
+        self.flush_every = flush_every
+        self.samples = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        cols = ["t", "seq", "ts_ms"]
+        for ch, _host, _gen in self.fleet.channels():
+            cols += [f"v{ch}", f"i{ch}", f"d{ch}"]
+        self.out.write(",".join(cols) + "\n")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+        self.out.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            samples = self.fleet.stream()
+            try:
+                for seq, ts_ms, generators in samples:
+                    self._write(seq, ts_ms, generators)
+                    if self._stop.is_set():
+                        break
+            except Exception as e:  # board went away; retry until stopped
+                self.error = e
+                self._stop.wait(1.0)
+            finally:
+                samples.close()
+
+    def _write(self, seq, ts_ms, generators):
+        parts = [f"{time.time():.3f}", str(seq), str(ts_ms)]
+        for g in generators:
+            i = signed_current(g)
+            parts.append("" if g.get("v") is None else f"{g['v']:.3f}")
+            parts.append("" if i is None else f"{i:.5f}")
+            parts.append(str(signed_duty(g)))
+        self.out.write(",".join(parts) + "\n")
+        self.samples += 1
+        if self.samples % self.flush_every == 0:
+            self.out.flush()
+
+
+class Supply:
+    """
+    Channel-level control of one or more boards (see Fleet for numbering).
+    Setpoints are regulated on the boards; this class only sends targets
+    and watches the measured current.
+    """
+
+    def __init__(self, hosts, port=80, timeout=2.0, poll_interval=0.02):
+        if isinstance(hosts, str):
+            hosts = [h.strip() for h in hosts.split(",") if h.strip()]
+        self.fleet = Fleet(hosts, port=port, timeout=timeout)
+        self.poll_interval = poll_interval
+        self.targets = {}  # channel -> last commanded amps
+        self._writer = None
+        self._writer_owns_file = False
+
+    def close(self, stop=True):
+        """Stop telemetry output and (by default) every channel, then disconnect."""
+        self.stop_telemetry()
+        try:
+            if stop:
+                self.stop()
+        finally:
+            self.fleet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def channels(self):
+        return [ch for ch, _host, _gen in self.fleet.channels()]
+
+    # ====================================
+    # SETPOINTS
+    # ====================================
+
+    def set_current(self, channel, amps, settle=False, **settle_kw):
+        """Regulate a channel to a signed current (A); 0 stops it."""
+        self.fleet.set_current(channel, amps)
+        self.targets[channel] = amps
+        if settle:
+            return self.wait_settled({channel: amps}, **settle_kw)
+        return True
+
+    def set_currents(self, targets, settle=False, **settle_kw):
+        """Set several channels, {channel: amps}, then optionally wait for all of them."""
+        for channel, amps in targets.items():
+            self.fleet.set_current(channel, amps)
+            self.targets[channel] = amps
+        if settle:
+            return self.wait_settled(targets, **settle_kw)
+        return True
+
+    def stop(self, channel=None):
+        """Stop one channel, or all of them."""
+        if channel is None:
+            self.fleet.stop_all()
+            self.targets = {ch: 0.0 for ch in self.targets}
+        else:
+            self.set_current(channel, 0.0)
+
+    # ====================================
+    # MEASUREMENT / SETTLING
+    # ====================================
+
+    def measure(self):
+        """{channel: signed measured amps (None without a sensor)} from one poll."""
+        return {g["id"]: signed_current(g) for g in self.fleet.get_state()}
+
+    def wait_settled(self, targets=None, tol=0.005, rel_tol=0.02, hold=0.2, timeout=5.0):
+        """
+        Poll until every channel in targets ({channel: amps}, default: all
+        commanded ones) is within max(tol, rel_tol*|target|) of its target
+        for `hold` seconds. Returns True when settled, False on timeout.
+        Channels without a sensor are not waited for.
+        """
+        targets = dict(self.targets if targets is None else targets)
+        end = time.monotonic() + timeout
+        since = None
+        while True:
+            now = time.monotonic()
+            measured = self.measure()
+            ok = True
+            for ch, target in targets.items():
+                i = measured.get(ch)
+                if i is not None and abs(i - target) > max(tol, rel_tol * abs(target)):
+                    ok = False
+                    break
+            if ok:
+                if since is None:
+                    since = now
+                if now - since >= hold:
+                    return True
+            else:
+                since = None
+            if now >= end:
+                return False
+            time.sleep(self.poll_interval)
+
+    # ====================================
+    # WAVEFORMS
+    # ====================================
+
+    def ramp(self, channel, start, stop, rate=None, duration=None, step=0.02, settle=False):
+        """
+        Move a channel linearly from start to stop (A), at `rate` A/s or
+        over `duration` s, sending a new setpoint every `step` seconds on
+        a fixed schedule (late steps are not made up).
+        """
+        if duration is None:
+            if not rate:
+                raise ValueError("give rate or duration")
+            duration = abs(stop - start) / abs(rate)
+        t0 = time.monotonic()
+        n = max(1, int(round(duration / step)))
+        for k in range(n + 1):
+            amps = start + (stop - start) * k / n
+            self.fleet.set_current(channel, amps)
+            delay = t0 + (k + 1) * step - time.monotonic()
+            if delay > 0 and k < n:
+                time.sleep(delay)
+        self.targets[channel] = stop
+        if settle:
+            return self.wait_settled({channel: stop})
+        return True
+
+    def steps(self, channel, levels, settle=False, repeat=1, **settle_kw):
+        """
+        Step a channel through [(amps, dwell_s), ...]. With settle=True the
+        dwell starts once the current has settled. Returns the settling
+        times (s, None if it timed out) for each step.
+        """
+        times = []
+        for _ in range(repeat):
+            for amps, dwell in levels:
+                t0 = time.monotonic()
+                self.set_current(channel, amps)
+                if settle:
+                    ok = self.wait_settled({channel: amps}, **settle_kw)
+                    times.append(time.monotonic() - t0 if ok else None)
+                time.sleep(dwell)
+        return times
+
+    # ====================================
+    # TELEMETRY
+    # ====================================
+
+    def start_telemetry(self, out=None):
+        """Stream every sample as CSV to `out` (a path, file object, or stdout)."""
+        self.stop_telemetry()
+        self._writer_owns_file = isinstance(out, str) and out != "-"
+        if out is None or out == "-":
+            f = sys.stdout
+        elif self._writer_owns_file:
+            f = open(out, "w")
+        else:
+            f = out
+        self._writer = TelemetryWriter(self.fleet, f).start()
+        return self._writer
+
+    def stop_telemetry(self):
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.stop()
+            if self._writer_owns_file:
+                writer.out.close()
+
+
+# ====================================
+# CLI
+# ====================================
+
+
+def _parse_levels(items):
+    """'0.2:1.5' -> (0.2, 1.5) (amps, dwell seconds)."""
+    levels = []
+    for item in items:
+        amps, _, dwell = item.partition(":")
+        levels.append((float(amps), float(dwell or 1.0)))
+    return levels
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Headless current-supply control")
+    ap.add_argument("--host", action="append", required=True,
+                    help="board host; repeat or comma-separate for several boards")
+    ap.add_argument("--port", type=int, default=80)
+    ap.add_argument("--log", default=None, help="stream telemetry CSV to this file ('-' = stdout)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("set", help="set a channel current")
+    p.add_argument("channel", type=int)
+    p.add_argument("amps", type=float)
+    p.add_argument("--settle", action="store_true")
+    p.add_argument("--hold", type=float, default=0.0, help="seconds to wait (and log) before exiting")
+
+    p = sub.add_parser("ramp", help="linear ramp")
+    p.add_argument("channel", type=int)
+    p.add_argument("start", type=float)
+    p.add_argument("stop", type=float)
+    p.add_argument("--rate", type=float, help="A/s")
+    p.add_argument("--time", type=float, help="ramp duration, s")
+    p.add_argument("--step-ms", type=float, default=20.0)
+
+    p = sub.add_parser("steps", help="step sequence, levels as AMPS:DWELL_S")
+    p.add_argument("channel", type=int)
+    p.add_argument("levels", nargs="+")
+    p.add_argument("--settle", action="store_true")
+    p.add_argument("--repeat", type=int, default=1)
+
+    sub.add_parser("stop", help="stop every channel")
+
+    p = sub.add_parser("watch", help="stream telemetry CSV (to the --log file if given)")
+    p.add_argument("--duration", type=float, default=None, help="seconds (default: until Ctrl-C)")
+    p.add_argument("--out", default=None, help="default: stdout")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "watch" and args.log and args.out:
+        ap.error("watch streams to --log or --out, not both")
+    hosts = [h.strip() for arg in args.host for h in arg.split(",") if h.strip()]
+    supply = Supply(hosts, port=args.port)
+    try:
+        if args.log:
+            supply.start_telemetry(args.log)
+        if args.cmd == "set":
+            ok = supply.set_current(args.channel, args.amps, settle=args.settle)
+            if args.settle:
+                print("settled" if ok else "not settled", file=sys.stderr)
+            time.sleep(args.hold)
+        elif args.cmd == "ramp":
+            supply.ramp(args.channel, args.start, args.stop, rate=args.rate,
+                        duration=args.time, step=args.step_ms / 1000.0)
+        elif args.cmd == "steps":
+            times = supply.steps(args.channel, _parse_levels(args.levels),
+                                 settle=args.settle, repeat=args.repeat)
+            if args.settle:
+                print("settling times (s):",
+                      " ".join("-" if t is None else f"{t:.3f}" for t in times),
+                      file=sys.stderr)
+        elif args.cmd == "stop":
+            supply.stop()
+        elif args.cmd == "watch":
+            if not args.log:  # else --log is already streaming
+                supply.start_telemetry(args.out)
+            end = None if args.duration is None else time.monotonic() + args.duration
+            while end is None or time.monotonic() < end:
+                time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supply.close(stop=False)  # only the stop command turns channels off
+
+
+if __name__ == "__main__":
+    main()
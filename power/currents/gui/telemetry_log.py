@@ -0,0 +1,300 @@
+"""
+Telemetry logging: every sample to disk, off the GUI and polling threads.
+
+Files are a header followed by chunks; each chunk holds up to chunk_rows
+samples stored column by column, so a reader can memory-map a file and
+take any column of a chunk as a numpy view without parsing rows.
+
+    file   = FILE_HEADER (magic "CTLG", version, n_generators)  chunk*
+    chunk  = CHUNK_HEADER (magic "CHNK", rows)  column*   (8-byte aligned)
+    column = rows values of COLUMNS[k], shaped (rows,) or (rows, n_generators)
+
+v/i are NaN where the sensor is missing; dir is -1 rev / 0 stop / 1 fwd.
+"""
+
+import datetime
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+FILE_MAGIC = b"CTLG"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sHH8x")
+CHUNK_MAGIC = b"CHNK"
+CHUNK_HEADER = struct.Struct("<4sI8x")
+
+# name, dtype, per generator
+COLUMNS = (
+    ("t", "<f8", False),  # host time.time()
+    ("seq", "<i8", False),  # device sample number, -1 when polled
+    ("ts_ms", "<i8", False),  # device ticks_ms, -1 when polled
+    ("v", "<f4", True),
+    ("i", "<f4", True),
+    ("dir", "<i1", True),
+    ("duty", "<u2", True),
+)
+
+DIRS = {"rev": -1, "stop": 0, "fwd": 1}
+
+
+def _pad8(n):
+    return (n + 7) & ~7
+
+
+def chunk_size(rows, n_generators):
+    """Bytes taken by one chunk of `rows` samples, header included."""
+    size = CHUNK_HEADER.size
+    for _name, dtype, per_gen in COLUMNS:
+        size += _pad8(rows * np.dtype(dtype).itemsize * (n_generators if per_gen else 1))
+    return size
+
+
+class TelemetryLogger:
+    """
+    Background writer fed through a bounded queue.
+
+    log() never blocks: when the queue is full the sample is counted in
+    `dropped` and discarded. The writer thread fills one chunk at a time
+    and writes it when full or every flush_interval seconds, starting a
+    new file after rotate_bytes.
+    """
+
+    def __init__(
+        self,
+        directory,
+        n_generators,
+        chunk_rows=4096,
+        flush_interval=1.0,
+        rotate_bytes=64 * 1024 * 1024,
+        queue_size=100000,
+        prefix="telemetry",
+    ):
+        self.directory = directory
+        self.n_generators = n_generators
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.prefix = prefix
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._file = None
+        self._file_bytes = 0
+        self._file_index = 0
+        self._rows = 0
+        self._cols = {
+            name: np.zeros((chunk_rows, n_generators) if per_gen else chunk_rows, dtype)
+            for name, dtype, per_gen in COLUMNS
+        }
+
+        self.files = []  # paths written so far
+        self.written = 0  # rows on disk
+        self.dropped = 0  # rows lost to a full queue
+
+    # ------------------------------------------------------------------
+    # producer side (any thread)
+    # ------------------------------------------------------------------
+
+    def log(self, sample):
+        """Queue (t, seq, ts_ms, generators) for writing; never blocks."""
+        try:
+            self._queue.put_nowait(sample)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self, timeout=5.0):
+        """Write what is queued, then close the current file."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ------------------------------------------------------------------
+    # writer thread
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    self._add(item)
+                    if self._rows == self.chunk_rows:
+                        self._write_chunk()
+                if time.monotonic() >= next_flush:
+                    if self._rows:
+                        self._write_chunk()
+                    next_flush = time.monotonic() + self.flush_interval
+        finally:
+            if self._rows:
+                self._write_chunk()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _add(self, sample):
+        t, seq, ts_ms, generators = sample
+        r = self._rows
+        cols = self._cols
+        cols["t"][r] = t
+        cols["seq"][r] = seq
+        cols["ts_ms"][r] = ts_ms
+        cols["v"][r] = np.nan
+        cols["i"][r] = np.nan
+        cols["dir"][r] = 0
+        cols["duty"][r] = 0
+        for g in generators:
+            idx = g.get("id", 0) - 1
+            if not (0 <= idx < self.n_generators):
+                continue
+            if g.get("v") is not None:
+                cols["v"][r, idx] = g["v"]
+            if g.get("i") is not None:
+                cols["i"][r, idx] = g["i"]
+            cols["dir"][r, idx] = DIRS.get(g.get("dir"), 0)
+            cols["duty"][r, idx] = g.get("duty", 0)
+        self._rows = r + 1
+
+    def _open(self):
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(
+            self.directory, f"{self.prefix}-{stamp}-{self._file_index:03d}.ctl"
+        )
+        self._file_index += 1
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self.n_generators))
+        self._file_bytes = FILE_HEADER.size
+        self.files.append(path)
+
+    def _write_chunk(self):
+        if self._file is None or self._file_bytes >= self.rotate_bytes:
+            if self._file is not None:
+                self._file.close()
+            self._open()
+        n = self._rows
+        f = self._file
+        f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, n))
+        for name, _dtype, _per_gen in COLUMNS:
+            data = self._cols[name][:n].tobytes()
+            f.write(data)
+            f.write(b"\0" * (_pad8(len(data)) - len(data)))
+        f.flush()
+        self._file_bytes += chunk_size(n, self.n_generators)
+        self.written += n
+        self._rows = 0
+
+
+class TelemetryLog:
+    """
+    Lazy reader for one log file or a directory of them (in name order).
+
+    Only chunk headers are read when opening; column data stays in the
+    memory-mapped files until asked for. A chunk cut short by a crash is
+    ignored.
+    """
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            paths = sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(".ctl")
+            )
+        else:
+            paths = [path]
+        self.n_generators = None
+        self._maps = []
+        self._chunks = []  # (map index, offset, rows)
+        for p in paths:
+            self._index(p)
+
+    def _index(self, path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < FILE_HEADER.size:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_gen = FILE_HEADER.unpack_from(mm)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{path}: not a telemetry log")
+        if self.n_generators is None:
+            self.n_generators = n_gen
+        elif n_gen != self.n_generators:
+            raise ValueError(f"{path}: {n_gen} generators, expected {self.n_generators}")
+        self._maps.append(mm)
+        m = len(self._maps) - 1
+        off = FILE_HEADER.size
+        while off + CHUNK_HEADER.size <= len(mm):
+            magic, rows = CHUNK_HEADER.unpack_from(mm, off)
+            size = chunk_size(rows, n_gen)
+            if magic != CHUNK_MAGIC or off + size > len(mm):
+                break
+            self._chunks.append((m, off, rows))
+            off += size
+
+    def close(self):
+        for mm in self._maps:
+            mm.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(rows for _m, _off, rows in self._chunks)
+
+    @property
+    def n_chunks(self):
+        return len(self._chunks)
+
+    def chunk(self, k):
+        """Columns of chunk k as read-only numpy views into the mapped file."""
+        m, off, rows = self._chunks[k]
+        mm = self._maps[m]
+        off += CHUNK_HEADER.size
+        out = {}
+        for name, dtype, per_gen in COLUMNS:
+            width = self.n_generators if per_gen else 1
+            arr = np.frombuffer(mm, dtype, rows * width, off)
+            out[name] = arr.reshape(rows, width) if per_gen else arr
+            off += _pad8(arr.nbytes)
+        return out
+
+    def chunks(self):
+        for k in range(len(self._chunks)):
+            yield self.chunk(k)
+
+    def read(self, columns=None):
+        """Whole log as {column: array} (copies; use chunks() for big logs)."""
+        names = columns or [name for name, _dtype, _per_gen in COLUMNS]
+        parts = {name: [] for name in names}
+        for chunk in self.chunks():
+            for name in names:
+                parts[name].append(chunk[name])
+        out = {}
+        for name, dtype, per_gen in COLUMNS:
+            if name not in parts:
+                continue
+            if parts[name]:
+                out[name] = np.concatenate(parts[name])
+            else:
+                shape = (0, self.n_generators or 0) if per_gen else (0,)
+                out[name] = np.zeros(shape, dtype)
+        return out
@@ -1,67 +1,86 @@
 import time
-from queue import Queue, Empty
 
 from PySide6.QtCore import QThreadPool, QRunnable, QObject, Signal, Slot
 
 
 class WorkerSignals(QObject):
     state = Signal(list)  # list of generator dicts from /api/state
+    sample = Signal(object)  # (host time, seq, ts_ms, generators); seq/ts_ms -1 when polled
     error = Signal(str)
 
 
 class Worker(QRunnable):
     """
     Worker that:
-      - periodically polls all sensors via ESP32Client (get_state)
-      - processes queued control commands (set_generator) in the same thread
+      - periodically polls all sensors via ESP32Client (get_state), or with
+        stream=True receives every sample over one /api/stream connection
+      - hands control commands (set_generator, set_current) to a CommandLane,
+        which sends them from its own thread and connection, latest value
+        per generator first and STOPs ahead of everything else
     """
 
-    def __init__(self, client, interval=0.15):
+    def __init__(self, client, interval=0.15, stream=False):
         super().__init__()
         self.client = client
         self.interval = interval
+        self.stream = stream
         self.signals = WorkerSignals()
         self._running = True
 
-        # Queue of (gen_id, direction, duty)
-        self._command_queue = Queue()
+        # ESP32Client or Fleet; both hand out a matching command lane
+        self.commands = client.command_lane(on_error=self.signals.error.emit)
+
+        # Stream bookkeeping
+        self.last_seq = None
+        self.dropped = 0  # samples missed according to sequence numbers
 
     def stop(self):
         self._running = False
+        self.commands.stop(timeout=0)  # don't block the GUI on a command in flight
 
     def send_command(self, gen_id, direction, duty):
         """
         Called from GUI thread to enqueue a control command.
         """
-        self._command_queue.put((gen_id, direction, duty))
+        stop = direction == "stop" or duty == 0
+        self.commands.submit(gen_id, "set_generator", (gen_id, direction, duty), stop)
 
-    def _process_commands(self, max_per_cycle=10):
+    def send_setpoint(self, gen_id, amps):
         """
-        Send a few queued commands to ESP32 each cycle so we don't starve polling.
+        Called from GUI thread to enqueue an on-device current setpoint.
         """
-        from queue import Empty
+        self.commands.submit(gen_id, "set_current", (gen_id, amps), amps == 0)
 
-        for _ in range(max_per_cycle):
-            try:
-                gen_id, direction, duty = self._command_queue.get_nowait()
-            except Empty:
-                break
+    def _run_stream(self):
+        while self._running:
             try:
-                self.client.set_generator(gen_id, direction, duty)
+                samples = self.client.stream()
+                for seq, ts_ms, generators in samples:
+                    if self.last_seq is not None and seq > self.last_seq + 1:
+                        self.dropped += seq - self.last_seq - 1
+                    self.last_seq = seq
+                    self.signals.state.emit(generators)
+                    self.signals.sample.emit((time.time(), seq, ts_ms, generators))
+                    if not self._running:
+                        break
+                samples.close()
             except Exception as e:
-                self.signals.error.emit(f"Control error: {e}")
+                self.signals.error.emit(str(e))
+                time.sleep(self.interval)  # back off, then reconnect
 
     @Slot()
     def run(self):
+        self.commands.start()
+        if self.stream:
+            self._run_stream()
+            return
+
         while self._running:
-            # 1) Poll state
             try:
                 generators = self.client.get_state()
                 self.signals.state.emit(generators)
+                self.signals.sample.emit((time.time(), -1, -1, generators))
             except Exception as e:
                 self.signals.error.emit(str(e))
 
-            # 2) Process some pending control commands
-            self._process_commands()
-
             time.sleep(self.interval)
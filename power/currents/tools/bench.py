@@ -0,0 +1,287 @@
+"""
+Benchmark of the board's HTTP API through the host client (ESP32Client),
+against a real board (--host) or the emulator (--local, in a subprocess so
+it does not share the benchmark's GIL).
+
+Scenarios, each for --duration seconds:
+
+    poll     --clients threads calling get_state() back to back
+    stream   one /api/stream subscriber while --clients threads poll
+    control  one thread sending duty commands back to back while a stream
+             subscriber times how long each takes to show up in telemetry
+
+Reported per scenario: requests/s, p50/p99 latency, telemetry freshness
+(age of the sample when it reaches the host) and the sampler loop timing.
+Freshness needs the board's clock: its offset is estimated from /api/state
+replies ("now") with the shortest round trip, NTP style.
+
+    python tools/bench.py --local
+    python tools/bench.py --host 192.168.8.48 --scenario poll --clients 2 --json poll.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gui"))
+
+from esp32_client import ESP32Client  # noqa: E402
+from http_load import percentile  # noqa: E402
+
+SCENARIOS = ("poll", "stream", "control")
+
+
+def summary(values_ms):
+    vals = sorted(values_ms)
+    return {
+        "n": len(vals),
+        "p50_ms": percentile(vals, 50),
+        "p99_ms": percentile(vals, 99),
+        "max_ms": vals[-1] if vals else float("nan"),
+    }
+
+
+def clock_offset(client, n=20):
+    """host ms - board ticks_ms, from the quickest of n /api/state round trips."""
+    best = None
+    for _ in range(n):
+        t0 = time.monotonic()
+        now = client.get_snapshot()["now"]
+        t1 = time.monotonic()
+        if best is None or t1 - t0 < best[0]:
+            best = (t1 - t0, (t0 + t1) / 2 * 1000.0 - now)
+    return best[1]
+
+
+# ====================================
+# LOAD THREADS
+# ====================================
+
+
+def _poller(host, port, stop, lat, ages):
+    client = ESP32Client(host, port, timeout=5.0)
+    try:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            snap = client.get_snapshot()
+            rtt = time.perf_counter() - t0
+            lat.append(rtt * 1000.0)
+            if snap["seq"]:  # no sample published yet otherwise
+                # age on the board at reply time, plus the way back
+                ages.append(snap["now"] - snap["ts"] + rtt * 500.0)
+    finally:
+        client.close()
+
+
+def _start_pollers(host, port, n, stop):
+    lat, ages = [], []
+    threads = [
+        threading.Thread(target=_poller, args=(host, port, stop, lat, ages), daemon=True)
+        for _ in range(n)
+    ]
+    for t in threads:
+        t.start()
+    return threads, lat, ages
+
+
+def _subscriber(client, offset, stop, out, on_sample=None):
+    """Read /api/stream until stop; out gets freshness (ms), sample count and lost samples."""
+    samples = client.stream()
+    last = None
+    try:
+        for seq, ts_ms, generators in samples:
+            out["freshness"].append(time.monotonic() * 1000.0 - offset - ts_ms)
+            if last is not None and seq > last + 1:
+                out["lost"] += seq - last - 1
+            last = seq
+            out["samples"] += 1
+            if on_sample is not None:
+                on_sample(generators)
+            if stop.is_set():
+                break
+    finally:
+        samples.close()
+
+
+# ====================================
+# SCENARIOS
+# ====================================
+
+
+def run_poll(host, port, clients, duration):
+    stop = threading.Event()
+    t0 = time.perf_counter()
+    threads, lat, ages = _start_pollers(host, port, clients, stop)
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return {"rps": len(lat) / wall, "latency": summary(lat), "freshness": summary(ages)}
+
+
+def run_stream(host, port, clients, duration):
+    client = ESP32Client(host, port, timeout=5.0)
+    offset = clock_offset(client)
+    stop = threading.Event()
+    out = {"freshness": [], "samples": 0, "lost": 0}
+    reader = threading.Thread(target=_subscriber, args=(client, offset, stop, out), daemon=True)
+    t0 = time.perf_counter()
+    reader.start()
+    threads, lat, _ages = _start_pollers(host, port, clients, stop)
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    reader.join(5.0)
+    wall = time.perf_counter() - t0
+    client.close()
+    return {
+        "rps": len(lat) / wall,
+        "latency": summary(lat),
+        "samples_per_s": out["samples"] / wall,
+        "lost": out["lost"],
+        "freshness": summary(out["freshness"]),
+    }
+
+
+def run_control(host, port, clients, duration, gen_id=1):
+    client = ESP32Client(host, port, timeout=5.0)
+    offset = clock_offset(client)
+    sent = {}  # duty -> time.monotonic() it was sent
+    applied = []  # command -> telemetry, ms
+    lock = threading.Lock()
+
+    def on_sample(generators):
+        duty = generators[gen_id - 1]["duty"]
+        with lock:
+            t = sent.pop(duty, None)
+        if t is not None:
+            applied.append((time.monotonic() - t) * 1000.0)
+
+    stop = threading.Event()
+    out = {"freshness": [], "samples": 0, "lost": 0}
+    reader = threading.Thread(
+        target=_subscriber, args=(client, offset, stop, out, on_sample), daemon=True
+    )
+    t0 = time.perf_counter()
+    reader.start()
+    time.sleep(0.2)
+
+    lat = []
+    k = 0
+    sending = time.perf_counter()
+    end = sending + duration
+    while time.perf_counter() < end:
+        duty = 10000 + (k % 2000) * 10  # distinct, so telemetry can be matched
+        k += 1
+        with lock:
+            sent[duty] = time.monotonic()
+        t1 = time.perf_counter()
+        client.set_generator(gen_id, "fwd", duty)
+        lat.append((time.perf_counter() - t1) * 1000.0)
+    sent_s = time.perf_counter() - sending
+    client.set_generator(gen_id, "stop", 0)
+    stop.set()
+    reader.join(5.0)
+    wall = time.perf_counter() - t0
+    client.close()
+    return {
+        "rps": len(lat) / sent_s,
+        "latency": summary(lat),
+        "samples_per_s": out["samples"] / wall,
+        "lost": out["lost"],
+        "freshness": summary(out["freshness"]),
+        "applied": summary(applied),
+    }
+
+
+RUNNERS = {"poll": run_poll, "stream": run_stream, "control": run_control}
+
+
+# ====================================
+# MAIN
+# ====================================
+
+
+def start_emulator():
+    """Emulator in a subprocess on a free port; returns (process, port)."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emulator.py")
+    proc = subprocess.Popen(
+        [sys.executable, "-u", script, "--port", "0"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    for line in proc.stdout:
+        if line.startswith("Emulated board at"):
+            port = int(line.rsplit(":", 1)[1])
+            # keep draining its output so it never blocks on a full pipe
+            threading.Thread(target=proc.stdout.read, daemon=True).start()
+            return proc, port
+    raise RuntimeError("emulator did not start")
+
+
+def _fmt(s):
+    return "p50 {p50_ms:.2f} / p99 {p99_ms:.2f} / max {max_ms:.2f} ms".format(**s)
+
+
+def report(name, res, timing):
+    print(f"{name}:  {res['rps']:.1f} req/s  latency {_fmt(res['latency'])}")
+    if "samples_per_s" in res:
+        print(f"  stream {res['samples_per_s']:.1f} samples/s  lost {res['lost']}")
+    print(f"  freshness {_fmt(res['freshness'])}")
+    if "applied" in res:
+        print(f"  command -> telemetry {_fmt(res['applied'])}")
+    print(
+        "  sampler {rate_hz} Hz: period mean {period_mean_us:.0f} / max {period_max_us} us  "
+        "exec max {exec_max_us} us  overruns {overruns}".format(**timing)
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Polling/streaming/control benchmark")
+    ap.add_argument("--host", default=None)
+    ap.add_argument("--port", type=int, default=80)
+    ap.add_argument("--local", action="store_true", help="benchmark the emulator")
+    ap.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    ap.add_argument("--clients", type=int, default=2, help="polling threads")
+    ap.add_argument("--duration", type=float, default=5.0, help="seconds per scenario")
+    ap.add_argument("--json", default=None, help="also write the results here")
+    args = ap.parse_args()
+
+    proc = None
+    if args.local:
+        proc, port = start_emulator()
+        host = "127.0.0.1"
+    elif args.host:
+        host, port = args.host, args.port
+    else:
+        ap.error("give --host or --local")
+
+    results = {}
+    try:
+        admin = ESP32Client(host, port, timeout=5.0)
+        for name in SCENARIOS if args.scenario == "all" else (args.scenario,):
+            admin.get_regulator(reset=True)
+            res = RUNNERS[name](host, port, args.clients, args.duration)
+            res["sampler"] = admin.get_regulator()["timing"]
+            report(name, res, res["sampler"])
+            results[name] = res
+        admin.close()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(5)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+Current-supply board emulator: the real ESP32/hardware.py, http_server.py
+and main.py running under CPython.
+
+The MicroPython-only modules are replaced by host stand-ins:
+
+    machine   Pin/PWM record the drive state, SoftI2C talks to an emulated
+              INA219 register file, Timer runs its callback from a thread
+    uasyncio  asyncio plus ThreadSafeFlag
+    network   a WLAN that is always connected to 127.0.0.1
+    ujson     json
+
+Each generator drives an RL coil: the H-bridge applies +-duty/65535 of the
+supply voltage and the coil current follows L di/dt = V - R i, integrated
+exactly between reads. The INA219 latches a new conversion every
+conversion time of its configured ADC mode, with a little noise, so the
+firmware's CNVR polling, regulators and telemetry see realistic data.
+
+The HTTP server listens on real loopback sockets: the firmware only uses
+asyncio streams, which run unchanged on CPython.
+
+    python tools/emulator.py --port 8080      # then connect the GUI to 127.0.0.1:8080
+
+    emu = Emulator().start()
+    client = ESP32Client("127.0.0.1", emu.port)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+ESP32_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ESP32")
+
+INA219_ADDR = 0x40
+
+# INA219 BADC/SADC code -> conversion time (us), as in the datasheet
+ADC_CONVERSION_US = {
+    0b0000: 84, 0b0001: 148, 0b0010: 276, 0b0011: 532,
+    0b1000: 532, 0b1001: 1060, 0b1010: 2130, 0b1011: 4260,
+    0b1100: 8510, 0b1101: 17020, 0b1110: 34050, 0b1111: 68100,
+}
+
+
+# ====================================
+# LOAD MODEL
+# ====================================
+
+
+class Coil:
+    """
+    RL load behind an L298-style H-bridge. The bridge state is read from
+    the emulated pins whenever the current is asked for.
+    """
+
+    def __init__(self, resistance=6.0, inductance=0.03, supply_v=12.0):
+        self.r = resistance
+        self.l = inductance
+        self.supply_v = supply_v
+        self.i = 0.0  # signed amps
+        self.en = self.in1 = self.in2 = None  # emulated PWM/Pin, set by Emulator.start()
+        self._t = time.perf_counter()
+
+    def drive_v(self):
+        if self.en is None:
+            return 0.0
+        direction = self.in1.value() - self.in2.value()
+        return direction * self.supply_v * self.en.duty_u16() / 65535.0
+
+    def current(self):
+        """Advance to now with the exact step response and return the current."""
+        now = time.perf_counter()
+        dt = now - self._t
+        self._t = now
+        target = self.drive_v() / self.r
+        self.i = target + (self.i - target) * math.exp(-dt * self.r / self.l)
+        return self.i
+
+
+class INA219Model:
+    """Register-level INA219: config, calibration, CNVR, power-register clear."""
+
+    def __init__(self, coil, shunt_ohms=0.1, noise_a=0.0005):
+        self.coil = coil
+        self.shunt = shunt_ohms
+        self.noise_a = noise_a
+        self.regs = {0x00: 0x399F, 0x01: 0, 0x02: 0, 0x03: 0, 0x04: 0, 0x05: 0}
+        self._next_conv = time.perf_counter()
+        self._ready = False
+
+    def conversion_s(self):
+        cfg = self.regs[0x00]
+        badc, sadc = (cfg >> 7) & 0xF, (cfg >> 3) & 0xF
+        return (ADC_CONVERSION_US[badc] + ADC_CONVERSION_US[sadc]) / 1e6
+
+    def _convert(self):
+        now = time.perf_counter()
+        if now < self._next_conv:
+            return
+        self._next_conv = now + self.conversion_s()
+        i = self.coil.current() + random.gauss(0.0, self.noise_a)
+        cal = self.regs[0x05]
+        shunt_v = i * self.shunt
+        self.regs[0x01] = _u16(round(shunt_v / 10e-6))
+        bus_v = max(0.0, self.coil.supply_v - abs(shunt_v))
+        raw_i = round(shunt_v * cal / 0.04096) if cal else 0
+        ovf = not -32768 <= raw_i <= 32767
+        self.regs[0x04] = _u16(raw_i)
+        bus_raw = int(bus_v / 0.004)
+        self.regs[0x03] = min(0xFFFF, abs(raw_i) * bus_raw // 5000)
+        self.regs[0x02] = (bus_raw << 3) | (0x01 if ovf else 0)
+        self._ready = True
+
+    def read(self, reg):
+        if reg == 0x02:
+            self._convert()
+            return self.regs[0x02] | (0x02 if self._ready else 0)
+        if reg == 0x03:
+            self._ready = False
+        return self.regs.get(reg, 0)
+
+    def write(self, reg, value):
+        self.regs[reg] = value & 0xFFFF
+        if reg == 0x00:
+            self._ready = False
+            self._next_conv = time.perf_counter() + self.conversion_s()
+
+
+def _u16(v):
+    return max(-32768, min(32767, int(v))) & 0xFFFF
+
+
+# ====================================
+# machine / uasyncio / network STAND-INS
+# ====================================
+
+# pin number -> Pin or PWM, and SCL pin -> INA219Model, for the board in use
+_pins = {}
+_i2c_devices = {}
+
+
+def _machine_module():
+    machine = types.ModuleType("machine")
+
+    class Pin:
+        OUT = 1
+        IN = 0
+
+        def __init__(self, pin, mode=None, *args, **kwargs):
+            self.id = pin
+            self._v = 0
+            if mode is not None:
+                _pins[pin] = self
+
+        def value(self, v=None):
+            if v is None:
+                return self._v
+            self._v = 1 if v else 0
+
+    class PWM:
+        def __init__(self, pin, freq=0, duty_u16=0):
+            self.id = pin.id
+            self._duty = duty_u16
+            _pins[pin.id] = self
+
+        def duty_u16(self, d=None):
+            if d is None:
+                return self._duty
+            self._duty = int(d)
+
+        def deinit(self):
+            self._duty = 0
+
+    class SoftI2C:
+        def __init__(self, scl, sda, freq=400000, **kwargs):
+            self.device = _i2c_devices.get(scl.id)
+
+        def scan(self):
+            return [INA219_ADDR] if self.device is not None else []
+
+        def _dev(self, addr):
+            if self.device is None or addr != INA219_ADDR:
+                raise OSError(19, "ENODEV")
+            return self.device
+
+        def readfrom_mem_into(self, addr, reg, buf):
+            value = self._dev(addr).read(reg)
+            buf[0] = value >> 8
+            buf[1] = value & 0xFF
+
+        def readfrom_mem(self, addr, reg, n):
+            buf = bytearray(n)
+            self.readfrom_mem_into(addr, reg, buf)
+            return bytes(buf)
+
+        def writeto_mem(self, addr, reg, buf):
+            self._dev(addr).write(reg, (buf[0] << 8) | buf[1])
+
+    class Timer:
+        PERIODIC = 1
+        ONE_SHOT = 0
+
+        def __init__(self, *args):
+            self._stop = None
+
+        def init(self, freq=1, mode=PERIODIC, callback=None, period=None):
+            self.deinit()
+            period_s = period / 1000.0 if period else 1.0 / freq
+            stop = self._stop = threading.Event()
+
+            def run():
+                deadline = time.perf_counter()
+                while not stop.is_set():
+                    deadline += period_s
+                    delay = deadline - time.perf_counter()
+                    if delay > 0:
+                        stop.wait(delay)
+                    if stop.is_set():
+                        break
+                    callback(self)
+                    if mode != Timer.PERIODIC:
+                        break
+
+            threading.Thread(target=run, daemon=True).start()
+
+        def deinit(self):
+            if self._stop is not None:
+                self._stop.set()
+                self._stop = None
+
+    machine.Pin, machine.PWM, machine.SoftI2C, machine.Timer = Pin, PWM, SoftI2C, Timer
+    return machine
+
+
+def _uasyncio_module():
+    uasyncio = types.ModuleType("uasyncio")
+    uasyncio.__dict__.update({k: getattr(asyncio, k) for k in dir(asyncio) if not k.startswith("_")})
+
+    class ThreadSafeFlag:
+        """uasyncio.ThreadSafeFlag: set() from any thread, wait() on the loop."""
+
+        def __init__(self):
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+
+        def set(self):
+            self._loop.call_soon_threadsafe(self._event.set)
+
+        async def wait(self):
+            await self._event.wait()
+            self._event.clear()
+
+    uasyncio.ThreadSafeFlag = ThreadSafeFlag
+    return uasyncio
+
+
+def _network_module():
+    network = types.ModuleType("network")
+
+    class WLAN:
+        def __init__(self, interface=0):
+            pass
+
+        def active(self, on=None):
+            return True
+
+        def connect(self, ssid, password):
+            pass
+
+        def isconnected(self):
+            return True
+
+        def ifconfig(self):
+            return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    network.WLAN, network.STA_IF = WLAN, 0
+    return network
+
+
+def install_host_modules():
+    """Install the stand-ins (once) so the firmware imports on CPython."""
+    sys.modules.setdefault("machine", _machine_module())
+    sys.modules.setdefault("uasyncio", _uasyncio_module())
+    sys.modules.setdefault("network", _network_module())
+    sys.modules.setdefault("ujson", json)
+
+    # MicroPython's time extensions
+    if not hasattr(time, "ticks_ms"):
+        time.ticks_ms = lambda: time.monotonic_ns() // 1000000
+        time.ticks_us = lambda: time.monotonic_ns() // 1000
+        time.ticks_add = lambda t, delta: t + delta
+        time.ticks_diff = lambda a, b: a - b
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+        time.sleep_us = lambda us: time.sleep(us / 1e6)
+    if ESP32_DIR not in sys.path:
+        sys.path.insert(0, os.path.abspath(ESP32_DIR))
+
+
+# ====================================
+# BOARD
+# ====================================
+
+
+class Emulator:
+    """
+    One emulated board. The firmware modules are process-wide, so only one
+    Emulator can run per process.
+
+    coils: a Coil (or None for a generator without a sensor) per generator;
+    default one Coil() each.
+    """
+
+    def __init__(self, coils=None, host="127.0.0.1", port=0, sampler=True, i2c_freq=400000):
+        install_host_modules()
+        import hardware
+
+        self.hardware = hardware
+        n = len(hardware.GENERATOR_PINS)
+        self.coils = list(coils) if coils is not None else [Coil() for _ in range(n)]
+        self.host = host
+        self.port = port
+        self.sampler = sampler
+        self.i2c_freq = i2c_freq
+        self.loop = None
+        self._thread = None
+        self._server = None
+
+    def start(self):
+        hw = self.hardware
+        _i2c_devices.clear()
+        for pins, coil in zip(hw.GENERATOR_PINS, self.coils):
+            if coil is not None:
+                _i2c_devices[pins["scl"]] = INA219Model(coil, hw.SHUNT_RESISTOR_OHMS)
+        hw.setup_hardware(i2c_freq=self.i2c_freq)
+        for pins, coil in zip(hw.GENERATOR_PINS, self.coils):
+            if coil is not None:
+                coil.en, coil.in1, coil.in2 = _pins[pins["en"]], _pins[pins["in1"]], _pins[pins["in2"]]
+
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        if not ready.wait(5):
+            raise RuntimeError("emulated HTTP server did not start")
+        return self
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+        ready.set()
+        self.loop.run_forever()
+
+    async def _serve(self):
+        # main.run(), minus WiFi and with our host/port
+        import http_server
+        import main
+        import uasyncio
+
+        self._server = await http_server.start_http_server(self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.sampler:
+            flag = uasyncio.ThreadSafeFlag()
+            self.hardware.start_sampler(on_sample=flag.set)
+            asyncio.ensure_future(main.sample_relay(flag))
+
+    def stop(self):
+        hw = self.hardware
+        hw.sequencer.stop()
+        hw.stop_sampler()
+        hw.stop_all_generators()
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(5)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(5)
+            self.loop.close()
+            self.loop = None
+
+    async def _shutdown(self):
+        # cancelled client tasks make asyncio.streams log an error each
+        self.loop.set_exception_handler(lambda loop, context: None)
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run an emulated current-supply board")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--ohms", type=float, default=6.0, help="coil resistance")
+    ap.add_argument("--mh", type=float, default=30.0, help="coil inductance, mH")
+    ap.add_argument("--supply", type=float, default=12.0, help="bridge supply, V")
+    ap.add_argument("--no-sensor", type=int, action="append", default=[],
+                    help="generator id without an INA219 (repeatable)")
+    args = ap.parse_args()
+
+    install_host_modules()
+    import hardware
+
+    coils = [
+        None if idx + 1 in args.no_sensor else Coil(args.ohms, args.mh / 1000.0, args.supply)
+        for idx in range(len(hardware.GENERATOR_PINS))
+    ]
+    emu = Emulator(coils, args.host, args.port).start()
+    print("Emulated board at", emu.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emu.stop()
+
+
+if __name__ == "__main__":
+    main()
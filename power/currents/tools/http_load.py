@@ -0,0 +1,138 @@
+"""
+HTTP load test for the current-supply firmware.
+
+Runs N concurrent clients against either a real board (--host) or the
+firmware's http_server.py running under CPython (--local), and reports
+requests/s and latency percentiles. With --timing it also reports the
+sampler loop period from /api/regulator measured during the run.
+
+    python tools/http_load.py --local --clients 4 --requests 500 --timing
+    python tools/http_load.py --host 192.168.8.48 --path /api/state --no-keepalive
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from emulator import Emulator
+
+
+# ====================================
+# LOCAL (CPython) SERVER
+# ====================================
+
+
+def start_local_server(sampler=True):
+    """
+    Start an emulated board (tools/emulator.py) on 127.0.0.1, with the
+    firmware's sampler thread unless sampler=False; returns the port.
+    """
+    return Emulator(sampler=sampler).start().port
+
+
+# ====================================
+# LOAD GENERATOR
+# ====================================
+
+
+def _client(host, port, path, n, keep_alive, out):
+    lat = []
+    conn = None
+    headers = {} if keep_alive else {"Connection": "close"}
+    for _ in range(n):
+        t0 = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+        conn.request("GET", path, headers=headers)
+        r = conn.getresponse()
+        r.read()
+        lat.append(time.perf_counter() - t0)
+        if not keep_alive or r.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    out.extend(lat)
+
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return float("nan")
+    k = min(len(sorted_vals) - 1, int(round(q / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def run_load(host, port, path="/api/state", clients=4, requests=200, keep_alive=True):
+    results = [[] for _ in range(clients)]
+    threads = [
+        threading.Thread(target=_client, args=(host, port, path, requests, keep_alive, results[i]))
+        for i in range(clients)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    lat = sorted(x for r in results for x in r)
+    return {
+        "requests": len(lat),
+        "rps": len(lat) / wall,
+        "p50_ms": percentile(lat, 50) * 1e3,
+        "p99_ms": percentile(lat, 99) * 1e3,
+        "max_ms": lat[-1] * 1e3 if lat else float("nan"),
+    }
+
+
+def _get_json(host, port, path):
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--host", default=None)
+    ap.add_argument("--port", type=int, default=80)
+    ap.add_argument("--local", action="store_true", help="run the firmware server under CPython")
+    ap.add_argument("--path", default="/api/state")
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--requests", type=int, default=200, help="per client")
+    ap.add_argument("--no-keepalive", action="store_true")
+    ap.add_argument("--timing", action="store_true", help="report sampler period under load")
+    args = ap.parse_args()
+
+    if args.local:
+        host, port = "127.0.0.1", start_local_server()
+    elif args.host:
+        host, port = args.host, args.port
+    else:
+        ap.error("give --host or --local")
+
+    if args.timing:
+        _get_json(host, port, "/api/regulator?reset=1")
+    res = run_load(host, port, args.path, args.clients, args.requests, not args.no_keepalive)
+    timing = _get_json(host, port, "/api/regulator")["timing"] if args.timing else None
+    print(
+        "{path}  clients={c}  keep-alive={ka}\n"
+        "  {requests} requests  {rps:.1f} req/s  p50 {p50_ms:.2f} ms  "
+        "p99 {p99_ms:.2f} ms  max {max_ms:.2f} ms".format(
+            path=args.path, c=args.clients, ka=not args.no_keepalive, **res
+        )
+    )
+    if timing is not None:
+        print(
+            "  sampler {rate_hz} Hz: {ticks} ticks  period min {period_min_us} / "
+            "mean {period_mean_us:.0f} / max {period_max_us} us  "
+            "exec max {exec_max_us} us  overruns {overruns}".format(**timing)
+        )
+
+
+if __name__ == "__main__":
+    main()